@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+数据池内存基准
+
+对比list-of-dict与列式DataPool保存同样记录时的内存占用（tracemalloc统计的Python分配量），
+以及按指令列同步去重索引、随机抽样的耗时。构建过程受tracemalloc影响较慢，不计时。
+
+用法：
+    python benchmarks/bench_data_pool.py --size 1000000
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.dedup import InstructionIndex
+from src.pool import DataPool, get_field
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='数据池内存基准')
+    parser.add_argument('--size', type=int, default=1000000, help='记录数')
+    parser.add_argument('--samples', type=int, default=10000, help='随机抽样次数（每次抽3条）')
+    return parser.parse_args()
+
+
+def make_records(size, rng):
+    for i in range(size):
+        topic = "".join(chr(rng.randint(0x4E00, 0x9FA5)) for _ in range(8))
+        yield {
+            "instruction": f"请写一段关于{topic}的说明，编号{i}",
+            "input": "无",
+            "output": f"这是关于{topic}的一段说明文字，用于测试数据池的内存占用，编号{i}。",
+        }
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    pool = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pool, current / 1024 / 1024
+
+
+def main():
+    args = parse_args()
+    print(f"{args.size} 条记录：")
+    print(f"{'存储':<10} {'内存(MB)':>10} {'索引同步(s)':>11} {'抽样(us/次)':>11}")
+    for name, build in (
+        ("list", lambda: list(make_records(args.size, random.Random(0)))),
+        ("DataPool", lambda: DataPool(make_records(args.size, random.Random(0)))),
+    ):
+        pool, megabytes = measure(build)
+
+        start = time.perf_counter()
+        InstructionIndex("exact").sync(pool)
+        sync_seconds = time.perf_counter() - start
+
+        rng = random.Random(0)
+        start = time.perf_counter()
+        for _ in range(args.samples):
+            [get_field(pool, i, "instruction") for i in rng.sample(range(len(pool)), 3)]
+        sample_us = (time.perf_counter() - start) / args.samples * 1e6
+
+        print(f"{name:<10} {megabytes:>10.1f} {sync_seconds:>11.2f} {sample_us:>11.1f}")
+        del pool
+
+
+if __name__ == "__main__":
+    main()
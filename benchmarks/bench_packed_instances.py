@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+打包实例生成基准
+
+在本地模拟服务上对比每个请求1条指令（当前默认）与每个请求打包K条指令时，
+每条有效实例消耗的token数和耗时。模拟服务的延迟由固定开销、提示词token和生成token组成，
+capacity限制服务端同时处理的请求数。
+
+用法：
+    python benchmarks/bench_packed_instances.py --num_instructions 64 --pack_sizes 1 2 4 8
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_server import MockLLMServer
+from src.config import Config
+from src.filter import DataFilter
+from src.generator import InstanceGenerator
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='打包实例生成基准')
+    parser.add_argument('--num_instructions', type=int, default=64, help='指令数量')
+    parser.add_argument('--pack_sizes', type=int, nargs='+', default=[1, 2, 4, 8], help='每个请求打包的指令数')
+    parser.add_argument('--max_concurrency', type=int, default=8, help='客户端最大并发请求数')
+    parser.add_argument('--capacity', type=int, default=8, help='模拟服务同时处理的请求数')
+    parser.add_argument('--base_latency', type=float, default=0.2, help='模拟服务每个请求的固定开销（秒）')
+    parser.add_argument('--token_latency', type=float, default=0.004, help='模拟服务每个生成token的时间（秒）')
+    parser.add_argument('--drop_rate', type=float, default=0.05, help='打包回复中每条结果被遗漏的概率')
+    return parser.parse_args()
+
+
+def run(server, args, pack_size):
+    config = Config()
+    config.api_key = "mock"
+    config.base_url = server.base_url
+    config.model = "mock"
+    config.max_concurrency = args.max_concurrency
+    config.instances_per_prompt = pack_size
+    generator = InstanceGenerator(config)
+    data_filter = DataFilter(config)
+    instructions = [f"请写一段关于主题{i}的简短说明，不超过三句话" for i in range(args.num_instructions)]
+
+    start = time.perf_counter()
+    instances = generator.generate_batch(instructions)
+    elapsed = time.perf_counter() - start
+    accepted = sum(1 for instance in instances if instance is not None and data_filter.is_valid(instance))
+    usage = generator.llm_client.usage
+    return {
+        "pack_size": pack_size,
+        "requests": usage.requests,
+        "retried": generator.pack_stats["retried"],
+        "accepted": accepted,
+        "seconds": elapsed,
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+    }
+
+
+def main():
+    args = parse_args()
+    with MockLLMServer(base_latency=args.base_latency, token_latency=args.token_latency,
+                       capacity=args.capacity, drop_rate=args.drop_rate) as server:
+        results = [run(server, args, pack_size) for pack_size in args.pack_sizes]
+
+    print(f"{args.num_instructions} 条指令，客户端并发 {args.max_concurrency}，服务端容量 {args.capacity}：")
+    print(f"{'K':>3} {'请求':>6} {'单独重试':>8} {'有效':>6} {'耗时(s)':>8} "
+          f"{'提示词tok/条':>12} {'生成tok/条':>10} {'毫秒/条':>8}")
+    for r in results:
+        accepted = max(r["accepted"], 1)
+        print(f"{r['pack_size']:>3} {r['requests']:>6} {r['retried']:>8} {r['accepted']:>6} {r['seconds']:>8.2f} "
+              f"{r['prompt_tokens'] / accepted:>12.1f} {r['completion_tokens'] / accepted:>10.1f} "
+              f"{r['seconds'] * 1000 / accepted:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+数据集后处理基准
+
+生成含重复、格式错误和应被过滤记录的合成JSONL数据集，分别用不同进程数运行
+python main.py postprocess，报告吞吐和峰值内存。每次运行在独立子进程中进行，
+峰值内存为主进程与worker进程中的最大值。输入规模翻倍时峰值内存应基本不变。
+
+用法：
+    python benchmarks/bench_postprocess.py --records 1000000 --workers 1 4
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='数据集后处理基准')
+    parser.add_argument('--records', type=int, default=200000, help='合成数据集的记录数')
+    parser.add_argument('--duplicate_rate', type=float, default=0.3, help='与之前某条指令重复的比例')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1], help='要比较的进程数')
+    parser.add_argument('--work_dir', type=str, default=None, help='存放合成数据和输出的目录')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    return parser.parse_args()
+
+
+def make_dataset(path, num_records, duplicate_rate, seed):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(num_records):
+            topic = rng.randrange(i) if i and rng.random() < duplicate_rate else i
+            record = {
+                "instruction": f"请说明主题{topic}的主要特点，并举一个例子",
+                "input": "",
+                "output": f"主题{topic}的特点包括：" + "、".join(f"要点{rng.randrange(1000)}" for _ in range(rng.randint(3, 30))),
+            }
+            if rng.random() < 0.02:
+                record["output"] = "抱歉，我无法回答这个问题。"
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if rng.random() < 0.001:
+                f.write("{broken\n")
+
+
+def run(input_path, output_path, workers):
+    """运行一次后处理，返回(耗时, 峰值内存MB)，峰值内存取自命令输出"""
+    command = [sys.executable, "main.py", "postprocess", input_path, "--output", output_path,
+               "--workers", str(workers)]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True)
+    seconds = time.perf_counter() - start
+    match = re.search(r"峰值内存 (\d+) MB", result.stdout)
+    return seconds, int(match.group(1)) if match else None
+
+
+def main():
+    args = parse_args()
+    work_dir = tempfile.mkdtemp(prefix="bench_postprocess_", dir=args.work_dir)
+    input_path = os.path.join(work_dir, "input.jsonl")
+    make_dataset(input_path, args.records, args.duplicate_rate, args.seed)
+    size_mb = os.path.getsize(input_path) / (1 << 20)
+    print(f"{args.records} 条记录，{size_mb:.0f} MB，重复比例 {args.duplicate_rate}，CPU核数 {os.cpu_count()}：")
+    print(f"{'进程数':>6} {'耗时(s)':>8} {'条/秒':>9} {'MB/秒':>7} {'峰值内存(MB)':>12}")
+    for workers in args.workers:
+        output_path = os.path.join(work_dir, f"output_{workers}.jsonl")
+        seconds, peak = run(input_path, output_path, workers)
+        peak_text = str(peak) if peak is not None else "-"
+        print(f"{workers:>6} {seconds:>8.2f} {args.records / seconds:>9.0f} {size_mb / seconds:>7.1f} {peak_text:>12}")
+        os.remove(output_path)
+    os.remove(input_path)
+    os.rmdir(work_dir)
+
+
+if __name__ == "__main__":
+    main()
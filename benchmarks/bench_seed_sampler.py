@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+种子采样器基准
+
+用模拟服务的示例模仿模式模拟模型围绕示例打转的情况：每条新指令多数是提示词中某个示例主题的
+--variants种变体之一，少数（--novelty）是全新主题。示例越集中于数据池中已经很多的主题，
+生成的指令越容易与已有指令重复。
+对比uniform与diversity两种种子采样方式在多轮迭代中每次LLM请求得到的去重后指令数。
+
+用法：
+    python benchmarks/bench_seed_sampler.py --rounds 10 --num_per_round 100
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from benchmarks.mock_server import MockLLMServer
+from src.config import Config
+from src.generator import InstructionGenerator
+from src.pool import DataPool
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='种子采样器基准')
+    parser.add_argument('--rounds', type=int, default=10, help='迭代轮数')
+    parser.add_argument('--num_per_round', type=int, default=100, help='每轮生成的指令数')
+    parser.add_argument('--variants', type=int, default=100, help='每个主题可产生的不同变体数')
+    parser.add_argument('--novelty', type=float, default=0.05, help='每条指令为全新主题的概率')
+    parser.add_argument('--clusters', type=int, default=32, help='diversity采样的簇数')
+    parser.add_argument('--dedup_mode', type=str, default='exact', choices=['exact', 'minhash'], help='指令去重模式')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    return parser.parse_args()
+
+
+def run(sampler, base_url, args):
+    config = Config()
+    config.api_key = "mock"
+    config.base_url = base_url
+    config.model = "mock"
+    config.cache_enabled = False
+    # 串行请求，请求数不含达到目标后被丢弃的并发请求
+    config.max_concurrency = 1
+    config.dedup_mode = args.dedup_mode
+    config.seed_sampler = sampler
+    config.seed_clusters = args.clusters
+    # 放宽请求预算，让产出率而不是预算决定请求数
+    config.max_instruction_requests = args.num_per_round * 2
+
+    with open(os.path.join(ROOT_DIR, "data", "seed_instructions.json"), "r", encoding="utf-8") as f:
+        pool = DataPool(json.load(f))
+    generator = InstructionGenerator(config)
+    random.seed(args.seed)
+
+    rows = []
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        accepted = generator.generate(pool, num_to_generate=args.num_per_round)
+        seconds = time.perf_counter() - start
+        stats = generator.last_stats
+        rows.append((len(pool), stats["requests"], len(accepted), stats["yield_per_request"], seconds))
+        pool.extend({"instruction": text, "input": "", "output": ""} for text in accepted)
+    return rows
+
+
+def main():
+    args = parse_args()
+    results = {}
+    for sampler in ("uniform", "diversity"):
+        with MockLLMServer(base_latency=0, prompt_token_latency=0, token_latency=0,
+                           seed=args.seed, instruction_variants=args.variants,
+                           instruction_novelty=args.novelty) as server:
+            results[sampler] = run(sampler, server.base_url, args)
+
+    print(f"每轮目标 {args.num_per_round} 条，每个主题 {args.variants} 种变体，新主题概率 {args.novelty}，去重模式 {args.dedup_mode}：")
+    print(f"{'轮次':>4} {'池大小':>7} | {'uniform 请求':>12} {'接受':>6} {'条/请求':>8} | "
+          f"{'diversity 请求':>14} {'接受':>6} {'条/请求':>8}")
+    for i, (u, d) in enumerate(zip(results["uniform"], results["diversity"])):
+        print(f"{i + 1:>4} {u[0]:>7} | {u[1]:>12} {u[2]:>6} {u[3]:>8.2f} | "
+              f"{d[1]:>14} {d[2]:>6} {d[3]:>8.2f}")
+    for sampler, rows in results.items():
+        requests = sum(row[1] for row in rows)
+        accepted = sum(row[2] for row in rows)
+        seconds = sum(row[4] for row in rows)
+        print(f"{sampler}: 共 {requests} 次请求，接受 {accepted} 条，平均每次请求 {accepted / max(requests, 1):.2f} 条，"
+              f"耗时 {seconds:.1f} 秒")
+
+
+if __name__ == "__main__":
+    main()
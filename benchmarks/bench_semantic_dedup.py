@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+语义去重性能基准
+
+对比旧版逐条计算相似度的实现与EmbeddingIndex批量检索的耗时。
+默认使用随机生成的归一化向量模拟嵌入（不依赖模型下载），
+加上 --encode 参数时使用真实的嵌入模型编码合成指令文本。
+
+用法：
+    python benchmarks/bench_semantic_dedup.py --pool_size 100000 --new_size 100
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.embedding import EmbeddingIndex
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='语义去重性能基准')
+    parser.add_argument('--pool_size', type=int, default=100000, help='数据池大小')
+    parser.add_argument('--new_size', type=int, default=100, help='每轮新数据数量')
+    parser.add_argument('--iterations', type=int, default=5, help='迭代轮数')
+    parser.add_argument('--dim', type=int, default=384, help='模拟向量维度')
+    parser.add_argument('--threshold', type=float, default=0.8, help='相似度阈值')
+    parser.add_argument('--encode', action='store_true', help='使用真实嵌入模型编码合成文本')
+    parser.add_argument('--skip_baseline', action='store_true', help='跳过旧版实现')
+    return parser.parse_args()
+
+
+def random_embeddings(n, dim, rng):
+    return rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def baseline_filter(new_embeddings, pool_embeddings, threshold):
+    """旧版实现：逐条计算与整个池的相似度，每次重新计算池向量范数，不做批内去重"""
+    keep = []
+    for i in range(len(new_embeddings)):
+        similarities = np.dot(new_embeddings[i], pool_embeddings.T) / \
+                      (np.linalg.norm(new_embeddings[i]) * np.linalg.norm(pool_embeddings, axis=1))
+        keep.append(np.max(similarities) < threshold)
+    return keep
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(0)
+    index = EmbeddingIndex()
+
+    if args.encode:
+        texts = [f"请为主题{i}写一段{i % 7 + 1}句话的说明" for i in range(args.pool_size)]
+        start = time.perf_counter()
+        pool_embeddings = index.encode(texts)
+        print(f"编码 {args.pool_size} 条池数据耗时: {time.perf_counter() - start:.2f} 秒")
+    else:
+        pool_embeddings = random_embeddings(args.pool_size, args.dim, rng)
+
+    start = time.perf_counter()
+    index.add_embeddings(pool_embeddings)
+    print(f"建立索引 ({args.pool_size} 条) 耗时: {time.perf_counter() - start:.3f} 秒")
+
+    baseline_time = 0.0
+    index_time = 0.0
+    baseline_pool = pool_embeddings
+    for _ in range(args.iterations):
+        new_embeddings = random_embeddings(args.new_size, pool_embeddings.shape[1], rng)
+
+        if not args.skip_baseline:
+            start = time.perf_counter()
+            baseline_filter(new_embeddings, baseline_pool, args.threshold)
+            baseline_time += time.perf_counter() - start
+            baseline_pool = np.vstack([baseline_pool, new_embeddings])
+
+        start = time.perf_counter()
+        keep = index.filter_embeddings(new_embeddings, args.threshold)
+        index.add_embeddings(new_embeddings[keep])
+        index_time += time.perf_counter() - start
+
+    print(f"每轮 {args.new_size} 条新数据，共 {args.iterations} 轮：")
+    if not args.skip_baseline:
+        print(f"  旧版逐条实现: {baseline_time / args.iterations * 1000:.1f} 毫秒/轮")
+    print(f"  EmbeddingIndex: {index_time / args.iterations * 1000:.1f} 毫秒/轮")
+    if not args.skip_baseline and index_time > 0:
+        print(f"  加速比: {baseline_time / index_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+启动开销基准
+
+测量CLI冷启动（python main.py --help的墙钟时间和import main的耗时）以及嵌入模型的开销：
+本进程首次编码（导入torch并加载模型）、模型已加载后的编码，以及通过常驻嵌入服务编码。
+未安装sentence-transformers时跳过嵌入部分。
+
+用法：
+    python benchmarks/bench_startup.py --repeat 5
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='启动开销基准')
+    parser.add_argument('--repeat', type=int, default=5, help='每项测量的重复次数，取中位数')
+    parser.add_argument('--model', type=str, default=None, help='嵌入模型，默认使用配置中的默认模型')
+    parser.add_argument('--texts', type=int, default=100, help='每次编码的文本数')
+    return parser.parse_args()
+
+
+def median_seconds(command, repeat):
+    """在子进程中运行命令repeat次，返回墙钟时间的中位数"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_embedding(model_name, num_texts, repeat):
+    from src.embedding import DEFAULT_EMBEDDING_MODEL, get_embedding_model
+    from src.embedding_service import RemoteEmbeddingModel, serve
+
+    model_name = model_name or DEFAULT_EMBEDDING_MODEL
+    texts = [f"请解释第{i}个概念的含义" for i in range(num_texts)]
+
+    start = time.perf_counter()
+    model = get_embedding_model(model_name)
+    model.encode(texts, show_progress_bar=False)
+    print(f"  本进程首次编码（含加载）: {time.perf_counter() - start:.2f} 秒")
+
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.encode(texts, show_progress_bar=False)
+        warm.append(time.perf_counter() - start)
+    print(f"  本进程模型已加载:         {statistics.median(warm):.3f} 秒")
+
+    # 服务与本进程共享已加载的模型，只测量HTTP往返和序列化开销
+    port = free_port()
+    threading.Thread(target=serve, args=("127.0.0.1", port), daemon=True).start()
+    time.sleep(0.5)
+    remote = RemoteEmbeddingModel(f"http://127.0.0.1:{port}", model_name)
+    remote.encode(texts)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        remote.encode(texts)
+        times.append(time.perf_counter() - start)
+    print(f"  通过嵌入服务:             {statistics.median(times):.3f} 秒")
+
+
+def main():
+    args = parse_args()
+    print(f"CLI启动（{args.repeat}次中位数）：")
+    help_time = median_seconds([sys.executable, "main.py", "--help"], args.repeat)
+    print(f"  python main.py --help: {help_time * 1000:.0f} 毫秒")
+    import_time = median_seconds([sys.executable, "-c", "import main"], args.repeat)
+    bare_time = median_seconds([sys.executable, "-c", "pass"], args.repeat)
+    print(f"  import main:           {(import_time - bare_time) * 1000:.0f} 毫秒（已扣除解释器启动 {bare_time * 1000:.0f} 毫秒）")
+
+    print(f"嵌入模型（{args.texts}条文本）：")
+    try:
+        import sentence_transformers  # noqa: F401
+    except ImportError:
+        print("  未安装sentence-transformers，跳过")
+        return
+    bench_embedding(args.model, args.texts, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+流式生成提前中止基准
+
+在本地模拟服务上按--refusal_rate注入以道歉开头的长回复，对比非流式与流式（stream_responses）
+生成实例时服务端实际生成的token数、总耗时、每条有效实例的耗时，以及第一条有效实例出现的时间。
+流式模式下部分输出一旦被apology等规则断定拒绝就关闭连接，服务端停止生成。
+
+用法：
+    python benchmarks/bench_streaming.py --num_instructions 200 --refusal_rate 0.2
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_server import MockLLMServer
+from src.config import Config
+from src.filter import DataFilter
+from src.generator import InstanceGenerator
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='流式生成提前中止基准')
+    parser.add_argument('--num_instructions', type=int, default=200, help='指令数量')
+    parser.add_argument('--refusal_rate', type=float, default=0.2, help='返回道歉长回复的比例')
+    parser.add_argument('--max_concurrency', type=int, default=8, help='客户端最大并发请求数')
+    parser.add_argument('--capacity', type=int, default=8, help='模拟服务同时处理的请求数')
+    parser.add_argument('--base_latency', type=float, default=0.2, help='模拟服务每个请求的固定开销（秒）')
+    parser.add_argument('--token_latency', type=float, default=0.01, help='模拟服务每个生成token的时间（秒）')
+    parser.add_argument('--response_format', type=str, default='text', choices=['text', 'json'], help='回复格式')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    return parser.parse_args()
+
+
+def run(args, stream):
+    with MockLLMServer(base_latency=args.base_latency, token_latency=args.token_latency, capacity=args.capacity,
+                       refusal_rate=args.refusal_rate, seed=args.seed) as server:
+        config = Config()
+        config.api_key = "mock"
+        config.base_url = server.base_url
+        config.model = "mock"
+        config.max_concurrency = args.max_concurrency
+        config.response_format = args.response_format
+        config.stream_responses = stream
+        data_filter = DataFilter(config)
+        generator = InstanceGenerator(config, data_filter)
+        instructions = [f"请写一段关于主题{i}的简短说明，不超过三句话" for i in range(args.num_instructions)]
+
+        start = time.perf_counter()
+        first_valid = None
+        accepted = 0
+        for _, instance in generator.iter_generate(instructions):
+            if instance is not None and data_filter.is_valid(instance):
+                accepted += 1
+                if first_valid is None:
+                    first_valid = time.perf_counter() - start
+        elapsed = time.perf_counter() - start
+        return {
+            "stream": stream,
+            "accepted": accepted,
+            "rejected": dict(data_filter.rejections),
+            "seconds": elapsed,
+            "first_valid": first_valid or 0.0,
+            "completion_tokens": server.completion_tokens,
+            "cancelled": server.streams_cancelled,
+        }
+
+
+def main():
+    args = parse_args()
+    results = [run(args, stream) for stream in (False, True)]
+
+    print(f"{args.num_instructions} 条指令，道歉回复比例 {args.refusal_rate}，客户端并发 {args.max_concurrency}，"
+          f"服务端容量 {args.capacity}：")
+    print(f"{'模式':<6} {'有效':>5} {'中止':>5} {'服务端生成tok':>13} {'耗时(s)':>8} {'毫秒/有效条':>11} {'首条有效(s)':>11}")
+    for r in results:
+        print(f"{'流式' if r['stream'] else '非流式':<6} {r['accepted']:>5} {r['cancelled']:>5} "
+              f"{r['completion_tokens']:>13} {r['seconds']:>8.2f} "
+              f"{r['seconds'] / max(r['accepted'], 1) * 1000:>11.1f} {r['first_valid']:>11.2f}")
+        print(f"       拒绝: {r['rejected']}")
+
+
+if __name__ == "__main__":
+    main()
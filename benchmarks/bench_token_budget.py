@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+token预算基准
+
+实例生成：模拟服务按--long_output_rate返回约--long_output_tokens个token的长回复，超过请求的
+max_tokens时截断并返回finish_reason为length。对比不同instance_max_tokens和length_retries下
+被截断的回复数、重新生成和最终放弃的次数、得到的完整实例数和服务端生成的token数。
+未检测截断时，被截断的回复会被当作完整实例解析，表中“截断”一列即这类不完整数据的数量。
+
+指令生成：用--num_seed_examples个较长的种子示例和较小的--context_window构建提示词，
+报告提示词token数和被去掉的示例数。
+
+用法：
+    python benchmarks/bench_token_budget.py --num_instructions 200 --long_output_rate 0.2
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from benchmarks.mock_server import MockLLMServer
+from src.config import Config
+from src.generator import InstanceGenerator, InstructionGenerator
+from src.metrics import metrics
+
+# (instance_max_tokens, length_retries)
+SETTINGS = [(256, 0), (256, 1), (1024, 0)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='token预算基准')
+    parser.add_argument('--num_instructions', type=int, default=200, help='实例生成的指令数量')
+    parser.add_argument('--long_output_rate', type=float, default=0.2, help='返回长回复的比例')
+    parser.add_argument('--long_output_tokens', type=int, default=400, help='长回复的大致token数')
+    parser.add_argument('--num_seed_examples', type=int, default=20, help='指令生成提示词的种子示例数')
+    parser.add_argument('--context_window', type=int, default=1024, help='指令生成时的上下文长度')
+    parser.add_argument('--max_concurrency', type=int, default=8, help='客户端最大并发请求数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    return parser.parse_args()
+
+
+def make_config(base_url, **overrides):
+    config = Config()
+    config.api_key = "mock"
+    config.base_url = base_url
+    config.model = "mock"
+    config.cache_enabled = False
+    for key, value in overrides.items():
+        setattr(config, key, value)
+    return config
+
+
+def counter(snapshot, name, **labels):
+    key = ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
+    return snapshot["counters"].get(name, {}).get(key, 0)
+
+
+def run_instances(args, max_tokens, retries):
+    with MockLLMServer(base_latency=0.05, token_latency=0.001, seed=args.seed,
+                       long_output_rate=args.long_output_rate, long_output_tokens=args.long_output_tokens) as server:
+        config = make_config(server.base_url, instance_max_tokens=max_tokens, length_retries=retries,
+                             max_concurrency=args.max_concurrency)
+        generator = InstanceGenerator(config)
+        instructions = [f"请写一段关于主题{i}的说明" for i in range(args.num_instructions)]
+        metrics.snapshot()
+        start = time.perf_counter()
+        results = generator.generate_batch(instructions)
+        seconds = time.perf_counter() - start
+        snapshot = metrics.snapshot()
+        return {
+            "truncated": server.truncated,
+            "retried": counter(snapshot, "llm_truncated_total", result="retried"),
+            "failed": counter(snapshot, "llm_truncated_total", result="failed"),
+            "complete": sum(1 for r in results if r is not None),
+            "completion_tokens": server.completion_tokens,
+            "seconds": seconds,
+        }
+
+
+def run_instruction_prompt(args):
+    # 较长的种子指令，使示例数较多时提示词超出上下文
+    seed_data = [{"instruction": f"请阅读下面这段关于主题{i}的材料，总结其中的三个要点、两个反例，"
+                                 f"并提出一个值得进一步研究的问题，回答不超过三百字", "input": "", "output": ""}
+                 for i in range(args.num_seed_examples * 2)]
+    with MockLLMServer(base_latency=0, seed=args.seed) as server:
+        rows = []
+        for context_window in (0, args.context_window):
+            config = make_config(server.base_url, num_seed_examples=args.num_seed_examples,
+                                 context_window=context_window)
+            generator = InstructionGenerator(config)
+            metrics.snapshot()
+            prompt, max_tokens = generator._build_prompt(seed_data, config.instructions_per_prompt)
+            snapshot = metrics.snapshot()
+            trimmed = counter(snapshot, "prompt_examples_trimmed_total", kind="instruction")
+            rows.append((context_window, generator.budget.prompt_tokens(prompt), max_tokens, trimmed))
+        return rows
+
+
+def main():
+    args = parse_args()
+    print(f"实例生成：{args.num_instructions} 条指令，长回复比例 {args.long_output_rate}，"
+          f"长回复约 {args.long_output_tokens} token：")
+    print(f"{'max_tokens':>10} {'重试':>4} {'截断':>5} {'重新生成':>8} {'放弃':>5} {'完整实例':>8} {'服务端生成tok':>13} {'耗时(s)':>8}")
+    for max_tokens, retries in SETTINGS:
+        r = run_instances(args, max_tokens, retries)
+        print(f"{max_tokens:>10} {retries:>4} {r['truncated']:>5} {r['retried']:>8} {r['failed']:>5} "
+              f"{r['complete']:>8} {r['completion_tokens']:>13} {r['seconds']:>8.2f}")
+
+    print(f"指令生成提示词：{args.num_seed_examples} 个种子示例：")
+    print(f"{'上下文长度':>10} {'提示词tok':>9} {'max_tokens':>10} {'去掉示例':>8}")
+    for context_window, prompt_tokens, max_tokens, trimmed in run_instruction_prompt(args):
+        print(f"{context_window or '不限':>10} {prompt_tokens:>9} {max_tokens:>10} {trimmed:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+模拟OpenAI兼容接口的本地服务，用于基准测试
+
+根据提示词返回指令列表、单条输入-输出对或打包的多条结果（JSON），
+并按 固定开销 + 提示词token数 × 单价 + 生成token数 × 单价 模拟延迟，
+固定开销可按指数或对数正态分布抖动。capacity限制同时处理的请求数（模拟推理服务的并发槽位），
+响应中包含usage，支持stream=True的SSE流式回复（客户端断开后停止发送）。
+超过请求max_tokens的回复被截断，finish_reason为length。
+可按比例注入500错误、带Retry-After的429限流响应和以道歉开头的实例回复。
+
+每个请求的随机数由seed和请求序号决定，相同参数下同一序号的请求得到相同的回复、延迟和错误。
+
+用法：
+    python benchmarks/mock_server.py --port 8000 --base_latency 0.2 --capacity 8 --error_rate 0.01 --rate_limit_rate 0.05
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.ratelimit import estimate_tokens
+
+_PACK_ITEM_RE = re.compile(r"^\[(\d+)\] (.+)$", re.MULTILINE)
+_NUM_INSTRUCTIONS_RE = re.compile(r"生成(\d+)条")
+_SEED_EXAMPLE_RE = re.compile(r"^- (.+)$", re.MULTILINE)
+_VARIANT_SUFFIX_RE = re.compile(r"（角度\d+）$")
+LATENCY_DISTRIBUTIONS = ("fixed", "exponential", "lognormal")
+# 流式回复每块的字符数
+STREAM_CHUNK_CHARS = 2
+
+
+class MockLLMServer:
+    """在后台线程中运行的模拟LLM服务"""
+
+    def __init__(self, host="127.0.0.1", port=0, base_latency=0.2, prompt_token_latency=0.0002,
+                 token_latency=0.004, capacity=0, drop_rate=0.0, seed=0, latency_distribution="fixed",
+                 latency_sigma=0.5, error_rate=0.0, rate_limit_rate=0.0, retry_after=0.1, output_format="auto",
+                 instruction_variants=0, instruction_novelty=0.2, refusal_rate=0.0, long_output_rate=0.0,
+                 long_output_tokens=600):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口，0表示自动分配
+            base_latency: 每个请求的固定开销（秒），抖动时为其均值
+            prompt_token_latency: 每个提示词token的处理时间（秒）
+            token_latency: 每个生成token的时间（秒）
+            capacity: 同时处理的最大请求数，0表示不限制
+            drop_rate: 打包请求中每条结果被遗漏的概率（用于测试单条重试）
+            seed: 随机种子
+            latency_distribution: 固定开销的分布，fixed、exponential或lognormal
+            latency_sigma: lognormal分布的sigma（越大长尾越明显）
+            error_rate: 返回500错误的请求比例
+            rate_limit_rate: 返回429限流的请求比例
+            retry_after: 429响应中Retry-After头的秒数
+            output_format: 回复格式，auto按请求的response_format决定，text或json强制使用该格式
+            instruction_variants: 0表示生成主题随机的指令；大于0时模仿提示词中的种子示例，
+                每条新指令是某个示例的主题加上instruction_variants种“角度”之一，模拟模型围绕示例打转，
+                同一主题的变体用完后只会产生重复
+            instruction_novelty: 模仿模式下每条指令改为一个全新主题的概率
+            refusal_rate: 单条实例请求返回以道歉开头的长回复的比例（用于测试流式提前中止）
+            long_output_rate: 单条实例请求返回长回复的比例（用于测试max_tokens截断后的重新生成）
+            long_output_tokens: 长回复的大致token数
+        """
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"未知的延迟分布: {latency_distribution}，可选: {', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.base_latency = base_latency
+        self.prompt_token_latency = prompt_token_latency
+        self.token_latency = token_latency
+        self.drop_rate = drop_rate
+        self.seed = seed
+        self.latency_distribution = latency_distribution
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.output_format = output_format
+        self.instruction_variants = instruction_variants
+        self.instruction_novelty = instruction_novelty
+        self.refusal_rate = refusal_rate
+        self.long_output_rate = long_output_rate
+        self.long_output_tokens = long_output_tokens
+        self.slots = threading.Semaphore(capacity) if capacity > 0 else None
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        # 实际发送给客户端的生成token数，流式请求被客户端中止时只计已发送的部分
+        self.completion_tokens = 0
+        self.streams_cancelled = 0
+        # 因达到max_tokens被截断（finish_reason为length）的回复数
+        self.truncated = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _output_for(self, instruction):
+        return f"针对“{instruction[:20]}”的回答：这是一段用于基准测试的模拟输出，长度接近真实的短任务回复。"
+
+    def _topic_for(self, examples, rng):
+        """模仿模式下新指令的主题：多数沿用某个示例的主题，少数为随机汉字组成的新主题"""
+        if rng.random() < self.instruction_novelty:
+            return "".join(chr(rng.randint(0x4E00, 0x9FA5)) for _ in range(8))
+        return _VARIANT_SUFFIX_RE.sub("", rng.choice(examples))
+
+    def next_request(self):
+        """分配请求序号，返回该请求专用的随机数生成器"""
+        with self._lock:
+            self.requests += 1
+            number = self.requests
+        return random.Random(self.seed * 1000003 + number)
+
+    def fault_for(self, rng):
+        """按注入比例决定本次请求是否失败，返回HTTP状态码或None"""
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            with self._lock:
+                self.rate_limited += 1
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            with self._lock:
+                self.errors += 1
+            return 500
+        return None
+
+    def latency_for(self, rng, prompt_tokens, completion_tokens):
+        """本次请求的模拟耗时（秒）"""
+        base = self.base_latency
+        if base > 0 and self.latency_distribution == "exponential":
+            base = rng.expovariate(1 / base)
+        elif base > 0 and self.latency_distribution == "lognormal":
+            # 调整mu使均值等于base_latency
+            base = rng.lognormvariate(math.log(base) - self.latency_sigma ** 2 / 2, self.latency_sigma)
+        return base + prompt_tokens * self.prompt_token_latency + completion_tokens * self.token_latency
+
+    def complete(self, body, rng=None):
+        """根据请求体生成回复文本"""
+        rng = rng or self.next_request()
+        prompt = body["messages"][-1]["content"]
+        if self.output_format == "auto":
+            json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        else:
+            json_mode = self.output_format == "json"
+        if "指令生成器" in prompt:
+            match = _NUM_INSTRUCTIONS_RE.search(prompt)
+            count = int(match.group(1)) if match else 5
+            examples = _SEED_EXAMPLE_RE.findall(prompt)
+            if self.instruction_variants and examples:
+                items = [f"{self._topic_for(examples, rng)}（角度{rng.randrange(self.instruction_variants)}）"
+                         for _ in range(count)]
+            else:
+                items = [f"请写一段关于主题{rng.randint(0, 10 ** 9)}的简短说明" for _ in range(count)]
+            if json_mode:
+                return json.dumps({"instructions": items}, ensure_ascii=False)
+            return "\n".join(f"{i}. {item}" for i, item in enumerate(items, 1))
+
+        pack = _PACK_ITEM_RE.findall(prompt)
+        if pack:
+            items = [(int(idx), instruction) for idx, instruction in pack if rng.random() >= self.drop_rate]
+            if json_mode:
+                results = [{"id": idx, "input": "无", "output": self._output_for(instruction)} for idx, instruction in items]
+                return json.dumps({"results": results}, ensure_ascii=False)
+            return "\n\n".join(f"[{idx}]\n输入：无\n输出：{self._output_for(instruction)}" for idx, instruction in items)
+
+        instruction = prompt.split("指令：", 1)[-1].split("\n", 1)[0]
+        if rng.random() < self.refusal_rate:
+            output = "抱歉，我无法完成这个请求。" + "作为一个语言模型，我需要说明这类任务超出了我的能力范围。" * 6
+            if json_mode:
+                return json.dumps({"input": "无", "output": output}, ensure_ascii=False)
+            return f"输入：无\n输出：{output}"
+        output = self._output_for(instruction)
+        # 未启用长回复时不消耗随机数，保持其他基准的回复不变
+        if self.long_output_rate and rng.random() < self.long_output_rate:
+            output += "下面分步骤详细说明。" * (self.long_output_tokens // 10)
+        if json_mode:
+            return json.dumps({"input": "无", "output": output}, ensure_ascii=False)
+        return f"输入：无\n输出：{output}"
+
+    def truncate(self, text, max_tokens):
+        """按max_tokens截断回复，返回(回复, finish_reason)"""
+        if not max_tokens or estimate_tokens(text) <= max_tokens:
+            return text, "stop"
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if estimate_tokens(text[:mid]) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        with self._lock:
+            self.truncated += 1
+        return text[:low], "length"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_error(self, status):
+                message = "rate limited" if status == 429 else "injected server error"
+                payload = json.dumps({"error": {"message": message, "type": "mock_error"}}).encode("utf-8")
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", str(server.retry_after))
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                rng = server.next_request()
+                status = server.fault_for(rng)
+                if status is not None:
+                    self._send_error(status)
+                    return
+                text, finish_reason = server.truncate(server.complete(body, rng), body.get("max_tokens"))
+                prompt_tokens = estimate_tokens(body["messages"][-1]["content"])
+                completion_tokens = estimate_tokens(text)
+                if body.get("stream"):
+                    self._stream(body, rng, text, finish_reason, prompt_tokens, completion_tokens)
+                    return
+                delay = server.latency_for(rng, prompt_tokens, completion_tokens)
+                if server.slots is not None:
+                    with server.slots:
+                        time.sleep(delay)
+                elif delay > 0:
+                    time.sleep(delay)
+                payload = json.dumps({
+                    "id": "mock", "object": "chat.completion", "created": int(time.time()),
+                    "model": body.get("model", "mock"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                }, ensure_ascii=False).encode("utf-8")
+                with server._lock:
+                    server.completion_tokens += completion_tokens
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, body, rng, text, finish_reason, prompt_tokens, completion_tokens):
+                """以SSE逐块发送回复，每块按生成token计时；客户端断开时停止生成"""
+                pieces = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+                first_token = server.latency_for(rng, prompt_tokens, 0)
+                per_piece = completion_tokens * server.token_latency / max(len(pieces), 1)
+                sent = 0
+                if server.slots is not None:
+                    server.slots.acquire()
+                try:
+                    time.sleep(first_token)
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    self.close_connection = True
+                    for piece in pieces:
+                        if per_piece > 0:
+                            time.sleep(per_piece)
+                        self._send_event({"choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}, body)
+                        sent += 1
+                    self._send_event({"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}, body)
+                    if (body.get("stream_options") or {}).get("include_usage"):
+                        self._send_event({"choices": [], "usage": {
+                            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                            "total_tokens": prompt_tokens + completion_tokens}}, body)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    with server._lock:
+                        server.streams_cancelled += 1
+                finally:
+                    with server._lock:
+                        server.completion_tokens += estimate_tokens("".join(pieces[:sent]))
+                    if server.slots is not None:
+                        server.slots.release()
+
+            def _send_event(self, payload, body):
+                payload = dict(payload, id="mock", object="chat.completion.chunk", created=int(time.time()),
+                               model=body.get("model", "mock"))
+                self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模拟OpenAI兼容接口的本地服务')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8000, help='监听端口')
+    parser.add_argument('--base_latency', type=float, default=0.2, help='每个请求的固定开销（秒）')
+    parser.add_argument('--token_latency', type=float, default=0.004, help='每个生成token的时间（秒）')
+    parser.add_argument('--capacity', type=int, default=0, help='同时处理的最大请求数，0表示不限制')
+    parser.add_argument('--drop_rate', type=float, default=0.0, help='打包请求中每条结果被遗漏的概率')
+    parser.add_argument('--latency_distribution', type=str, default='fixed', choices=LATENCY_DISTRIBUTIONS,
+                        help='固定开销的分布')
+    parser.add_argument('--latency_sigma', type=float, default=0.5, help='lognormal分布的sigma')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='返回500错误的请求比例')
+    parser.add_argument('--rate_limit_rate', type=float, default=0.0, help='返回429限流的请求比例')
+    parser.add_argument('--retry_after', type=float, default=0.1, help='429响应中Retry-After的秒数')
+    parser.add_argument('--output_format', type=str, default='auto', choices=['auto', 'text', 'json'],
+                        help='回复格式，auto按请求的response_format决定')
+    parser.add_argument('--instruction_variants', type=int, default=0,
+                        help='大于0时新指令模仿提示词中的示例，每个主题只有这么多种变体')
+    parser.add_argument('--instruction_novelty', type=float, default=0.2,
+                        help='模仿模式下每条指令改为全新主题的概率')
+    parser.add_argument('--refusal_rate', type=float, default=0.0, help='单条实例请求返回道歉长回复的比例')
+    parser.add_argument('--long_output_rate', type=float, default=0.0, help='单条实例请求返回长回复的比例')
+    parser.add_argument('--long_output_tokens', type=int, default=600, help='长回复的大致token数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, base_latency=args.base_latency, token_latency=args.token_latency,
+                           capacity=args.capacity, drop_rate=args.drop_rate, seed=args.seed,
+                           latency_distribution=args.latency_distribution, latency_sigma=args.latency_sigma,
+                           error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                           retry_after=args.retry_after, output_format=args.output_format,
+                           instruction_variants=args.instruction_variants,
+                           instruction_novelty=args.instruction_novelty, refusal_rate=args.refusal_rate,
+                           long_output_rate=args.long_output_rate, long_output_tokens=args.long_output_tokens)
+    print(f"模拟服务已启动: {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
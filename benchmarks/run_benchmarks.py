@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+离线基准套件
+
+在本地模拟服务（benchmarks/mock_server.py）上按1k/10k/100k等规模运行各个场景，
+报告吞吐和峰值内存，结果连同当前提交号写入 benchmarks/results/，用于跨提交对比。
+每个场景在独立的子进程中运行，峰值内存为该子进程的最大常驻内存（RSS）；
+模拟服务运行在父进程中，不计入场景的内存。
+
+场景：
+    filter       DataFilter.filter_batch 过滤合成数据（含约三成无效数据）
+    dedup        InstructionIndex（exact、minhash）和 semantic_deduplicate 对合成指令去重
+    instruction  InstructionGenerator.generate 生成指定数量的去重后指令
+    instance     InstanceGenerator.generate_batch 为指定数量的指令生成输入-输出对
+    main         以子进程运行一轮 main.py（指令生成、实例生成、过滤和写入）
+
+用法：
+    python benchmarks/run_benchmarks.py --scales 1000 10000 --scenarios filter dedup
+    python benchmarks/run_benchmarks.py --scales 1000 --error_rate 0.01 --rate_limit_rate 0.05
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<旧>.json benchmarks/results/<新>.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# 添加项目根目录到路径
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from benchmarks.mock_server import MockLLMServer, LATENCY_DISTRIBUTIONS
+
+SCENARIOS = ("filter", "dedup", "instruction", "instance", "main")
+# 需要模拟服务的场景
+LLM_SCENARIOS = ("instruction", "instance", "main")
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='离线基准套件')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000, 100000], help='数据规模')
+    parser.add_argument('--scenarios', type=str, nargs='+', default=list(SCENARIOS), choices=SCENARIOS, help='要运行的场景')
+    parser.add_argument('--output', type=str, default=None, help='结果文件，默认写入benchmarks/results/<时间>_<提交>.json')
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('BASE', 'NEW'), help='对比两个结果文件并退出')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    # 客户端
+    parser.add_argument('--max_concurrency', type=int, default=8, help='客户端最大并发请求数')
+    parser.add_argument('--response_format', type=str, default='text', choices=['text', 'json'], help='请求的响应格式')
+    parser.add_argument('--filter_workers', type=int, default=1, help='filter场景的进程数，0表示使用全部CPU核')
+    # 模拟服务
+    parser.add_argument('--base_latency', type=float, default=0.0, help='模拟服务每个请求的固定开销（秒）')
+    parser.add_argument('--token_latency', type=float, default=0.0, help='模拟服务每个生成token的时间（秒）')
+    parser.add_argument('--latency_distribution', type=str, default='fixed', choices=LATENCY_DISTRIBUTIONS,
+                        help='固定开销的分布')
+    parser.add_argument('--capacity', type=int, default=0, help='模拟服务同时处理的请求数，0表示不限制')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='返回500错误的请求比例')
+    parser.add_argument('--rate_limit_rate', type=float, default=0.0, help='返回429限流的请求比例')
+    parser.add_argument('--child', type=str, nargs=3, metavar=('SCENARIO', 'SCALE', 'BASE_URL'), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+# ---------------------------------------------------------------------------
+# 合成数据
+
+def make_instructions(count, rng, duplicate_rate=0.1):
+    """合成指令，其中约duplicate_rate比例为较早指令的重复（大小写或标点不同）"""
+    actions = ["写一段关于", "解释", "总结", "列出三个关于", "用简单的话介绍", "比较两种"]
+    instructions = []
+    for _ in range(count):
+        if instructions and rng.random() < duplicate_rate:
+            instructions.append(rng.choice(instructions).rstrip("。") + "！")
+            continue
+        # 主题由随机汉字组成，使不重复的指令之间字符n-gram重叠很少（接近真实指令的分布）
+        topic = "".join(chr(rng.randint(0x4E00, 0x9FA5)) for _ in range(rng.randint(6, 12)))
+        instructions.append(f"{rng.choice(actions)}{topic}的内容。")
+    return instructions
+
+
+def make_instances(count, rng):
+    """合成实例，约三成会被默认过滤规则拒绝（输出过短、道歉、重复、复述指令）"""
+    instances = []
+    for instruction in make_instructions(count, rng, duplicate_rate=0.0):
+        roll = rng.random()
+        if roll < 0.08:
+            output = "好"
+        elif roll < 0.16:
+            output = "抱歉，我无法回答这个问题。"
+        elif roll < 0.24:
+            output = "重复的内容。" * 20
+        elif roll < 0.30:
+            output = instruction
+        else:
+            output = f"这是针对“{instruction[:12]}”的回答，编号{rng.randint(0, 10 ** 6)}，包含若干说明性的句子。"
+        instances.append({"instruction": instruction, "input": "无", "output": output})
+    return instances
+
+
+def load_seed_data():
+    with open(os.path.join(ROOT_DIR, "data", "seed_instructions.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def make_config(base_url, args):
+    from src.config import Config
+    config = Config()
+    config.api_key = "mock"
+    config.base_url = base_url
+    config.model = "mock"
+    config.cache_enabled = False
+    config.retry_count = 5
+    config.retry_delay = 0.05
+    config.max_concurrency = args.max_concurrency
+    config.response_format = args.response_format
+    config.filter_workers = args.filter_workers
+    return config
+
+
+# ---------------------------------------------------------------------------
+# 场景，返回 {"items": 处理条数, "seconds": 耗时, ...}
+
+def bench_filter(scale, base_url, args):
+    from src.filter import DataFilter
+    instances = make_instances(scale, random.Random(args.seed))
+    data_filter = DataFilter(make_config(base_url, args))
+    start = time.perf_counter()
+    kept = data_filter.filter_batch(instances)
+    return {"items": scale, "seconds": time.perf_counter() - start, "kept": len(kept)}
+
+
+def bench_dedup(scale, base_url, args):
+    from src.dedup import InstructionIndex
+    from src.utils import semantic_deduplicate
+    rng = random.Random(args.seed)
+    pool = [{"instruction": text} for text in make_instructions(scale, rng)]
+    candidates = make_instructions(scale, rng)
+    result = {"items": scale, "seconds": 0.0}
+    for mode in ("exact", "minhash"):
+        index = InstructionIndex(mode)
+        start = time.perf_counter()
+        index.sync(pool)
+        kept = index.filter(candidates)
+        seconds = time.perf_counter() - start
+        result[f"{mode}_seconds"] = seconds
+        result[f"{mode}_kept"] = len(kept)
+        result["seconds"] += seconds
+
+    new_data = [{"instruction": text, "input": "无", "output": "无"} for text in candidates]
+    try:
+        import sentence_transformers  # noqa: F401
+        result["semantic_backend"] = "embedding"
+    except ImportError:
+        result["semantic_backend"] = "text"
+    start = time.perf_counter()
+    kept = semantic_deduplicate(new_data, pool)
+    seconds = time.perf_counter() - start
+    result["semantic_seconds"] = seconds
+    result["semantic_kept"] = len(kept)
+    result["seconds"] += seconds
+    return result
+
+
+def bench_instruction(scale, base_url, args):
+    from src.generator import InstructionGenerator
+    generator = InstructionGenerator(make_config(base_url, args))
+    seed_data = load_seed_data()
+    start = time.perf_counter()
+    instructions = generator.generate(seed_data, num_to_generate=scale)
+    seconds = time.perf_counter() - start
+    stats = generator.last_stats
+    return {"items": len(instructions), "seconds": seconds, "requests": stats["requests"],
+            "failures": stats["failures"], "yield_per_request": stats["yield_per_request"]}
+
+
+def bench_instance(scale, base_url, args):
+    from src.generator import InstanceGenerator
+    generator = InstanceGenerator(make_config(base_url, args))
+    instructions = make_instructions(scale, random.Random(args.seed), duplicate_rate=0.0)
+    start = time.perf_counter()
+    instances = generator.generate_batch(instructions)
+    seconds = time.perf_counter() - start
+    usage = generator.llm_client.usage
+    return {"items": scale, "seconds": seconds, "generated": sum(1 for i in instances if i is not None),
+            "requests": usage.requests, "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens}
+
+
+def bench_main(scale, base_url, args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = {
+            "api_key": "mock", "base_url": base_url, "model": "mock", "cache_enabled": False,
+            "retry_count": 5, "retry_delay": 0.05, "max_concurrency": args.max_concurrency,
+            "response_format": args.response_format, "filter_workers": args.filter_workers,
+        }
+        config_file = os.path.join(tmp_dir, "config.json")
+        with open(config_file, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        output_dir = os.path.join(tmp_dir, "output")
+        command = [
+            sys.executable, os.path.join(ROOT_DIR, "main.py"), "--config", config_file,
+            "--seed_file", os.path.join(ROOT_DIR, "data", "seed_instructions.json"),
+            "--output_dir", output_dir, "--iterations", "1", "--num_per_iter", str(scale),
+        ]
+        start = time.perf_counter()
+        # main.py的日志写入当前目录，在临时目录中运行
+        subprocess.run(command, cwd=tmp_dir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds = time.perf_counter() - start
+        with open(os.path.join(output_dir, "metrics_iter_0.json"), "r", encoding="utf-8") as f:
+            summary = json.load(f)
+    return {"items": summary["instructions"], "seconds": seconds, "valid_instances": summary["valid_instances"],
+            "requests": summary["llm"]["requests"], "errors": summary["llm"]["errors"],
+            "retries": summary["llm"]["retries"]}
+
+
+BENCHMARKS = {
+    "filter": bench_filter,
+    "dedup": bench_dedup,
+    "instruction": bench_instruction,
+    "instance": bench_instance,
+    "main": bench_main,
+}
+
+
+def run_child(args):
+    """子进程：运行单个场景并在最后一行输出JSON结果"""
+    scenario, scale, base_url = args.child
+    result = BENCHMARKS[scenario](int(scale), base_url, args)
+    # Linux下ru_maxrss单位为KB，macOS下为字节
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    who = resource.RUSAGE_CHILDREN if scenario == "main" else resource.RUSAGE_SELF
+    result["peak_rss_mb"] = resource.getrusage(who).ru_maxrss / divisor
+    print(json.dumps(result))
+
+
+def run_scenario(scenario, scale, base_url, args):
+    command = [sys.executable, os.path.abspath(__file__), "--child", scenario, str(scale), base_url or "-",
+               "--seed", str(args.seed), "--max_concurrency", str(args.max_concurrency),
+               "--response_format", args.response_format, "--filter_workers", str(args.filter_workers)]
+    completed = subprocess.run(command, cwd=ROOT_DIR, capture_output=True, text=True)
+    if completed.returncode != 0:
+        print(completed.stderr[-2000:], file=sys.stderr)
+        return {"error": f"exit code {completed.returncode}"}
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["items_per_second"] = result["items"] / result["seconds"] if result["seconds"] > 0 else 0.0
+    return result
+
+
+# ---------------------------------------------------------------------------
+# 结果存储与对比
+
+def git_revision():
+    """当前提交号及工作区是否有未提交的修改"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def print_results(results):
+    print(f"{'场景':<12} {'规模':>8} {'条数':>8} {'耗时(s)':>9} {'条/秒':>10} {'峰值内存(MB)':>12}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['scenario']:<12} {r['scale']:>8} 失败: {r['error']}")
+            continue
+        print(f"{r['scenario']:<12} {r['scale']:>8} {r['items']:>8} {r['seconds']:>9.2f} "
+              f"{r['items_per_second']:>10.1f} {r['peak_rss_mb']:>12.1f}")
+
+
+def compare(base_file, new_file):
+    """按(场景, 规模)对比两个结果文件的吞吐和峰值内存"""
+    with open(base_file, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_file, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"基准: {base['commit']}{'+' if base['dirty'] else ''} ({base['date']})")
+    print(f"对比: {new['commit']}{'+' if new['dirty'] else ''} ({new['date']})")
+    base_results = {(r["scenario"], r["scale"]): r for r in base["results"] if "error" not in r}
+    print(f"{'场景':<12} {'规模':>8} {'条/秒(基准)':>12} {'条/秒(对比)':>12} {'变化':>8} "
+          f"{'内存MB(基准)':>12} {'内存MB(对比)':>12}")
+    for r in new["results"]:
+        old = base_results.get((r["scenario"], r["scale"]))
+        if old is None or "error" in r:
+            continue
+        change = r["items_per_second"] / old["items_per_second"] - 1 if old["items_per_second"] else 0.0
+        print(f"{r['scenario']:<12} {r['scale']:>8} {old['items_per_second']:>12.1f} {r['items_per_second']:>12.1f} "
+              f"{change:>+8.1%} {old['peak_rss_mb']:>12.1f} {r['peak_rss_mb']:>12.1f}")
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        run_child(args)
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    server = None
+    if any(scenario in LLM_SCENARIOS for scenario in args.scenarios):
+        server = MockLLMServer(base_latency=args.base_latency, token_latency=args.token_latency,
+                               prompt_token_latency=0.0, capacity=args.capacity, seed=args.seed,
+                               latency_distribution=args.latency_distribution, error_rate=args.error_rate,
+                               rate_limit_rate=args.rate_limit_rate, retry_after=0.05)
+        server.start()
+
+    results = []
+    try:
+        for scenario in args.scenarios:
+            for scale in args.scales:
+                base_url = server.base_url if scenario in LLM_SCENARIOS else None
+                print(f"运行 {scenario} (规模 {scale})...", flush=True)
+                result = {"scenario": scenario, "scale": scale}
+                result.update(run_scenario(scenario, scale, base_url, args))
+                results.append(result)
+    finally:
+        if server is not None:
+            server.stop()
+
+    commit, dirty = git_revision()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("child", "compare", "output")},
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{commit}{'-dirty' if dirty else ''}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print_results(results)
+    print(f"结果已保存至: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,7 @@ from src.generator import InstructionGenerator, InstanceGenerator
 from src.filter import DataFilter
 from src.config import Config
 from src.utils import save_json, load_json, semantic_deduplicate
+from src.embedding import EmbeddingIndex
 
 def main():
     # 加载配置
@@ -53,6 +54,9 @@ def main():
     # 初始化数据池
     current_pool = seed_data.copy()
     
+    # 语义去重索引：跨迭代复用，每轮只编码新增数据
+    embedding_index = EmbeddingIndex(config.embedding_model, device=config.embedding_device)
+    
     # 多轮迭代
     iterations = 3
     num_per_iter = 10
@@ -80,7 +84,7 @@ def main():
         
         # 3. 语义去重
         try:
-            unique_data = semantic_deduplicate(new_data, current_pool, threshold=0.8)
+            unique_data = semantic_deduplicate(new_data, current_pool, threshold=0.8, index=embedding_index)
             print(f"去重后剩余 {len(unique_data)}/{len(new_data)} 条数据")
         except ImportError:
             print("警告: 语义去重需要安装sentence-transformers库")
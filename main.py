@@ -1,12 +1,23 @@
 import argparse
 import json
 import os
-from tqdm import tqdm
+import subprocess
+import sys
+import time
 
 from src.generator import InstructionGenerator, InstanceGenerator
 from src.filter import DataFilter
-from src.utils import setup_logger, load_json, save_json
+from src.utils import setup_logger, load_json, save_json_stream, semantic_deduplicate
+from src.storage import JsonlSink, OrderedWriter, iter_jsonl, atomic_write_json
+from src.pipeline import IterationPipeline
 from src.config import Config
+from src.cache import get_response_cache
+from src.balancer import get_load_balancer
+from src.state import RunJournal, set_rng_state
+from src.batch import export_instance_requests, ingest_instance_results
+from src.workqueue import WorkQueue
+from src.metrics import metrics, start_metrics_server
+from src.pool import DataPool
 
 # 设置日志
 logger = setup_logger()
@@ -18,17 +29,232 @@ def parse_args():
     parser.add_argument('--output_dir', type=str, default='output', help='输出目录')
     parser.add_argument('--iterations', type=int, default=5, help='迭代次数')
     parser.add_argument('--num_per_iter', type=int, default=100, help='每轮生成指令数量')
-    return parser.parse_args()
+    parser.add_argument('--max_concurrency', type=int, default=None, help='实例生成的最大并发请求数（覆盖配置文件）')
+    parser.add_argument('--cache', dest='cache', action='store_true', default=None, help='启用LLM响应缓存')
+    parser.add_argument('--no_cache', dest='cache', action='store_false', help='禁用LLM响应缓存')
+    parser.add_argument('--clear_cache', action='store_true', help='运行前清空LLM响应缓存')
+    parser.add_argument('--pipeline', action='store_true', help='流水线模式：指令生成与实例生成重叠进行')
+    parser.add_argument('--resume', action='store_true', help='从输出目录中的运行日志断点继续上次中断的运行')
+    parser.add_argument('--batch_export', action='store_true', help='离线批量模式：生成本轮指令后导出实例生成请求（Batch API格式）并退出')
+    parser.add_argument('--batch_ingest', type=str, default=None, help='离线批量模式：读取批量请求的结果文件，完成导出时中断的迭代（隐含--resume）')
+    parser.add_argument('--work_queue', type=str, default=None, help='分布式模式：实例生成任务写入该SQLite队列，由worker进程领取处理')
+    parser.add_argument('--spawn_workers', type=int, default=0, help='分布式模式下在本机启动的worker进程数')
+    parser.add_argument('--metrics_port', type=int, default=None, help='在该端口提供Prometheus格式的/metrics接口')
+    args = parser.parse_args()
+    if args.batch_export and args.pipeline:
+        parser.error('--batch_export 不能与 --pipeline 同时使用')
+    if args.work_queue and args.pipeline:
+        parser.error('--work_queue 不能与 --pipeline 同时使用')
+    if args.spawn_workers and not args.work_queue:
+        parser.error('--spawn_workers 需要同时指定 --work_queue')
+    if args.batch_ingest and not os.path.isfile(args.batch_ingest):
+        parser.error(f'--batch_ingest 结果文件不存在: {args.batch_ingest}')
+    if args.batch_ingest:
+        args.resume = True
+    return args
+
+def progress_bar(**kwargs):
+    """tqdm进度条（tqdm在用到时才导入，缩短启动时间）"""
+    from tqdm import tqdm
+    return tqdm(**kwargs)
+
+def semantic_filter_instructions(embedding_index, instructions, pool, threshold):
+    """去除与数据池语义相似的新指令，记录嵌入编码耗时
+
+    保留的指令不加入索引，之后进入数据池时由下一次sync补齐。
+    """
+    start = time.perf_counter()
+    kept = semantic_deduplicate(
+        [{"instruction": text} for text in instructions], pool, threshold, index=embedding_index, add=False
+    )
+    elapsed = time.perf_counter() - start
+    metrics.observe("embedding_seconds", elapsed)
+    logger.info(f"语义去重: 保留 {len(kept)}/{len(instructions)} 条指令 (耗时 {elapsed:.2f} 秒)")
+    return [item["instruction"] for item in kept]
+
+def generate_instances(instance_generator, data_filter, instructions, done, writer, journal, iter_idx):
+    """并发为指令生成实例并过滤，结果按指令顺序写入数据池
+    
+    Args:
+        instructions: 本轮的指令列表
+        done: 断点恢复时已完成的结果 {指令下标: 实例或None}
+        
+    Returns:
+        与指令一一对应的结果列表，无效的位置为None
+    """
+    results = [None] * len(instructions)
+    for idx in sorted(done):
+        results[idx] = done[idx]
+        writer.put(idx, done[idx])
+    todo = [idx for idx in range(len(instructions)) if idx not in done]
+    
+    start_time = time.time()
+    with progress_bar(total=len(instructions), initial=len(instructions) - len(todo)) as pbar:
+        # 按完成顺序过滤，按指令顺序写回，保证输出顺序确定
+        pending = [instructions[idx] for idx in todo]
+        for pos, instance in instance_generator.iter_generate(pending):
+            idx = todo[pos]
+            if instance and data_filter.is_valid(instance):
+                results[idx] = instance
+            journal.record_instance(iter_idx, idx, results[idx])
+            writer.put(idx, results[idx])
+            pbar.update(1)
+    elapsed = time.time() - start_time
+    if elapsed > 0 and todo:
+        logger.info(f"实例生成吞吐: {len(todo) / elapsed:.2f} 请求/秒 (耗时 {elapsed:.1f} 秒)")
+    return results
+
+def distribute_instances(queue, data_filter, instructions, done, writer, journal, iter_idx, poll_interval):
+    """分布式模式：将指令写入任务队列，等待worker完成，结果按指令顺序写入数据池
+    
+    参数和返回值同generate_instances，多出的queue为任务队列，poll_interval为轮询间隔（秒）
+    """
+    results = [None] * len(instructions)
+    for idx in sorted(done):
+        results[idx] = done[idx]
+        writer.put(idx, done[idx])
+    seen = set(done)
+    queue.enqueue(iter_idx, instructions)
+    
+    start_time = time.time()
+    with progress_bar(total=len(instructions), initial=len(seen)) as pbar:
+        while len(seen) < len(instructions):
+            finished = queue.fetch_done(iter_idx, exclude=seen)
+            if not finished:
+                time.sleep(poll_interval)
+                continue
+            for idx, instance, rejected in sorted(finished, key=lambda item: item[0]):
+                seen.add(idx)
+                if rejected is not None or instance is not None:
+                    data_filter.record_result(rejected)
+                results[idx] = instance
+                journal.record_instance(iter_idx, idx, instance)
+                writer.put(idx, instance)
+            pbar.update(len(finished))
+    elapsed = time.time() - start_time
+    if elapsed > 0:
+        logger.info(f"分布式实例生成吞吐: {len(instructions) / elapsed:.2f} 条/秒 (耗时 {elapsed:.1f} 秒)")
+    return results
+
+def _counter_total(counters, name, **match):
+    """指标快照中某个计数器在标签匹配的各序列上的合计"""
+    total = 0
+    for label, value in counters.get(name, {}).items():
+        labels = dict(item.split("=", 1) for item in label.split(",") if item)
+        if all(labels.get(k) == v for k, v in match.items()):
+            total += value
+    return total
+
+def write_iteration_metrics(path, iter_idx, elapsed, pool_size, num_instructions, num_valid):
+    """写入本轮的指标文件：本轮内的计数器增量、延迟分位数和由此算出的比率"""
+    snapshot = metrics.snapshot()
+    counters = snapshot["counters"]
+    
+    def rate(numerator, denominator):
+        return numerator / denominator if denominator else 0.0
+    
+    llm_requests = _counter_total(counters, "llm_requests_total")
+    summary = {
+        "iteration": iter_idx,
+        "elapsed_seconds": elapsed,
+        "pool_size": pool_size,
+        "instructions": num_instructions,
+        "valid_instances": num_valid,
+        "yield": rate(num_valid, num_instructions),
+        "llm": {
+            "requests": llm_requests,
+            "errors": _counter_total(counters, "llm_errors_total"),
+            "retries": _counter_total(counters, "llm_retries_total"),
+            "cache_hits": _counter_total(counters, "llm_cache_hits_total"),
+            "prompt_tokens": _counter_total(counters, "llm_prompt_tokens_total"),
+            "completion_tokens": _counter_total(counters, "llm_completion_tokens_total"),
+            "valid_instances_per_request": rate(num_valid, llm_requests),
+            "latency_seconds": snapshot["histograms"].get("llm_request_seconds", {}),
+        },
+        "parse_failure_rate": {
+            kind: rate(_counter_total(counters, "parse_responses_total", kind=kind, result="failed"),
+                       _counter_total(counters, "parse_responses_total", kind=kind))
+            for kind in ("instruction", "instance")
+        },
+        "filter_reject_rate": rate(_counter_total(counters, "filter_rejections_total"),
+                                   _counter_total(counters, "filter_checked_total")),
+        "dedup_drop_rate": {
+            stage: rate(_counter_total(counters, "dedup_dropped_total", stage=stage),
+                        _counter_total(counters, "dedup_checked_total", stage=stage))
+            for stage in ("instruction", "semantic")
+        },
+        "counters": counters,
+        "histograms": snapshot["histograms"],
+    }
+    atomic_write_json(summary, path)
+    return summary
+
+def spawn_workers(args, count):
+    """在本机启动worker进程，共享同一任务队列"""
+    command = [sys.executable, "-m", "src.workqueue", os.path.abspath(args.work_queue),
+               "--config", os.path.abspath(args.config)]
+    if args.max_concurrency is not None:
+        command += ["--max_concurrency", str(args.max_concurrency)]
+    root = os.path.dirname(os.path.abspath(__file__))
+    return [subprocess.Popen(command, cwd=root) for _ in range(count)]
+
+def run_pipeline(pipeline, current_pool, target, writer, journal, iter_idx):
+    """以流水线模式运行一轮迭代
+    
+    Returns:
+        按指令序号排列的结果列表，无效的位置为None
+    """
+    results = {}
+    start_time = time.time()
+    on_instruction = lambda idx, instruction: journal.record_instruction(iter_idx, idx, instruction)
+    with progress_bar(total=target) as pbar:
+        for idx, instruction, instance in pipeline.run(current_pool, target, on_instruction=on_instruction):
+            results[idx] = instance
+            journal.record_instance(iter_idx, idx, instance)
+            writer.put(idx, instance)
+            pbar.update(1)
+    elapsed = time.time() - start_time
+    
+    stats = pipeline.stats
+    logger.info(
+        f"指令请求 {stats['instruction_requests']} 次 (失败 {stats['instruction_failures']} 次)，"
+        f"候选指令 {stats['candidates']} 条，去重后 {stats['accepted_instructions']} 条，"
+        f"每次请求产出 {stats['accepted_instructions'] / max(stats['instruction_requests'], 1):.2f} 条"
+    )
+    if elapsed > 0:
+        logger.info(f"流水线吞吐: {len(results) / elapsed:.2f} 条/秒 (耗时 {elapsed:.1f} 秒)")
+    return [results[idx] for idx in sorted(results)]
 
 def main():
+    # 后处理子命令：python main.py postprocess ...
+    if len(sys.argv) > 1 and sys.argv[1] == "postprocess":
+        from src.postprocess import main as postprocess_main
+        postprocess_main(sys.argv[2:])
+        return
+
     # 解析参数
     args = parse_args()
     
     # 加载配置
     config = Config(args.config)
+    if args.max_concurrency is not None:
+        config.max_concurrency = args.max_concurrency
+    if args.cache is not None:
+        config.cache_enabled = args.cache
+    
+    # 清空缓存（即使本次运行未启用缓存）
+    if args.clear_cache:
+        enabled = config.cache_enabled
+        config.cache_enabled = True
+        removed = get_response_cache(config).clear()
+        config.cache_enabled = enabled
+        logger.info(f"已清空LLM响应缓存: {config.cache_path} ({removed} 条)")
     
     # 创建输出目录
     os.makedirs(args.output_dir, exist_ok=True)
+    if args.metrics_port is not None:
+        start_metrics_server(args.metrics_port)
+        logger.info(f"Prometheus指标接口: http://0.0.0.0:{args.metrics_port}/metrics")
     
     # 加载种子指令
     logger.info(f"加载种子指令: {args.seed_file}")
@@ -36,50 +262,226 @@ def main():
     
     # 初始化生成器和过滤器
     instruction_generator = InstructionGenerator(config)
-    instance_generator = InstanceGenerator(config)
     data_filter = DataFilter(config)
+    instance_generator = InstanceGenerator(config, data_filter)
+    pipeline = IterationPipeline(config, instruction_generator, instance_generator, data_filter)
+    work_queue = WorkQueue.from_config(args.work_queue, config) if args.work_queue else None
+    
+    # 数据池以JSONL只追加写入，每轮只写入新增数据并记录清单；
+    # 运行日志记录每轮的待处理指令和已完成实例，用于断点恢复
+    pool_file = os.path.join(args.output_dir, "self_instruct_pool.jsonl")
+    journal_file = os.path.join(args.output_dir, "run_state.jsonl")
+    state = RunJournal.load(journal_file) if args.resume else None
+    
+    if state is not None:
+        if state.config_hash != config.fingerprint():
+            logger.warning("当前配置与中断的运行不一致，仍按断点继续")
+        # 丢弃最后一次提交之后写入的数据，这部分会从运行日志中重新写入
+        sink = JsonlSink(pool_file)
+        sink.truncate(state.committed_offset)
+        current_pool = DataPool.from_jsonl(
+            pool_file, end_offset=state.committed_offset, index=instruction_generator.dedup_index
+        )
+        set_rng_state(state.rng_state)
+        journal = RunJournal(journal_file)
+        start_iter = state.next_iteration
+        logger.info(f"从断点恢复: 已完成 {start_iter} 轮迭代，数据池大小 {len(current_pool)}")
+        if args.batch_ingest and state.pending_iteration is None:
+            logger.warning(f"运行日志中没有等待批量结果的迭代，忽略 {args.batch_ingest}")
+        if state.finished and start_iter >= args.iterations:
+            logger.info("上次运行已全部完成")
+    else:
+        if args.resume:
+            logger.warning(f"未找到可恢复的运行日志: {journal_file}，开始新的运行")
+        # 初始化数据池（列式存储，附加指令去重索引）
+        current_pool = DataPool(seed_data, index=instruction_generator.dedup_index)
+        logger.info(f"初始种子指令数量: {len(current_pool)}")
+        
+        sink = JsonlSink(pool_file, truncate=True)
+        sink.write(seed_data)
+        sink.write_manifest(
+            os.path.join(args.output_dir, "self_instruct_seed.manifest.json"),
+            start_offset=0, count=len(current_pool), iteration=-1, total=len(current_pool)
+        )
+        journal = RunJournal(journal_file, truncate=True)
+        journal.start(config.fingerprint())
+        if work_queue is not None:
+            work_queue.reset()
+        journal.commit(-1, sink.offset, len(current_pool))
+        start_iter = 0
+    
+    # 分布式模式下可在本机启动worker，其他机器上的worker运行 python -m src.workqueue <队列文件>
+    if work_queue is not None:
+        work_queue.open_run()
+    workers = spawn_workers(args, args.spawn_workers) if work_queue is not None else []
     
-    # 初始化数据池
-    current_pool = seed_data.copy()
-    logger.info(f"初始种子指令数量: {len(current_pool)}")
+    # 语义去重：嵌入模型只加载一次（或由常驻嵌入服务提供），并在第一轮指令生成期间后台加载
+    embedding_index = None
+    if config.semantic_dedup_threshold > 0:
+        if args.pipeline:
+            logger.warning("流水线模式暂不支持语义去重，忽略semantic_dedup_threshold")
+        else:
+            from src.embedding import EmbeddingIndex, preload_embedding_model
+            if config.seed_sampler == "diversity" and config.seed_embedding == "model":
+                # 与种子采样器共用数据池向量，每条指令只编码一次
+                embedding_index = instruction_generator.seed_sampler.index
+            else:
+                embedding_index = EmbeddingIndex(
+                    config.embedding_model, device=config.embedding_device, server_url=config.embedding_server or None
+                )
+            if config.embedding_preload:
+                preload_embedding_model(config.embedding_model, config.embedding_device, config.embedding_server or None)
     
     # 迭代生成
-    for iter_idx in range(args.iterations):
+    for iter_idx in range(start_iter, args.iterations):
         logger.info(f"开始第 {iter_idx+1}/{args.iterations} 轮迭代")
+        iter_start_time = time.time()
         
-        # 1. 生成新指令
-        logger.info(f"生成新指令...")
-        new_instructions = instruction_generator.generate(
-            current_pool, 
-            num_to_generate=args.num_per_iter
-        )
-        logger.info(f"生成了 {len(new_instructions)} 条新指令")
+        writer = OrderedWriter(sink)
+        iter_start_offset = sink.offset
+        data_filter.sync(current_pool)
+        # 需要生成实例的指令（流水线模式下实例在run_pipeline中生成）
+        instructions = None
         
-        # 2. 为指令生成输入-输出对
-        logger.info(f"为指令生成输入-输出对...")
-        new_data = []
-        for inst in tqdm(new_instructions):
-            instance = instance_generator.generate(inst)
-            if instance and data_filter.is_valid(instance):
-                new_data.append(instance)
+        if state is not None and state.pending_iteration == iter_idx:
+            if args.batch_ingest:
+                # 离线批量模式：先写入批量结果，缺失或失败的请求在下面交互式补齐
+                ingested = 0
+                for idx, instance in ingest_instance_results(
+                    instance_generator, data_filter, state.pending_instructions, iter_idx, args.batch_ingest
+                ):
+                    if idx in state.completed_instances:
+                        continue
+                    state.completed_instances[idx] = instance
+                    journal.record_instance(iter_idx, idx, instance)
+                    ingested += 1
+                logger.info(f"从批量结果 {args.batch_ingest} 读取了 {ingested} 条结果")
+            # 断点恢复：直接使用日志中的待处理指令，只为未完成的指令生成实例
+            logger.info(f"恢复 {len(state.pending_instructions)} 条待处理指令，其中 {len(state.completed_instances)} 条已完成")
+            instructions, done = state.pending_instructions, state.completed_instances
+        elif args.pipeline:
+            # 流水线模式：指令生成、去重、实例生成、过滤和写入同时进行
+            logger.info(f"以流水线模式生成指令和输入-输出对...")
+            results = run_pipeline(pipeline, current_pool, args.num_per_iter, writer, journal, iter_idx)
+        else:
+            # 1. 生成新指令
+            logger.info(f"生成新指令...")
+            new_instructions = instruction_generator.generate(
+                current_pool, 
+                num_to_generate=args.num_per_iter
+            )
+            stats = instruction_generator.last_stats
+            logger.info(
+                f"生成了 {len(new_instructions)} 条新指令 (请求 {stats['requests']} 次，失败 {stats['failures']} 次，"
+                f"候选 {stats['candidates']} 条，每次请求产出 {stats['yield_per_request']:.2f} 条)"
+            )
+            if embedding_index is not None:
+                new_instructions = semantic_filter_instructions(
+                    embedding_index, new_instructions, current_pool, config.semantic_dedup_threshold
+                )
+            journal.record_instructions(iter_idx, new_instructions)
+            
+            if args.batch_export:
+                # 离线批量模式：导出实例生成请求后退出，本轮在--batch_ingest时完成
+                batch_file = os.path.join(args.output_dir, f"batch_iter_{iter_idx}_requests.jsonl")
+                count = export_instance_requests(instance_generator, new_instructions, iter_idx, batch_file)
+                journal.close()
+                sink.close()
+                if work_queue is not None:
+                    work_queue.close_run()
+                logger.info(f"已导出 {count} 个实例生成请求: {batch_file}")
+                logger.info(
+                    f"批量请求完成后运行: python main.py --output_dir {args.output_dir} --batch_ingest <结果文件> [--batch_export]"
+                )
+                return
+            
+            # 2. 为指令生成输入-输出对
+            instructions, done = new_instructions, {}
         
-        logger.info(f"成功生成 {len(new_data)}/{len(new_instructions)} 条有效数据")
+        if instructions is not None:
+            if work_queue is not None:
+                logger.info(f"将 {len(instructions) - len(done)} 条指令分发给worker生成输入-输出对...")
+                results = distribute_instances(
+                    work_queue, data_filter, instructions, done, writer, journal, iter_idx, config.queue_poll_interval
+                )
+            else:
+                logger.info(f"为指令生成输入-输出对 (并发数: {config.max_concurrency})...")
+                results = generate_instances(
+                    instance_generator, data_filter, instructions, done, writer, journal, iter_idx
+                )
+        new_data = [d for d in results if d is not None]
+        logger.info(f"成功生成 {len(new_data)}/{len(results)} 条有效数据")
         
         # 3. 去重并加入数据池
         old_pool_size = len(current_pool)
         current_pool.extend(new_data)
         
-        # 4. 保存当前迭代结果
-        iter_output_file = os.path.join(args.output_dir, f"self_instruct_iter_{iter_idx}.json")
-        save_json(current_pool, iter_output_file)
-        logger.info(f"保存迭代结果到: {iter_output_file}")
+        # 4. 落盘并写入本轮清单，然后在运行日志中提交本轮
+        manifest_file = os.path.join(args.output_dir, f"self_instruct_iter_{iter_idx}.manifest.json")
+        sink.write_manifest(
+            manifest_file, start_offset=iter_start_offset, count=len(new_data),
+            iteration=iter_idx, total=len(current_pool)
+        )
+        journal.commit(iter_idx, sink.offset, len(current_pool))
+        logger.info(f"保存迭代结果到: {pool_file} (清单: {manifest_file})")
         logger.info(f"当前数据池大小: {len(current_pool)} (新增 {len(current_pool) - old_pool_size} 条)")
+        
+        # 5. 本轮指标
+        metrics_file = os.path.join(args.output_dir, f"metrics_iter_{iter_idx}.json")
+        summary = write_iteration_metrics(
+            metrics_file, iter_idx, time.time() - iter_start_time, len(current_pool), len(results), len(new_data)
+        )
+        llm = summary["llm"]
+        logger.info(
+            f"本轮指标: LLM请求 {llm['requests']} 次 (错误 {llm['errors']}, 重试 {llm['retries']}), "
+            f"token {llm['prompt_tokens']}+{llm['completion_tokens']}, 有效率 {summary['yield']:.1%} "
+            f"(详见 {metrics_file})"
+        )
     
-    # 保存最终结果
+    for name, generator in (("指令", instruction_generator), ("实例", instance_generator)):
+        parse_stats = generator.parse_stats
+        if parse_stats.responses:
+            logger.info(
+                f"{name}响应解析: {parse_stats.responses} 条, 失败 {parse_stats.failures} 条 "
+                f"({parse_stats.failure_rate:.1%}), JSON {parse_stats.json} 条"
+            )
+    if data_filter.rejections:
+        logger.info(f"过滤规则拒绝次数: {dict(data_filter.rejections)}")
+    for name, rule_stats in data_filter.rule_stats().items():
+        if not rule_stats['calls']:
+            continue
+        logger.info(
+            f"过滤规则 {name}: 检查 {rule_stats['calls']} 条，拒绝 {rule_stats['rejections']} 条，"
+            f"平均耗时 {rule_stats['avg_microseconds']:.1f}us"
+        )
+    
+    journal.finish()
+    journal.close()
+    sink.close()
+    if work_queue is not None:
+        # 通知worker运行结束
+        work_queue.close_run()
+        for worker in workers:
+            worker.wait()
+        work_queue.close()
+    
+    # 从JSONL流式导出最终结果
     final_output_file = os.path.join(args.output_dir, "self_instruct_final.json")
-    save_json(current_pool, final_output_file)
+    save_json_stream(iter_jsonl(pool_file), final_output_file)
     logger.info(f"生成完成！最终数据集大小: {len(current_pool)}")
     logger.info(f"最终数据保存至: {final_output_file}")
+    
+    cache = get_response_cache(config)
+    if cache is not None:
+        stats = cache.stats
+        logger.info(f"LLM响应缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, 命中率 {stats['hit_rate']:.1%}")
+    
+    if len(config.endpoints) > 1:
+        for base_url, stats in get_load_balancer(config).stats().items():
+            logger.info(
+                f"端点 {base_url}: 请求 {stats['requests']} 次, 失败 {stats['failures']} 次, "
+                f"平均延迟 {stats['avg_latency']:.2f}秒, 吞吐 {stats['throughput']:.2f} 请求/秒"
+            )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,242 @@
+import random
+import threading
+import time
+from typing import List, Dict, Any, Tuple
+
+from .ratelimit import RateLimiter, get_rate_limiter, is_retryable_error, is_rate_limit_error
+
+# 延迟的指数滑动平均系数
+LATENCY_EWMA_ALPHA = 0.2
+
+# 同一组端点的所有客户端共享一个负载均衡器
+_balancers: Dict[Tuple, "LoadBalancer"] = {}
+_balancers_lock = threading.Lock()
+
+
+class Endpoint:
+    """一个后端节点的连接参数、熔断状态和运行指标"""
+
+    def __init__(self, base_url: str, api_key: str, model: str, weight: float, rate_limiter: RateLimiter):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.weight = max(weight, 1e-6)
+        self.rate_limiter = rate_limiter
+
+        # 熔断状态：连续失败达到阈值后打开，冷却后放行一个探测请求（半开）
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+        self.outstanding = 0
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.ewma_latency = None
+        self.first_request = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.open_until > 0
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.first_request if self.first_request else 0.0
+        return {
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": self.failures,
+            "outstanding": self.outstanding,
+            "avg_latency": self.total_latency / self.successes if self.successes else 0.0,
+            "ewma_latency": self.ewma_latency or 0.0,
+            "throughput": self.successes / elapsed if elapsed > 0 else 0.0,
+            "circuit_open": self.is_open,
+        }
+
+
+class LoadBalancer:
+    """在多个OpenAI兼容端点之间分发请求
+
+    路由策略：least_outstanding按 (进行中请求数+1)/权重 选择最空闲的节点；
+    latency在此基础上乘以节点的滑动平均延迟，尚无延迟数据的节点优先被尝试。
+    节点连续失败（连接错误、超时、5xx）达到阈值后熔断，冷却后放行一个探测请求，
+    成功则恢复。可选的后台线程定期探测已熔断节点的 /models 接口。
+    """
+
+    def __init__(self, endpoints: List[Endpoint], strategy: str = "least_outstanding",
+                 failure_threshold: int = 5, reset_timeout: float = 30.0, health_check_interval: float = 0):
+        """
+        Args:
+            endpoints: 后端节点列表
+            strategy: 路由策略，"least_outstanding"或"latency"
+            failure_threshold: 触发熔断的连续失败次数
+            reset_timeout: 熔断后多少秒放行探测请求
+            health_check_interval: 后台健康检查间隔（秒），0表示不启用
+        """
+        if not endpoints:
+            raise ValueError("负载均衡至少需要一个端点")
+        if strategy not in ("least_outstanding", "latency"):
+            raise ValueError(f"不支持的路由策略: {strategy}")
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        if health_check_interval > 0 and len(endpoints) > 1:
+            thread = threading.Thread(target=self._health_check_loop, args=(health_check_interval,), daemon=True)
+            thread.start()
+
+    def _available(self, endpoint: Endpoint, now: float) -> bool:
+        if not endpoint.is_open:
+            return True
+        # 冷却结束后只放行一个探测请求
+        return now >= endpoint.open_until and not endpoint.probing
+
+    def _score(self, endpoint: Endpoint) -> float:
+        load = (endpoint.outstanding + 1) / endpoint.weight
+        if self.strategy == "latency":
+            if endpoint.ewma_latency is None:
+                return 0.0
+            return load * endpoint.ewma_latency
+        return load
+
+    def acquire(self, exclude: Endpoint = None) -> Endpoint:
+        """选择一个节点并计入进行中请求，请求结束后必须调用release
+
+        Args:
+            exclude: 尽量避开的节点（如刚刚失败的节点）
+
+        Returns:
+            选中的节点
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [e for e in self.endpoints if self._available(e, now)]
+            if exclude is not None and len(candidates) > 1:
+                candidates = [e for e in candidates if e is not exclude]
+            if not candidates:
+                # 所有节点都已熔断：选择最早结束冷却的节点，让请求照常进入重试流程
+                candidates = [min(self.endpoints, key=lambda e: e.open_until)]
+            best = min(self._score(e) for e in candidates)
+            endpoint = random.choice([e for e in candidates if self._score(e) == best])
+            if endpoint.is_open:
+                endpoint.probing = True
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            if endpoint.first_request is None:
+                endpoint.first_request = now
+            return endpoint
+
+    def release(self, endpoint: Endpoint, latency: float = None, error: Exception = None) -> None:
+        """记录请求结果
+
+        Args:
+            endpoint: acquire返回的节点
+            latency: 成功请求的耗时（秒）
+            error: 请求失败时的异常，None表示成功
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.probing = False
+            if error is None:
+                endpoint.successes += 1
+                endpoint.consecutive_failures = 0
+                endpoint.open_until = 0.0
+                if latency is not None:
+                    endpoint.total_latency += latency
+                    if endpoint.ewma_latency is None:
+                        endpoint.ewma_latency = latency
+                    else:
+                        endpoint.ewma_latency += LATENCY_EWMA_ALPHA * (latency - endpoint.ewma_latency)
+                return
+            endpoint.failures += 1
+            # 限流和参数错误不代表节点不健康
+            if is_rate_limit_error(error) or not is_retryable_error(error):
+                return
+            endpoint.consecutive_failures += 1
+            if endpoint.is_open or endpoint.consecutive_failures >= self.failure_threshold:
+                if not endpoint.is_open:
+                    print(f"端点 {endpoint.base_url} 连续失败 {endpoint.consecutive_failures} 次，暂停 {self.reset_timeout} 秒")
+                endpoint.open_until = time.monotonic() + self.reset_timeout
+
+    def abandon(self, endpoint: Endpoint) -> None:
+        """请求被取消，只释放进行中计数，不计入成功或失败"""
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.probing = False
+
+    def has_alternative(self, endpoint: Endpoint) -> bool:
+        """是否还有其他可用节点（用于失败后立即切换而不等待退避）"""
+        with self._lock:
+            now = time.monotonic()
+            return any(e is not endpoint and self._available(e, now) for e in self.endpoints)
+
+    def check_health(self) -> None:
+        """探测已熔断节点，/models接口可访问时恢复该节点"""
+        import openai
+        from .llm import get_shared_client
+
+        for endpoint in self.endpoints:
+            if not endpoint.is_open:
+                continue
+            try:
+                get_shared_client(endpoint.api_key, endpoint.base_url).with_options(timeout=5).models.list()
+            except openai.APIStatusError as e:
+                # 服务有响应但不支持/models时同样视为可用
+                if e.status_code >= 500:
+                    continue
+            except Exception:
+                continue
+            with self._lock:
+                endpoint.consecutive_failures = 0
+                endpoint.open_until = 0.0
+            print(f"端点 {endpoint.base_url} 健康检查通过，恢复使用")
+
+    def _health_check_loop(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            self.check_health()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各节点的请求数、失败数、延迟和吞吐"""
+        with self._lock:
+            return {endpoint.base_url: endpoint.stats() for endpoint in self.endpoints}
+
+
+def get_endpoint_specs(config) -> List[Dict[str, Any]]:
+    """配置中的端点列表，未配置endpoints时为base_url对应的单个端点"""
+    specs = config.endpoints or [{"base_url": config.base_url}]
+    return [{
+        "base_url": spec["base_url"],
+        "api_key": spec.get("api_key", config.api_key),
+        "model": spec.get("model", config.model),
+        "weight": spec.get("weight", 1),
+        "requests_per_minute": spec.get("requests_per_minute", config.requests_per_minute),
+        "tokens_per_minute": spec.get("tokens_per_minute", config.tokens_per_minute),
+    } for spec in specs]
+
+
+def get_load_balancer(config) -> LoadBalancer:
+    """获取配置中端点列表共享的负载均衡器"""
+    specs = get_endpoint_specs(config)
+    key = tuple((spec["base_url"], spec["model"]) for spec in specs)
+    with _balancers_lock:
+        balancer = _balancers.get(key)
+        if balancer is None:
+            endpoints = [
+                Endpoint(
+                    spec["base_url"], spec["api_key"], spec["model"], spec["weight"],
+                    get_rate_limiter(config, spec["base_url"], spec["model"],
+                                     spec["requests_per_minute"], spec["tokens_per_minute"])
+                )
+                for spec in specs
+            ]
+            balancer = LoadBalancer(
+                endpoints,
+                strategy=config.load_balancing,
+                failure_threshold=config.circuit_failure_threshold,
+                reset_timeout=config.circuit_reset_timeout,
+                health_check_interval=config.health_check_interval
+            )
+            _balancers[key] = balancer
+        return balancer
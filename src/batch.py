@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import os
+import time
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+from .config import Config
+from .llm import AsyncLLMClient, ResponseTruncated
+from .metrics import metrics
+from .storage import JsonlSink, iter_jsonl
+
+# Batch API请求行的目标接口
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+def make_custom_id(iteration: int, index: int) -> str:
+    """批量请求的custom_id，编码迭代序号和指令下标"""
+    return f"iter-{iteration}-{index}"
+
+
+def parse_custom_id(custom_id: str) -> Tuple[int, int]:
+    """解析make_custom_id生成的custom_id，返回(迭代序号, 指令下标)"""
+    prefix, iteration, index = custom_id.rsplit("-", 2)
+    if prefix != "iter":
+        raise ValueError(f"无法识别的custom_id: {custom_id}")
+    return int(iteration), int(index)
+
+
+def build_batch_request(custom_id: str, prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """构造一行Batch API格式的请求
+
+    Args:
+        custom_id: 请求标识，结果中原样返回
+        prompt: 提示词
+        params: 模型参数（model、temperature、max_tokens，可选response_format）
+
+    Returns:
+        可直接写入JSONL的请求
+    """
+    body = {
+        "model": params["model"],
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": params["temperature"],
+        "max_tokens": params["max_tokens"],
+    }
+    if "response_format" in params:
+        body["response_format"] = params["response_format"]
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+
+
+def export_instance_requests(instance_generator, instructions: List[str], iteration: int, file_path: str) -> int:
+    """将实例生成的提示词导出为Batch API格式的JSONL
+
+    Args:
+        instance_generator: 实例生成器，提供提示词模板和模型参数
+        instructions: 本轮的指令列表
+        iteration: 迭代序号，编码进custom_id
+        file_path: 输出文件路径（覆盖已有文件）
+
+    Returns:
+        导出的请求数
+    """
+    params = instance_generator.llm_client._build_params(instance_generator.request_kwargs)
+    with JsonlSink(file_path, truncate=True) as sink:
+        requests = []
+        for idx, instruction in enumerate(instructions):
+            prompt = instance_generator.build_prompt(instruction)
+            requests.append(build_batch_request(
+                make_custom_id(iteration, idx), prompt, dict(params, max_tokens=instance_generator.max_tokens_for(prompt))
+            ))
+        sink.write(requests)
+        return sink.count
+
+
+def get_result_content(result: Dict[str, Any]) -> Optional[str]:
+    """从一行Batch API结果中取出生成文本，请求失败或输出被max_tokens截断时返回None"""
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code", 200) != 200:
+        return None
+    try:
+        choice = response["body"]["choices"][0]
+        content = choice["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return None
+    if choice.get("finish_reason") == "length":
+        metrics.inc("llm_truncated_total", result="failed")
+        return None
+    return content.strip() if content else None
+
+
+def ingest_instance_results(instance_generator, data_filter, instructions: List[str], iteration: int,
+                            file_path: str) -> Iterator[Tuple[int, Optional[Dict[str, str]]]]:
+    """读取Batch API结果，解析并过滤出实例
+
+    Args:
+        instance_generator: 实例生成器，用于解析响应
+        data_filter: 数据过滤器
+        instructions: 导出请求时的指令列表
+        iteration: 导出请求时的迭代序号，其他迭代的结果会被忽略
+        file_path: 结果JSONL路径
+
+    Yields:
+        (指令下标, 有效实例) 元组，请求失败、解析失败或被过滤时实例为None
+
+    Raises:
+        FileNotFoundError: 结果文件不存在（iter_jsonl对不存在的文件不返回任何记录，
+            不检查的话路径写错会被当作0条结果，整轮改为交互式重新生成）
+    """
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f"批量结果文件不存在: {file_path}")
+    for result in iter_jsonl(file_path):
+        try:
+            result_iteration, idx = parse_custom_id(result["custom_id"])
+        except (KeyError, ValueError) as e:
+            print(f"跳过无法识别的批量结果: {e}")
+            continue
+        if result_iteration != iteration or not 0 <= idx < len(instructions):
+            continue
+        content = get_result_content(result)
+        instance = None
+        if content is not None:
+            try:
+                instance = instance_generator._parse_instance(instructions[idx], content)
+            except Exception as e:
+                print(f"解析实例失败: {e}")
+        if instance is not None and not data_filter.is_valid(instance):
+            instance = None
+        yield idx, instance
+
+
+async def _arun_batch(config, requests: List[Dict[str, Any]], sink: JsonlSink, max_concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(client: AsyncLLMClient, request: Dict[str, Any]) -> None:
+        body = request["body"]
+        prompt = body["messages"][-1]["content"]
+        params = {key: body[key] for key in ("model", "temperature", "max_tokens", "response_format") if key in body}
+        async with semaphore:
+            try:
+                content = await client.agenerate(prompt, **params)
+                finish_reason = "stop"
+            except ResponseTruncated as e:
+                # 与Batch API一致：截断的输出照常返回，由finish_reason标明，导入时丢弃
+                content, finish_reason = e.text, "length"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                content = finish_reason = None
+                result = {"custom_id": request["custom_id"], "response": None,
+                          "error": {"code": type(e).__name__, "message": str(e)}}
+            if finish_reason is not None:
+                result = {
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {
+                            "object": "chat.completion",
+                            "model": params.get("model", config.model),
+                            "choices": [{
+                                "index": 0,
+                                "message": {"role": "assistant", "content": content},
+                                "finish_reason": finish_reason,
+                            }],
+                        },
+                    },
+                    "error": None,
+                }
+        # 单线程事件循环中逐条写入，每行都是完整的
+        sink.write([result])
+
+    async with AsyncLLMClient(config) as client:
+        await asyncio.gather(*(_run(client, request) for request in requests))
+
+
+def run_batch_file(config, input_path: str, output_path: str, max_concurrency: int = None) -> int:
+    """本地执行Batch API格式的请求文件，输出格式与Batch API结果一致
+
+    用于在没有批量接口时用配置中的端点（如本地vLLM/Ollama）批量跑完请求。
+    输出文件中已有结果的请求会被跳过，中断后重新运行即可继续。
+
+    Args:
+        config: 配置对象，提供端点、重试和限速设置
+        input_path: 请求JSONL路径
+        output_path: 结果JSONL路径
+        max_concurrency: 最大并发请求数，默认使用配置中的max_concurrency
+
+    Returns:
+        本次执行的请求数
+    """
+    done = {result["custom_id"] for result in iter_jsonl(output_path)}
+    requests = [request for request in iter_jsonl(input_path) if request["custom_id"] not in done]
+    with JsonlSink(output_path) as sink:
+        asyncio.run(_arun_batch(config, requests, sink, max_concurrency or config.max_concurrency))
+    return len(requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地执行Batch API格式的请求文件')
+    parser.add_argument('input', type=str, help='请求JSONL文件')
+    parser.add_argument('output', type=str, help='结果JSONL文件')
+    parser.add_argument('--config', type=str, default='config/default.json', help='配置文件路径')
+    parser.add_argument('--max_concurrency', type=int, default=None, help='最大并发请求数')
+    args = parser.parse_args()
+
+    config = Config(args.config)
+    start_time = time.time()
+    count = run_batch_file(config, args.input, args.output, args.max_concurrency)
+    print(f"完成 {count} 个请求，耗时 {time.time() - start_time:.2f}秒，结果保存至: {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 from typing import List, Dict, Any
@@ -11,12 +12,84 @@ class Config:
         self.base_url = "https://api.openai.com/v1"
         self.model = "gpt-3.5-turbo"
         self.temperature = 0.7
+        # 未指定请求类型时的max_tokens
         self.max_tokens = 256
+        # 按请求类型的输出预算：指令生成按每条指令计，实例生成按每条实例计（打包请求乘以条数）
+        self.instruction_max_tokens = 64
+        self.instance_max_tokens = 512
+        # 模型上下文长度，提示词token数与max_tokens之和不超过它（超出时去掉种子示例），0表示不限制
+        self.context_window = 4096
+        # 本地计算token数的方式：auto（安装了tiktoken时使用，否则估算）、estimate或tiktoken编码名
+        self.tokenizer = "auto"
+        # 输出被截断（finish_reason为length）后加倍max_tokens重新生成的次数及max_tokens上限
+        self.length_retries = 1
+        self.max_tokens_limit = 4096
         self.retry_count = 3
-        self.retry_delay = 5
+        self.retry_delay = 1
+        self.retry_max_delay = 60
+        self.max_concurrency = 8
+        self.request_timeout = 60
+        self.requests_per_minute = 0
+        self.tokens_per_minute = 0
+        # 多端点负载均衡：每项包含base_url，可选api_key、model、weight和限速参数，为空时只使用base_url
+        self.endpoints = []
+        self.load_balancing = "least_outstanding"
+        self.circuit_failure_threshold = 5
+        self.circuit_reset_timeout = 30
+        self.health_check_interval = 0
+        self.cache_enabled = False
+        self.cache_path = ".cache/llm_responses.sqlite"
+        self.cache_ttl = 0
+        self.cache_max_entries = 1000000
+        # 响应格式："text"按“输入：/输出：”等标记解析，"json"请求结构化JSON输出
+        self.response_format = "text"
+        # 每个实例生成请求打包的指令数，1表示每条指令单独请求
+        self.instances_per_prompt = 1
+        # 单条实例以流式方式生成，部分输出已被过滤规则拒绝时提前中止请求（打包请求不使用流式）
+        self.stream_responses = False
         self.num_seed_examples = 3
+        self.instructions_per_prompt = 8
+        # 种子示例采样方式：uniform从整个数据池均匀抽样，diversity按数据池聚类优先抽取较少出现的类型
+        self.seed_sampler = "uniform"
+        self.seed_clusters = 32
+        # diversity采样使用的向量：hashing为字符n-gram哈希（无需模型），model为embedding_model
+        self.seed_embedding = "hashing"
+        self.max_instruction_requests = 0
+        self.pipeline_instruction_workers = 2
+        self.pipeline_instance_workers = 0
+        self.pipeline_queue_size = 64
         self.min_instruction_length = 5
         self.min_output_length = 5
+        self.dedup_mode = "exact"
+        self.minhash_threshold = 0.7
+        self.minhash_num_perm = 64
+        self.minhash_ngram = 3
+        self.embedding_model = "paraphrase-multilingual-MiniLM-L12-v2"
+        self.embedding_device = None
+        # 新指令与数据池的语义相似度阈值，0表示不做语义去重
+        self.semantic_dedup_threshold = 0
+        # 常驻嵌入服务地址（python -m src.embedding_service），为空时在本进程加载模型
+        self.embedding_server = ""
+        # 启用语义去重时，在第一轮指令生成期间于后台加载嵌入模型
+        self.embedding_preload = True
+        self.filter_workers = 0
+        self.queue_lease_seconds = 120
+        self.queue_batch_size = 16
+        self.queue_max_attempts = 3
+        self.queue_poll_interval = 1.0
+        # 过滤规则按列表创建，每条包含规则名称name、可选的enabled和该规则的参数
+        self.filter_rules = [
+            {"name": "instruction_length"},
+            {"name": "output_length"},
+            {"name": "invalid_output"},
+            {"name": "blacklist"},
+            {"name": "apology"},
+            {"name": "echo", "enabled": False},
+            {"name": "repetition", "enabled": False, "ngram": 4, "max_ratio": 0.5, "min_length": 50},
+            {"name": "language", "enabled": False, "language": "zh", "min_ratio": 0.2},
+            {"name": "rouge_overlap", "enabled": False, "threshold": 0.7},
+        ]
+        self.filter_reorder_interval = 1000
         self.blacklist_keywords = ["色情", "暴力", "仇恨言论", "歧视", "政治", "宗教"]
         
         # 如果提供了配置文件路径，则加载配置
@@ -63,6 +136,18 @@ class Config:
         
         print(f"配置已保存到: {config_path}")
     
+    def fingerprint(self) -> str:
+        """返回配置内容的哈希（不含各处的api_key），用于判断断点恢复时配置是否变化"""
+        config_dict = {
+            key: value for key, value in self.__dict__.items()
+            if not key.startswith('_') and key != 'api_key'
+        }
+        config_dict['endpoints'] = [
+            {k: v for k, v in endpoint.items() if k != 'api_key'} for endpoint in self.endpoints
+        ]
+        payload = json.dumps(config_dict, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
     def __str__(self) -> str:
         """返回配置的字符串表示"""
         config_str = "配置信息:\n"
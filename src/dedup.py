@@ -0,0 +1,202 @@
+import re
+import unicodedata
+import zlib
+from collections import defaultdict
+from typing import List, Dict, Any, Iterable, Optional, TYPE_CHECKING
+
+from .metrics import metrics
+from .pool import iter_field
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# MinHash使用的梅森素数及随机排列参数范围（保证a*x+b不溢出uint64）
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_PUNCTUATION_RE = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：全角转半角、转小写、去除空白和标点"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _PUNCTUATION_RE.sub("", text)
+
+
+def char_ngrams(text: str, n: int = 3) -> set:
+    """字符n-gram集合，对中文等无空格分词的语言同样适用"""
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _choose_bands(num_perm: int, threshold: float) -> int:
+    """选择LSH分段数，使S曲线拐点(1/b)^(1/r)最接近阈值"""
+    best_bands, best_error = 1, float("inf")
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands:
+            continue
+        rows = num_perm // bands
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if error < best_error:
+            best_bands, best_error = bands, error
+    return best_bands
+
+
+class MinHashLSH:
+    """基于字符n-gram的MinHash签名和LSH分桶，用于增量检测近似重复文本"""
+
+    def __init__(self, threshold: float = 0.7, num_perm: int = 64, ngram: int = 3, seed: int = 1):
+        """
+        Args:
+            threshold: Jaccard相似度阈值，估计值达到该值视为重复
+            num_perm: MinHash排列数（签名长度）
+            ngram: 字符n-gram长度
+            seed: 随机排列种子，同一种子生成的签名可相互比较
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.ngram = ngram
+        self.bands = _choose_bands(num_perm, threshold)
+        self.rows = num_perm // self.bands
+
+        import numpy as np
+
+        # 系数取满[0, p)范围：系数过小时a*h+b不会对p取模回绕，各排列保持同一顺序，
+        # 签名退化为同一个最小n-gram的重复
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._buckets = [defaultdict(list) for _ in range(self.bands)]
+        self._signatures: List["np.ndarray"] = []
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def signature(self, text: str) -> "np.ndarray":
+        """计算规范化文本的MinHash签名"""
+        import numpy as np
+
+        shingles = char_ngrams(text, self.ngram)
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) & _MAX_HASH for s in shingles),
+            dtype=np.uint64, count=len(shingles)
+        )
+        # uint64乘法按2^64回绕，与datasketch的做法相同，结果截断到32位
+        permuted = ((hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME) & _MAX_HASH
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature: "np.ndarray") -> Iterable[bytes]:
+        for band in range(self.bands):
+            yield signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def query(self, signature: "np.ndarray") -> bool:
+        """判断签名是否与已索引的某条文本近似重复"""
+        checked = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            for candidate in self._buckets[band].get(key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                similarity = (self._signatures[candidate] == signature).mean()
+                if similarity >= self.threshold:
+                    return True
+        return False
+
+    def add(self, signature: "np.ndarray") -> None:
+        """将签名加入索引"""
+        item_id = len(self._signatures)
+        self._signatures.append(signature)
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band][key].append(item_id)
+
+
+class InstructionIndex:
+    """指令去重索引：规范化文本哈希集合，可选MinHash/LSH近似重复检测
+
+    索引可跨迭代增量维护，sync只处理数据池新增的尾部条目。
+    """
+
+    def __init__(self, mode: str = "exact", threshold: float = 0.7, num_perm: int = 64, ngram: int = 3):
+        """
+        Args:
+            mode: "exact"只检测规范化后完全相同的文本，"minhash"同时检测近似重复
+            threshold: 近似重复的Jaccard相似度阈值
+            num_perm: MinHash排列数
+            ngram: 字符n-gram长度
+        """
+        if mode not in ("exact", "minhash"):
+            raise ValueError(f"不支持的去重模式: {mode}")
+        self.mode = mode
+        self._keys = set()
+        self._lsh = MinHashLSH(threshold, num_perm, ngram) if mode == "minhash" else None
+        self._synced = 0
+
+    @classmethod
+    def from_config(cls, config) -> "InstructionIndex":
+        """根据配置创建索引"""
+        return cls(
+            mode=config.dedup_mode,
+            threshold=config.minhash_threshold,
+            num_perm=config.minhash_num_perm,
+            ngram=config.minhash_ngram
+        )
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, text: str) -> bool:
+        return self.is_duplicate(text)
+
+    def is_duplicate(self, text: str) -> bool:
+        """判断文本是否与已索引文本重复"""
+        key = normalize_text(text)
+        if key in self._keys:
+            return True
+        return self._lsh is not None and self._lsh.query(self._lsh.signature(key))
+
+    def add(self, text: str) -> None:
+        """将文本加入索引（已存在的相同文本不重复加入）"""
+        key = normalize_text(text)
+        if key in self._keys:
+            return
+        self._keys.add(key)
+        if self._lsh is not None:
+            self._lsh.add(self._lsh.signature(key))
+
+    def add_if_new(self, text: str) -> bool:
+        """文本不重复时加入索引
+
+        Returns:
+            是否为新文本
+        """
+        metrics.inc("dedup_checked_total", stage="instruction")
+        key = normalize_text(text)
+        if key in self._keys:
+            metrics.inc("dedup_dropped_total", stage="instruction")
+            return False
+        if self._lsh is not None:
+            signature = self._lsh.signature(key)
+            if self._lsh.query(signature):
+                metrics.inc("dedup_dropped_total", stage="instruction")
+                return False
+            self._lsh.add(signature)
+        self._keys.add(key)
+        return True
+
+    def filter(self, texts: List[str]) -> List[str]:
+        """过滤掉与索引或同批更早文本重复的文本，保留的文本加入索引"""
+        return [text for text in texts if self.add_if_new(text)]
+
+    def sync(self, pool: List[Dict[str, Any]], key: str = "instruction") -> None:
+        """将数据池中尚未索引的尾部条目加入索引（数据池只追加不删除）"""
+        if len(pool) < self._synced:
+            # 传入的不是同一个数据池，从头重建
+            self.__init__(self.mode, *self._lsh_params())
+        for text in iter_field(pool, key, self._synced):
+            self.add(text)
+        self._synced = len(pool)
+
+    def _lsh_params(self):
+        if self._lsh is None:
+            return ()
+        return (self._lsh.threshold, self._lsh.num_perm, self._lsh.ngram)
@@ -0,0 +1,342 @@
+import json
+import os
+import threading
+import time
+import zlib
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from .dedup import char_ngrams, normalize_text
+from .metrics import metrics
+from .pool import iter_field
+
+DEFAULT_EMBEDDING_MODEL = 'paraphrase-multilingual-MiniLM-L12-v2'
+
+# 每次矩阵乘法处理的池向量行数，限制相似度矩阵的内存占用
+SEARCH_CHUNK_ROWS = 65536
+# 池规模超过该值且安装了faiss时使用HNSW近似最近邻检索
+ANN_MIN_POOL_SIZE = 50000
+
+# 进程内缓存已加载的模型，避免每次去重都重新加载
+_models: Dict[Tuple[str, str], Any] = {}
+_models_lock = threading.Lock()
+
+
+def get_embedding_model(model_name: str = DEFAULT_EMBEDDING_MODEL, device: str = None, server_url: str = None):
+    """获取进程内共享的SentenceTransformer模型
+
+    模型只加载一次；加载期间其他线程的调用会等待加载完成而不是重复加载。
+
+    Args:
+        model_name: 模型名称或路径
+        device: 运行设备，如"cpu"、"cuda"，None表示自动选择
+        server_url: 嵌入服务地址（见src.embedding_service），指定时返回远程模型，本进程不加载模型
+
+    Returns:
+        SentenceTransformer模型，或encode接口相同的RemoteEmbeddingModel
+    """
+    if server_url:
+        from .embedding_service import RemoteEmbeddingModel
+        return RemoteEmbeddingModel(server_url, model_name, device)
+
+    key = (model_name, device or "")
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            try:
+                model = SentenceTransformer(model_name, device=device)
+            except RuntimeError as e:
+                if device in (None, "cpu"):
+                    raise
+                # 指定设备不可用（如没有GPU）时退回CPU
+                print(f"警告: 无法在{device}上加载嵌入模型({e})，改用CPU")
+                model = SentenceTransformer(model_name, device="cpu")
+            _models[key] = model
+        return model
+
+
+def preload_embedding_model(model_name: str = DEFAULT_EMBEDDING_MODEL, device: str = None,
+                            server_url: str = None) -> threading.Thread:
+    """在后台线程中加载嵌入模型，与LLM请求等其他工作重叠进行
+
+    使用嵌入服务时发送一次预热请求，让服务端提前加载模型。加载失败（如未安装
+    sentence-transformers）只打印警告，实际使用时再按原逻辑处理。
+
+    Returns:
+        加载线程
+    """
+    def load():
+        try:
+            get_embedding_model(model_name, device, server_url).encode(["预热"], show_progress_bar=False)
+        except Exception as e:
+            print(f"警告: 预加载嵌入模型失败: {e}")
+
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+    return thread
+
+
+class HashingEmbeddingModel:
+    """字符n-gram特征哈希向量，encode接口与SentenceTransformer相同
+
+    不需要模型和额外依赖，编码几乎没有开销，只反映字面相似度。适合对数据池做粗粒度聚类
+    （如种子采样），不适合语义去重。
+    """
+
+    def __init__(self, dim: int = 256, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+
+    def encode(self, texts: List[str], batch_size: int = 64, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = True, show_progress_bar: bool = False) -> np.ndarray:
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for gram in char_ngrams(normalize_text(text), self.ngram):
+                embeddings[row, zlib.crc32(gram.encode("utf-8")) % self.dim] += 1.0
+        return _normalize(embeddings) if normalize_embeddings else embeddings
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    """按行L2归一化为float32"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim == 1:
+        embeddings = embeddings[None, :]
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+class EmbeddingIndex:
+    """增量维护的归一化嵌入索引，用于语义去重
+
+    池向量以float32存放；指定path时存放在内存映射文件中，可跨迭代、跨进程复用。
+    相似度通过分块矩阵乘法批量计算，安装了faiss且池足够大时使用HNSW近似检索。
+    """
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, path: str = None,
+                 device: str = None, batch_size: int = 64, use_ann: bool = True, server_url: str = None,
+                 model=None):
+        """
+        Args:
+            model_name: 嵌入模型名称
+            path: 内存映射文件路径，None表示只保存在内存中
+            device: 嵌入模型运行设备，None表示自动选择
+            batch_size: 编码批大小
+            use_ann: 是否在可用时使用faiss近似检索
+            server_url: 嵌入服务地址，指定时由常驻的嵌入服务进程编码
+            model: 直接使用的模型对象（需提供encode方法，如HashingEmbeddingModel），
+                指定时忽略device和server_url；model_name仍用于区分持久化的索引
+        """
+        self.model_name = model_name
+        self.path = path
+        self.device = device
+        self.server_url = server_url
+        self.model = model
+        self.batch_size = batch_size
+        self.use_ann = use_ann
+        self.dim = None
+        self._count = 0
+        self._data = None
+        self._ann = None
+
+        if path and os.path.exists(self._meta_path):
+            self._load()
+
+    @property
+    def _meta_path(self) -> str:
+        return f"{self.path}.meta.json"
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """已索引的归一化嵌入（只读视图）"""
+        if self._data is None:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return self._data[:self._count]
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """将文本编码为归一化的float32向量"""
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        start = time.perf_counter()
+        model = self.model or get_embedding_model(self.model_name, self.device, self.server_url)
+        embeddings = model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        # 包含首次调用时等待模型加载的时间
+        metrics.observe("embedding_encode_seconds", time.perf_counter() - start)
+        metrics.inc("embedding_texts_total", len(texts))
+        return _normalize(embeddings)
+
+    def add(self, texts: List[str]) -> None:
+        """编码并加入索引"""
+        self.add_embeddings(self.encode(texts))
+
+    def add_embeddings(self, embeddings: np.ndarray) -> None:
+        """将向量加入索引
+
+        Args:
+            embeddings: 形状为(n, dim)的向量，会被归一化
+        """
+        embeddings = _normalize(embeddings)
+        if len(embeddings) == 0:
+            return
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        self._reserve(self._count + len(embeddings))
+        self._data[self._count:self._count + len(embeddings)] = embeddings
+        self._count += len(embeddings)
+        if self._ann is not None:
+            self._ann.add(embeddings)
+        elif self._should_use_ann():
+            self._build_ann()
+        if self.path:
+            self._save_meta()
+
+    def sync(self, pool: List[Dict[str, Any]], key: str = "instruction") -> None:
+        """将数据池中尚未索引的尾部条目加入索引（数据池只追加不删除）"""
+        if len(pool) > self._count:
+            self.add(list(iter_field(pool, key, self._count)))
+
+    def max_similarity(self, embeddings: np.ndarray) -> np.ndarray:
+        """计算每个查询向量与索引中最相似向量的余弦相似度
+
+        Args:
+            embeddings: 形状为(n, dim)的查询向量
+
+        Returns:
+            长度为n的最大相似度数组，索引为空时为-1
+        """
+        queries = _normalize(embeddings)
+        best = np.full(len(queries), -1.0, dtype=np.float32)
+        if self._count == 0 or len(queries) == 0:
+            return best
+
+        if self._ann is not None:
+            scores, _ = self._ann.search(queries, 1)
+            return scores[:, 0]
+
+        for start in range(0, self._count, SEARCH_CHUNK_ROWS):
+            chunk = self._data[start:min(start + SEARCH_CHUNK_ROWS, self._count)]
+            np.maximum(best, (queries @ chunk.T).max(axis=1), out=best)
+        return best
+
+    def filter_embeddings(self, embeddings: np.ndarray, threshold: float) -> np.ndarray:
+        """判断每条新向量是否与索引及同批中更早保留的向量都不相似
+
+        Args:
+            embeddings: 形状为(n, dim)的新向量
+            threshold: 相似度阈值，达到该值视为重复
+
+        Returns:
+            长度为n的布尔数组，True表示保留
+        """
+        embeddings = _normalize(embeddings)
+        keep = self.max_similarity(embeddings) < threshold
+
+        # 同批去重：按顺序保留，与已保留条目相似的后续条目丢弃
+        batch_sim = embeddings @ embeddings.T
+        kept = []
+        for i in range(len(embeddings)):
+            if not keep[i]:
+                continue
+            if kept and batch_sim[i, kept].max() >= threshold:
+                keep[i] = False
+            else:
+                kept.append(i)
+        return keep
+
+    def deduplicate(self, items: List[Dict[str, Any]], threshold: float = 0.8,
+                    key: str = "instruction", add: bool = True) -> List[Dict[str, Any]]:
+        """语义去重
+
+        Args:
+            items: 新数据
+            threshold: 相似度阈值
+            key: 用于比较的字段
+            add: 是否将保留的数据加入索引（调用方需将其全部加入数据池）
+
+        Returns:
+            去重后的新数据
+        """
+        if not items:
+            return []
+        embeddings = self.encode([d[key] for d in items])
+        keep = self.filter_embeddings(embeddings, threshold)
+        if add:
+            self.add_embeddings(embeddings[keep])
+        return [item for item, k in zip(items, keep) if k]
+
+    def _reserve(self, size: int) -> None:
+        """保证存储容量不小于size，容量不足时按倍数扩容"""
+        capacity = 0 if self._data is None else len(self._data)
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2, 1024)
+
+        if not self.path:
+            data = np.zeros((new_capacity, self.dim), dtype=np.float32)
+            if self._count:
+                data[:self._count] = self._data[:self._count]
+            self._data = data
+            return
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self._data is not None:
+            self._data.flush()
+            self._data = None
+        with open(self.path, 'ab') as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._data = np.memmap(self.path, dtype=np.float32, mode='r+', shape=(new_capacity, self.dim))
+
+    def _save_meta(self) -> None:
+        """刷新内存映射并原子写入元数据"""
+        self._data.flush()
+        tmp_path = f"{self._meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"model": self.model_name, "dim": self.dim, "count": self._count}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _load(self) -> None:
+        """从内存映射文件恢复索引"""
+        with open(self._meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta["model"] != self.model_name:
+            print(f"警告: 嵌入索引由{meta['model']}生成，与当前模型{self.model_name}不一致，重新建立索引")
+            return
+        self.dim = meta["dim"]
+        self._count = meta["count"]
+        if self._count:
+            capacity = os.path.getsize(self.path) // (self.dim * 4)
+            self._data = np.memmap(self.path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+            if self._should_use_ann():
+                self._build_ann()
+
+    def _should_use_ann(self) -> bool:
+        return self.use_ann and self._count >= ANN_MIN_POOL_SIZE and _faiss() is not None
+
+    def _build_ann(self) -> None:
+        """用已有向量构建faiss HNSW索引"""
+        faiss = _faiss()
+        self._ann = faiss.IndexHNSWFlat(self.dim, 32, faiss.METRIC_INNER_PRODUCT)
+        for start in range(0, self._count, SEARCH_CHUNK_ROWS):
+            self._ann.add(np.ascontiguousarray(self._data[start:min(start + SEARCH_CHUNK_ROWS, self._count)]))
+
+
+def _faiss():
+    """faiss为可选依赖，未安装时使用numpy精确检索"""
+    try:
+        import faiss
+        return faiss
+    except ImportError:
+        return None
@@ -0,0 +1,147 @@
+import argparse
+import base64
+import json
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from .embedding import DEFAULT_EMBEDDING_MODEL, get_embedding_model
+
+# 请求嵌入服务的超时时间（秒），首次请求可能需要等待服务端加载模型
+REQUEST_TIMEOUT = 600
+
+
+class RemoteEmbeddingModel:
+    """通过HTTP调用常驻嵌入服务的模型，encode接口与SentenceTransformer相同
+
+    多次CLI运行共享同一个已加载模型的服务进程，省去每次启动时导入torch和加载模型的时间。
+    """
+
+    def __init__(self, server_url: str, model_name: str = DEFAULT_EMBEDDING_MODEL, device: str = None):
+        """
+        Args:
+            server_url: 服务地址，如"http://127.0.0.1:8765"
+            model_name: 模型名称，服务端按名称加载并缓存
+            device: 服务端运行设备，None表示使用服务端默认设备
+        """
+        self.server_url = server_url.rstrip("/")
+        self.model_name = model_name
+        self.device = device
+
+    def encode(self, texts: List[str], batch_size: int = 64, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = True, show_progress_bar: bool = False):
+        """编码文本
+
+        Returns:
+            形状为(n, dim)的float32数组，已归一化
+        """
+        import numpy as np
+
+        body = json.dumps({
+            "model": self.model_name,
+            "device": self.device,
+            "texts": list(texts),
+            "batch_size": batch_size,
+        }, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(
+            f"{self.server_url}/encode", data=body, headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+            result = json.loads(response.read())
+        embeddings = np.frombuffer(base64.b64decode(result["embeddings"]), dtype=np.float32)
+        return embeddings.reshape(len(texts), result["dim"])
+
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    """POST /encode 编码文本，GET /health 返回已加载的模型"""
+
+    default_device = None
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_error(404)
+            return
+        from .embedding import _models
+        self._send_json({"status": "ok", "models": [name for name, _ in _models]})
+
+    def do_POST(self):
+        if self.path != "/encode":
+            self.send_error(404)
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            texts = request["texts"]
+            model = get_embedding_model(
+                request.get("model") or DEFAULT_EMBEDDING_MODEL, request.get("device") or self.default_device
+            )
+            start = time.perf_counter()
+            embeddings = model.encode(
+                texts,
+                batch_size=request.get("batch_size", 64),
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            self._send_json({"error": str(e)}, status=500)
+            return
+
+        import numpy as np
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(texts), -1)
+        self._send_json({
+            "dim": embeddings.shape[1],
+            "embeddings": base64.b64encode(embeddings.tobytes()).decode("ascii"),
+            "seconds": elapsed,
+        })
+
+    def _send_json(self, payload, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, model_name: str = None, device: str = None):
+    """启动嵌入服务并阻塞运行
+
+    Args:
+        host: 监听地址
+        port: 监听端口
+        model_name: 启动时预加载的模型，None表示收到第一个请求时再加载
+        device: 请求未指定设备时使用的设备
+    """
+    EmbeddingRequestHandler.default_device = device
+    server = ThreadingHTTPServer((host, port), EmbeddingRequestHandler)
+    if model_name:
+        # 后台加载，服务立即可用，加载期间到达的请求会等待加载完成
+        threading.Thread(target=get_embedding_model, args=(model_name, device), daemon=True).start()
+    print(f"嵌入服务: http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='常驻嵌入模型服务，供多次CLI运行共享')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口')
+    parser.add_argument('--model', type=str, default=DEFAULT_EMBEDDING_MODEL, help='预加载的嵌入模型')
+    parser.add_argument('--device', type=str, default=None, help='运行设备，如cpu、cuda')
+    parser.add_argument('--no_preload', action='store_true', help='收到第一个请求时再加载模型')
+    args = parser.parse_args()
+    serve(args.host, args.port, None if args.no_preload else args.model, args.device)
+
+
+if __name__ == "__main__":
+    main()
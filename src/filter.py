@@ -1,66 +1,451 @@
-from typing import Dict, List, Any
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Optional, Tuple
 import re
 
+from .dedup import InstructionIndex, normalize_text
+from .metrics import metrics
+
+# 无效输出（比较前转为小写）
+INVALID_OUTPUTS = ["n/a", "我不知道", "不知道", "无法回答", "无法提供", "抱歉", ""]
+
+# 道歉或拒绝回答的表达
+APOLOGY_PATTERNS = [
+    "抱歉", "对不起", "很遗憾", "无法回答", "无法提供",
+    "sorry", "apologize", "cannot answer", "can't provide"
+]
+
+# 数据量少于该值时不启用进程池
+PARALLEL_MIN_SIZE = 20000
+
+# 规则注册表：规则名称 → 规则类
+FILTER_RULES: Dict[str, type] = {}
+
+# 进程池中每个worker持有的过滤器副本，由_init_filter_worker在进程启动时设置
+_worker_filter: Optional["DataFilter"] = None
+
+
+def register_rule(name: str):
+    """注册过滤规则的装饰器，注册后即可在配置的filter_rules中按名称启用"""
+    def decorator(cls):
+        cls.name = name
+        FILTER_RULES[name] = cls
+        return cls
+    return decorator
+
+
+def compile_keywords(keywords: List[str]) -> Optional["re.Pattern"]:
+    """将关键词列表编译为一个正则（较长的关键词优先），一次扫描即可判断是否命中任一关键词"""
+    keywords = sorted({k.lower() for k in keywords if k}, key=len, reverse=True)
+    if not keywords:
+        return None
+    return re.compile("|".join(re.escape(k) for k in keywords))
+
+
+class Sample:
+    """待检查的数据，小写形式按需计算并在各规则间共享"""
+
+    __slots__ = ("instruction", "input", "output", "_instruction_lower", "_output_lower")
+
+    def __init__(self, instruction: str, input_text: str, output: str):
+        self.instruction = instruction
+        self.input = input_text
+        self.output = output
+        self._instruction_lower = None
+        self._output_lower = None
+
+    @property
+    def instruction_lower(self) -> str:
+        if self._instruction_lower is None:
+            self._instruction_lower = self.instruction.lower()
+        return self._instruction_lower
+
+    @property
+    def output_lower(self) -> str:
+        if self._output_lower is None:
+            self._output_lower = self.output.lower()
+        return self._output_lower
+
+
+class FilterRule:
+    """过滤规则基类
+
+    子类实现rejects，返回True表示拒绝该数据。构造参数来自配置中filter_rules对应条目的其余字段。
+    """
+
+    name = None
+
+    def __init__(self, config, **params):
+        self.config = config
+        # 运行统计，用于按代价和拒绝率排序
+        self.calls = 0
+        self.hits = 0
+        self.seconds = 0.0
+
+    def rejects(self, sample: Sample) -> bool:
+        raise NotImplementedError
+
+    def rejects_partial(self, sample: Sample) -> bool:
+        """流式生成中只有部分输出时能否断定拒绝
+
+        只有当任何以当前输出为前缀的完整输出都会被rejects拒绝时才能返回True，
+        默认不做判断（只依赖指令或对前缀单调的规则才需要覆盖）。
+        """
+        return False
+
+    def sync(self, pool: List[Dict[str, Any]]) -> None:
+        """需要参考数据池的规则在此增量同步，默认不做任何事"""
+
+    @property
+    def cost_per_rejection(self) -> float:
+        """平均每次拒绝所花费的检查时间，越小越应该排在前面"""
+        if not self.calls:
+            return 0.0
+        reject_rate = max(self.hits / self.calls, 1e-6)
+        return (self.seconds / self.calls) / reject_rate
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "rejections": self.hits,
+            "reject_rate": self.hits / self.calls if self.calls else 0.0,
+            "total_seconds": self.seconds,
+            "avg_microseconds": self.seconds / self.calls * 1e6 if self.calls else 0.0,
+        }
+
+
+@register_rule("instruction_length")
+class InstructionLengthRule(FilterRule):
+    """指令长度检测"""
+
+    def __init__(self, config, min_length: int = None, **params):
+        super().__init__(config, **params)
+        self.min_length = config.min_instruction_length if min_length is None else min_length
+
+    def rejects(self, sample: Sample) -> bool:
+        return len(sample.instruction) < self.min_length
+
+    def rejects_partial(self, sample: Sample) -> bool:
+        # 只依赖指令，不必等待输出
+        return self.rejects(sample)
+
+
+@register_rule("output_length")
+class OutputLengthRule(FilterRule):
+    """输出长度检测，可选最大长度"""
+
+    def __init__(self, config, min_length: int = None, max_length: int = 0, **params):
+        super().__init__(config, **params)
+        self.min_length = config.min_output_length if min_length is None else min_length
+        self.max_length = max_length
+
+    def rejects(self, sample: Sample) -> bool:
+        length = len(sample.output)
+        return length < self.min_length or (self.max_length and length > self.max_length)
+
+    def rejects_partial(self, sample: Sample) -> bool:
+        return bool(self.max_length) and len(sample.output) > self.max_length
+
+
+@register_rule("invalid_output")
+class InvalidOutputRule(FilterRule):
+    """输出相关性检测：整个输出为无效回答"""
+
+    def __init__(self, config, values: List[str] = None, **params):
+        super().__init__(config, **params)
+        self.values = frozenset(v.lower() for v in (INVALID_OUTPUTS if values is None else values))
+
+    def rejects(self, sample: Sample) -> bool:
+        return sample.output_lower in self.values
+
+
+@register_rule("blacklist")
+class BlacklistRule(FilterRule):
+    """关键词黑名单过滤（指令）"""
+
+    def __init__(self, config, keywords: List[str] = None, **params):
+        super().__init__(config, **params)
+        self.pattern = compile_keywords(config.blacklist_keywords if keywords is None else keywords)
+
+    def rejects(self, sample: Sample) -> bool:
+        return self.pattern is not None and self.pattern.search(sample.instruction_lower) is not None
+
+    def rejects_partial(self, sample: Sample) -> bool:
+        # 只依赖指令，不必等待输出
+        return self.rejects(sample)
+
+
+@register_rule("apology")
+class ApologyRule(FilterRule):
+    """输出中不应包含抱歉、歉意等表达"""
+
+    def __init__(self, config, patterns: List[str] = None, **params):
+        super().__init__(config, **params)
+        self.pattern = compile_keywords(APOLOGY_PATTERNS if patterns is None else patterns)
+
+    def rejects(self, sample: Sample) -> bool:
+        return self.pattern is not None and self.pattern.search(sample.output_lower) is not None
+
+    def rejects_partial(self, sample: Sample) -> bool:
+        # 前缀中出现的道歉表达在完整输出中仍然存在
+        return self.rejects(sample)
+
+
+@register_rule("language")
+class LanguageRule(FilterRule):
+    """语言检测：按中日韩字符占比判断输出是否为期望的语言"""
+
+    def __init__(self, config, language: str = "zh", min_ratio: float = 0.2, field: str = "output", **params):
+        super().__init__(config, **params)
+        if language not in ("zh", "en"):
+            raise ValueError(f"语言检测规则不支持的语言: {language}")
+        self.language = language
+        self.min_ratio = min_ratio
+        self.field = field
+
+    def rejects(self, sample: Sample) -> bool:
+        text = getattr(sample, self.field)
+        letters = [ch for ch in text if ch.isalpha()]
+        if not letters:
+            return False
+        cjk_ratio = sum(1 for ch in letters if '⺀' <= ch <= '鿿') / len(letters)
+        if self.language == "zh":
+            return cjk_ratio < self.min_ratio
+        return (1 - cjk_ratio) < self.min_ratio
+
+
+@register_rule("repetition")
+class RepetitionRule(FilterRule):
+    """重复度检测：输出中重复的字符n-gram占比过高（模型复读）"""
+
+    def __init__(self, config, ngram: int = 4, max_ratio: float = 0.5, min_length: int = 50, **params):
+        super().__init__(config, **params)
+        self.ngram = ngram
+        self.max_ratio = max_ratio
+        self.min_length = min_length
+
+    def rejects(self, sample: Sample) -> bool:
+        text = sample.output
+        if len(text) < self.min_length:
+            return False
+        total = len(text) - self.ngram + 1
+        distinct = len({text[i:i + self.ngram] for i in range(total)})
+        return 1 - distinct / total > self.max_ratio
+
+
+@register_rule("echo")
+class EchoRule(FilterRule):
+    """回显检测：输出只是重复了输入或指令"""
+
+    def __init__(self, config, empty_inputs: List[str] = None, **params):
+        super().__init__(config, **params)
+        self.empty_inputs = frozenset(empty_inputs or ["", "无"])
+
+    def rejects(self, sample: Sample) -> bool:
+        output = normalize_text(sample.output)
+        if output == normalize_text(sample.instruction):
+            return True
+        return sample.input not in self.empty_inputs and output == normalize_text(sample.input)
+
+
+@register_rule("rouge_overlap")
+class RougeOverlapRule(FilterRule):
+    """与数据池指令近似重复检测（字符n-gram MinHash估计的相似度，近似Self-Instruct的ROUGE-L过滤）"""
+
+    def __init__(self, config, threshold: float = 0.7, num_perm: int = 64, ngram: int = 3, **params):
+        super().__init__(config, **params)
+        self.index = InstructionIndex("minhash", threshold, num_perm, ngram)
+
+    def sync(self, pool: List[Dict[str, Any]]) -> None:
+        self.index.sync(pool)
+
+    def rejects(self, sample: Sample) -> bool:
+        return self.index.is_duplicate(sample.instruction)
+
+    def rejects_partial(self, sample: Sample) -> bool:
+        # 只依赖指令，不必等待输出
+        return self.rejects(sample)
+
+
+def build_rules(config) -> List[FilterRule]:
+    """根据配置中的filter_rules创建规则列表"""
+    rules = []
+    for spec in config.filter_rules:
+        spec = dict(spec)
+        name = spec.pop("name")
+        if not spec.pop("enabled", True):
+            continue
+        if name not in FILTER_RULES:
+            raise ValueError(f"未知的过滤规则: {name}，可用规则: {', '.join(FILTER_RULES)}")
+        rules.append(FILTER_RULES[name](config, **spec))
+    return rules
+
+
+def _init_filter_worker(data_filter: "DataFilter") -> None:
+    global _worker_filter
+    _worker_filter = data_filter
+
+
+def _filter_chunk(fields: List[Tuple[str, str, str]]) -> Tuple[List[bool], Dict[str, Tuple[int, int, float]]]:
+    """进程池中执行的过滤任务，过滤器在worker启动时传入一次，每个任务只传输(指令, 输入, 输出)
+
+    过滤器副本可能带有父进程已合并的统计或上一块的统计，先清零，只返回本块的增量。
+
+    Returns:
+        (保留标记, {规则名称: (调用次数, 拒绝次数, 耗时)})
+    """
+    data_filter = _worker_filter
+    for rule in data_filter.rules:
+        rule.calls = rule.hits = 0
+        rule.seconds = 0.0
+    mask = [data_filter.check_fields(*item) is None for item in fields]
+    return mask, {rule.name: (rule.calls, rule.hits, rule.seconds) for rule in data_filter.rules}
+
+
 class DataFilter:
-    """数据过滤器，负责清洗低质量数据"""
-    
+    """数据过滤器，负责清洗低质量数据
+
+    规则从配置的filter_rules创建。运行中按实测的“平均每次拒绝耗时”（单次耗时/拒绝率）
+    定期重排规则顺序，让便宜且拒绝率高的规则先执行，尽早短路。
+    """
+
     def __init__(self, config):
         self.config = config
-        self.blacklist = config.blacklist_keywords
-        self.min_instruction_length = config.min_instruction_length
-        self.min_output_length = config.min_output_length
-        self.invalid_outputs = ["n/a", "我不知道", "不知道", "无法回答", "无法提供", "抱歉", ""]
-    
+        self.num_workers = config.filter_workers
+        self.reorder_interval = config.filter_reorder_interval
+        self.rules = build_rules(config)
+        self._since_reorder = 0
+
+        # 各规则的拒绝次数
+        self.rejections = Counter()
+
+    def sync(self, pool: List[Dict[str, Any]]) -> None:
+        """让需要参考数据池的规则同步数据池新增部分"""
+        for rule in self.rules:
+            rule.sync(pool)
+
+    def check(self, instance: Dict[str, str]) -> Optional[str]:
+        """检查数据实例，返回第一条未通过的规则名称
+
+        Args:
+            instance: 包含指令、输入和输出的字典
+
+        Returns:
+            未通过的规则名称，全部通过时返回None
+        """
+        return self.check_fields(instance["instruction"], instance.get("input", ""), instance["output"])
+
+    def check_fields(self, instruction: str, input_text: str, output: str) -> Optional[str]:
+        """按字段检查，参数为指令、输入和输出文本，返回值同check"""
+        sample = Sample(instruction, input_text, output)
+        rejected = None
+        for rule in self.rules:
+            start = time.perf_counter()
+            hit = rule.rejects(sample)
+            rule.seconds += time.perf_counter() - start
+            rule.calls += 1
+            if hit:
+                rule.hits += 1
+                rejected = rule.name
+                break
+
+        self._since_reorder += 1
+        if self.reorder_interval and self._since_reorder >= self.reorder_interval:
+            self.reorder()
+        return rejected
+
+    def check_partial(self, instruction: str, input_text: str, output: str) -> Optional[str]:
+        """检查流式生成中的部分输出，返回能够断定拒绝的规则名称
+
+        只调用各规则的rejects_partial，不计入规则统计；返回非None时完整输出必然也会被拒绝，
+        调用方可以提前中止生成。可在多个线程中并发调用。
+
+        Args:
+            instruction: 指令
+            input_text: 已解析出的输入
+            output: 已生成的部分输出
+
+        Returns:
+            断定拒绝的规则名称，无法断定时返回None
+        """
+        sample = Sample(instruction, input_text, output)
+        for rule in self.rules:
+            if rule.rejects_partial(sample):
+                return rule.name
+        return None
+
+    def reorder(self) -> None:
+        """按平均每次拒绝耗时从小到大重排规则"""
+        self.rules.sort(key=lambda rule: rule.cost_per_rejection)
+        self._since_reorder = 0
+
     def is_valid(self, instance: Dict[str, str]) -> bool:
         """检查数据实例是否有效
-        
+
         Args:
             instance: 包含指令、输入和输出的字典
-            
+
         Returns:
             数据是否有效
         """
-        # 规则1：指令长度检测
-        if len(instance["instruction"]) < self.min_instruction_length:
-            return False
-        
-        # 规则2：输出长度检测
-        if len(instance["output"]) < self.min_output_length:
-            return False
-        
-        # 规则3：输出相关性检测
-        if instance["output"].lower() in self.invalid_outputs:
-            return False
-        
-        # 规则4：关键词黑名单过滤
-        if self._contains_blacklist_keywords(instance["instruction"]):
-            return False
-        
-        # 规则5：输出中不应包含抱歉、歉意等表达
-        if self._contains_apology(instance["output"]):
-            return False
-        
-        return True
-    
-    def _contains_blacklist_keywords(self, text: str) -> bool:
-        """检查文本是否包含黑名单关键词"""
-        return any(word in text.lower() for word in self.blacklist)
-    
-    def _contains_apology(self, text: str) -> bool:
-        """检查输出是否包含道歉或拒绝回答的表达"""
-        apology_patterns = [
-            r"抱歉", r"对不起", r"很遗憾", r"无法回答", r"无法提供",
-            r"sorry", r"apologize", r"cannot answer", r"can't provide"
-        ]
-        return any(re.search(pattern, text.lower()) for pattern in apology_patterns)
-    
-    def filter_batch(self, instances: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        rule = self.check(instance)
+        self.record_result(rule)
+        return rule is None
+
+    def record_result(self, rule: Optional[str], count: int = 1) -> None:
+        """记录检查结果（包括在子进程或其他工作进程中完成的检查）
+
+        Args:
+            rule: 未通过的规则名称，通过时为None
+            count: 检查条数
+        """
+        metrics.inc("filter_checked_total", count)
+        if rule is not None:
+            self.rejections[rule] += count
+            metrics.inc("filter_rejections_total", count, rule=rule)
+
+    def rule_stats(self) -> Dict[str, Dict[str, Any]]:
+        """按当前执行顺序返回各规则的调用次数、拒绝次数和耗时"""
+        return {rule.name: rule.stats() for rule in self.rules}
+
+    def filter_batch(self, instances: List[Dict[str, str]], num_workers: int = None,
+                     chunk_size: int = 5000) -> List[Dict[str, str]]:
         """批量过滤数据
-        
+
         Args:
             instances: 数据实例列表
-            
+            num_workers: 进程数，默认使用配置中的filter_workers，0表示使用全部CPU核，1表示不启用进程池
+            chunk_size: 每个进程任务处理的数据量
+
         Returns:
             过滤后的数据实例列表
         """
-        return [inst for inst in instances if self.is_valid(inst)]
\ No newline at end of file
+        num_workers = self.num_workers if num_workers is None else num_workers
+        num_workers = num_workers or os.cpu_count() or 1
+        if num_workers <= 1 or len(instances) < PARALLEL_MIN_SIZE:
+            return [inst for inst in instances if self.is_valid(inst)]
+
+        chunks = [instances[i:i + chunk_size] for i in range(0, len(instances), chunk_size)]
+        fields = [[(inst["instruction"], inst.get("input", ""), inst["output"]) for inst in chunk] for chunk in chunks]
+        result = []
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_filter_worker,
+                                 initargs=(self,)) as executor:
+            for chunk, (mask, deltas) in zip(chunks, executor.map(_filter_chunk, fields)):
+                kept = [inst for inst, keep in zip(chunk, mask) if keep]
+                result.extend(kept)
+                self.record_result(None, len(kept))
+                self._merge_stats(deltas)
+        return result
+
+    def _merge_stats(self, deltas: Dict[str, Tuple[int, int, float]]) -> None:
+        """累加子进程返回的各规则统计增量"""
+        rules = {rule.name: rule for rule in self.rules}
+        for name, (calls, hits, seconds) in deltas.items():
+            rule = rules[name]
+            rule.calls += calls
+            rule.hits += hits
+            rule.seconds += seconds
+            if hits:
+                self.record_result(name, hits)
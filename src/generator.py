@@ -1,8 +1,18 @@
 import json
-import random
-from typing import List, Dict, Any
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 
-from .llm import LLMClient
+from .llm import LLMClient, AsyncLLMClient, StreamAborted, ResponseTruncated
+from .dedup import InstructionIndex
+from .metrics import metrics
+from .pool import get_field
+from .sampling import create_seed_sampler
+from .parsing import (
+    JSON_RESPONSE_FORMAT, ParseStats, parse_instruction_list, parse_instance_response, parse_packed_instances,
+    parse_partial_instance
+)
 from .utils import deduplicate_instructions
 
 class InstructionGenerator:
@@ -11,6 +21,19 @@ class InstructionGenerator:
     def __init__(self, config):
         self.config = config
         self.llm_client = LLMClient(config)
+        self.async_llm_client = AsyncLLMClient(config)
+        # 按上下文长度裁剪种子示例
+        self.budget = self.llm_client.budget
+        # 跨调用增量维护的去重索引，每次只同步数据池新增的部分
+        self.dedup_index = InstructionIndex.from_config(config)
+        # 种子示例采样器（diversity模式下缓存数据池向量并增量聚类）
+        self.seed_sampler = create_seed_sampler(config)
+        # 最近一次generate的请求数与产出统计
+        self.last_stats = {}
+        # 累计的响应解析统计
+        self.parse_stats = ParseStats("instruction")
+        # JSON模式下请求结构化输出，并在提示词末尾说明JSON格式
+        self.request_kwargs = {"response_format": JSON_RESPONSE_FORMAT} if config.response_format == "json" else {}
         self.prompt_template = """
 你是一个指令生成器。请基于以下示例生成{num_prompts}条新的、多样化的任务指令：
 {seed_examples}
@@ -23,69 +46,168 @@ class InstructionGenerator:
 5. 特别注意：生成至少三种不同任务类型（如创意写作、信息提取、逻辑推理）
 
 生成的指令列表：
+"""
+        self.json_format_hint = """
+请只输出一个JSON对象，格式为：{"instructions": ["指令1", "指令2", ...]}
 """
     
     def generate(self, seed_data: List[Dict[str, Any]], num_to_generate: int = 10) -> List[str]:
         """生成新指令
         
+        目标数量被拆分为多个较小的提示词（每个最多instructions_per_prompt条，种子示例各自独立采样）
+        并发发出，按已观察到的去重后产出率持续补发请求，直到达到目标数量或用完请求预算。
+        
         Args:
             seed_data: 种子数据列表
             num_to_generate: 要生成的指令数量
             
         Returns:
-            生成的新指令列表
+            生成的新指令列表（已去重，最多num_to_generate条）
         """
-        # 随机选择种子示例
-        sample_size = min(self.config.num_seed_examples, len(seed_data))
-        seed_samples = random.sample(seed_data, sample_size)
+        per_prompt = max(1, min(num_to_generate, self.config.instructions_per_prompt))
+        budget = self.config.max_instruction_requests or math.ceil(num_to_generate / per_prompt) * 4
+        max_workers = max(1, self.config.max_concurrency)
         
-        # 提取指令部分
-        seed_examples = "\n".join([f"- {d['instruction']}" for d in seed_samples])
+        # 去重（与数据池及历史生成的指令比较）
+        self.dedup_index.sync(seed_data)
+        # 在发出请求前编码数据池新增部分，避免各请求线程在采样时等待
+        self.seed_sampler.sync(seed_data)
+        accepted = []
+        stats = {"requests": 0, "failures": 0, "candidates": 0}
         
-        # 构建提示词
-        prompt = self.prompt_template.format(
-            num_prompts=num_to_generate,
-            seed_examples=seed_examples
-        )
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            in_flight = set()
+            
+            def top_up():
+                # 按目前的产出率估算还需要多少请求，在并发上限和预算内补发
+                remaining = num_to_generate - len(accepted)
+                finished = stats["requests"] - len(in_flight)
+                rate = len(accepted) / finished if finished and accepted else per_prompt
+                needed = math.ceil(remaining / max(rate, 1e-3))
+                while (len(in_flight) < min(max_workers, needed)
+                       and stats["requests"] < budget):
+                    in_flight.add(executor.submit(self.generate_candidates, seed_data, per_prompt))
+                    stats["requests"] += 1
+            
+            top_up()
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        candidates = future.result()
+                    except Exception as e:
+                        print(f"指令生成请求失败: {e}")
+                        stats["failures"] += 1
+                        continue
+                    stats["candidates"] += len(candidates)
+                    for candidate in candidates:
+                        if len(accepted) >= num_to_generate:
+                            break
+                        if self.dedup_index.add_if_new(candidate):
+                            accepted.append(candidate)
+                if len(accepted) >= num_to_generate:
+                    break
+                top_up()
+        finally:
+            # 已达目标或出错时不等待仍在进行中的请求，它们在后台完成后结果被丢弃（仍计入请求数）
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        stats["accepted"] = len(accepted)
+        metrics.inc("instructions_accepted_total", len(accepted))
+        stats["yield_per_request"] = len(accepted) / stats["requests"] if stats["requests"] else 0.0
+        self.last_stats = stats
+        return accepted
+    
+    def generate_candidates(self, seed_data: List[Dict[str, Any]], num_to_generate: int = 10) -> List[str]:
+        """发出一次请求并解析出候选指令，不做去重（可在多个线程中并发调用）
+        
+        Args:
+            seed_data: 种子数据列表
+            num_to_generate: 提示词中要求生成的指令数量
+            
+        Returns:
+            解析出的候选指令列表
+        """
+        prompt, max_tokens = self._build_prompt(seed_data, num_to_generate)
         
         # 调用LLM生成
-        response = self.llm_client.generate(prompt)
+        response = self.llm_client.generate(prompt, max_tokens=max_tokens, **self.request_kwargs)
+        
+        # 解析响应获取指令列表
+        candidates = self._parse_instructions(response)
+        metrics.inc("instruction_candidates_total", len(candidates))
+        return candidates
+    
+    async def agenerate(self, seed_data: List[Dict[str, Any]], num_to_generate: int = 10) -> List[str]:
+        """异步发出一次请求生成新指令并去重，参数与返回值同generate"""
+        prompt, max_tokens = self._build_prompt(seed_data, num_to_generate)
+        response = await self.async_llm_client.agenerate(prompt, max_tokens=max_tokens, **self.request_kwargs)
+        return self._postprocess(response, seed_data)
+    
+    def _build_prompt(self, seed_data: List[Dict[str, Any]], num_to_generate: int) -> Tuple[str, int]:
+        """由种子采样器选择种子示例并构建提示词
+
+        输出预算为每条instruction_max_tokens，提示词与输出超出context_window时从末尾去掉种子示例。
+
+        Returns:
+            (提示词, max_tokens)
+        """
+        # 按下标抽样，数据池为DataPool时只读取指令列
+        indices = self.seed_sampler.sample(seed_data, self.config.num_seed_examples)
         
+        # 提取指令部分
+        examples = [get_field(seed_data, i, 'instruction') for i in indices]
+        
+        def render(examples: List[str]) -> str:
+            prompt = self.prompt_template.format(
+                num_prompts=num_to_generate,
+                seed_examples="\n".join(f"- {example}" for example in examples)
+            )
+            if self.request_kwargs:
+                prompt += self.json_format_hint
+            return prompt
+        
+        return self.budget.fit_examples(
+            render, examples, self.config.instruction_max_tokens * num_to_generate, "instruction"
+        )
+    
+    def _postprocess(self, response: str, seed_data: List[Dict[str, Any]]) -> List[str]:
+        """解析响应并与已有指令去重"""
         # 解析响应获取指令列表
         instructions = self._parse_instructions(response)
         
-        # 去重
-        existing_instructions = [d["instruction"] for d in seed_data]
-        unique_instructions = deduplicate_instructions(instructions, existing_instructions)
+        # 去重（与数据池及历史生成的指令比较）
+        self.dedup_index.sync(seed_data)
+        unique_instructions = deduplicate_instructions(instructions, [], index=self.dedup_index)
         
         return unique_instructions
     
     def _parse_instructions(self, response: str) -> List[str]:
-        """解析LLM响应，提取指令列表"""
-        instructions = []
-        for line in response.strip().split("\n"):
-            line = line.strip()
-            # 跳过空行
-            if not line:
-                continue
-            # 移除行首的序号和符号
-            if line.startswith(("-", "*", "•")):
-                line = line[1:].strip()
-            elif any(line.startswith(f"{i}.") for i in range(1, 100)):
-                line = line.split(".", 1)[1].strip()
-            
-            if line and len(line) > 5:  # 简单过滤太短的指令
-                instructions.append(line)
-        
+        """解析LLM响应，提取指令列表（JSON或逐行列表，行首的符号和编号会被去掉）"""
+        # 简单过滤太短的指令
+        instructions, as_json = parse_instruction_list(response, min_length=6)
+        self.parse_stats.record(bool(instructions), as_json)
         return instructions
 
 
 class InstanceGenerator:
     """实例生成器，负责为指令生成输入-输出对"""
     
-    def __init__(self, config):
+    def __init__(self, config, data_filter=None):
+        """
+        Args:
+            config: 配置
+            data_filter: 可选的DataFilter。配置stream_responses时，单条实例以流式方式生成，
+                部分输出已能断定会被过滤器拒绝时立即中止请求
+        """
         self.config = config
+        self.stream_filter = data_filter if config.stream_responses else None
         self.llm_client = LLMClient(config)
+        self.async_llm_client = AsyncLLMClient(config)
+        self.budget = self.llm_client.budget
+        self.parse_stats = ParseStats("instance")
+        self.request_kwargs = {"response_format": JSON_RESPONSE_FORMAT} if config.response_format == "json" else {}
         self.prompt_template = """
 根据指令生成输入和输出：
 指令：{instruction}
@@ -100,6 +222,49 @@ class InstanceGenerator:
 输入：<在此生成任务输入>
 输出：<在此生成任务输出>
 """
+        self.json_prompt_template = """
+根据指令生成输入和输出：
+指令：{instruction}
+
+要求：
+1. 如果任务不需要输入，填写"无"
+2. 输出必须直接完成任务
+3. 输入应该是真实、多样化的
+4. 输出应该是高质量、有帮助的
+
+请只输出一个JSON对象，格式为：{{"input": "<任务输入>", "output": "<任务输出>"}}
+"""
+        # 多条指令打包到一个请求时的提示词，共用一份要求说明
+        self.pack_prompt_template = """
+请为以下{count}条指令分别生成输入和输出：
+{instructions}
+
+要求：
+1. 如果任务不需要输入，填写"无"
+2. 输出必须直接完成任务
+3. 输入应该是真实、多样化的
+4. 输出应该是高质量、有帮助的
+
+请只输出一个JSON对象，按编号顺序包含全部{count}条结果，格式为：
+{{"results": [{{"id": 1, "input": "<任务输入>", "output": "<任务输出>"}}, ...]}}
+"""
+        # 打包请求的统计：请求数、打包的指令数、解析失败后单独重试的指令数
+        self.pack_stats = {"requests": 0, "instructions": 0, "retried": 0}
+        self._stats_lock = threading.Lock()
+    
+    def build_prompt(self, instruction: str) -> str:
+        """构建实例生成的提示词"""
+        template = self.json_prompt_template if self.request_kwargs else self.prompt_template
+        return template.format(instruction=instruction)
+    
+    def build_pack_prompt(self, instructions: List[str]) -> str:
+        """构建多条指令打包的提示词"""
+        numbered = "\n".join(f"[{i}] {instruction}" for i, instruction in enumerate(instructions, 1))
+        return self.pack_prompt_template.format(count=len(instructions), instructions=numbered)
+    
+    def max_tokens_for(self, prompt: str, count: int = 1) -> int:
+        """实例生成请求的max_tokens：每条instance_max_tokens，不超过上下文中剩余的空间"""
+        return self.budget.max_tokens_for(prompt, self.config.instance_max_tokens * count, "instance")
     
     def generate(self, instruction: str) -> Dict[str, str]:
         """为指令生成输入-输出对
@@ -109,12 +274,17 @@ class InstanceGenerator:
             
         Returns:
             包含指令、输入和输出的字典，如果生成失败则返回None
+
+        Raises:
+            StreamAborted: 流式生成时指令在请求前即被过滤规则拒绝，或中止时的部分输出无法解析
         """
         # 构建提示词
-        prompt = self.prompt_template.format(instruction=instruction)
+        prompt = self.build_prompt(instruction)
         
         # 调用LLM生成
-        response = self.llm_client.generate(prompt)
+        if self.stream_filter is not None:
+            return self._generate_streaming(instruction, prompt)
+        response = self.llm_client.generate(prompt, max_tokens=self.max_tokens_for(prompt), **self.request_kwargs)
         
         # 解析响应
         try:
@@ -124,26 +294,206 @@ class InstanceGenerator:
             print(f"解析实例失败: {e}")
             return None
     
+    async def agenerate(self, instruction: str) -> Optional[Dict[str, str]]:
+        """异步为指令生成输入-输出对，参数与返回值同generate"""
+        prompt = self.build_prompt(instruction)
+        response = await self.async_llm_client.agenerate(
+            prompt, max_tokens=self.max_tokens_for(prompt), **self.request_kwargs
+        )
+        try:
+            return self._parse_instance(instruction, response)
+        except Exception as e:
+            print(f"解析实例失败: {e}")
+            return None
+    
+    async def agenerate_batch(self, instructions: List[str], max_concurrency: int = None) -> List[Optional[Dict[str, str]]]:
+        """通过AsyncLLMClient.abatch_generate并发为多条指令生成输入-输出对
+        
+        Args:
+            instructions: 指令列表
+            max_concurrency: 最大并发请求数，默认使用配置中的max_concurrency
+            
+        Returns:
+            与指令一一对应的实例列表，生成失败的位置为None
+        """
+        prompts = [self.build_prompt(inst) for inst in instructions]
+        if not prompts:
+            return []
+        # 各请求共用一个max_tokens，取所有提示词都放得下的值
+        max_tokens = min(self.max_tokens_for(prompt) for prompt in prompts)
+        responses = await self.async_llm_client.abatch_generate(
+            prompts, max_concurrency=max_concurrency, max_tokens=max_tokens, **self.request_kwargs
+        )
+        
+        results = []
+        for instruction, response in zip(instructions, responses):
+            if response is None:
+                results.append(None)
+                continue
+            try:
+                results.append(self._parse_instance(instruction, response))
+            except Exception as e:
+                print(f"解析实例失败: {e}")
+                results.append(None)
+        return results
+    
+    def generate_pack(self, instructions: List[str]) -> List[Optional[Dict[str, str]]]:
+        """在一个请求中为多条指令生成输入-输出对
+        
+        响应按编号拆回各条指令，只有解析失败的条目会单独重新请求。
+        
+        Args:
+            instructions: 打包的指令列表
+            
+        Returns:
+            与指令一一对应的实例列表，生成失败的位置为None
+        """
+        if len(instructions) == 1:
+            return [self._safe_generate(instructions[0])]
+        
+        with self._stats_lock:
+            self.pack_stats["requests"] += 1
+            self.pack_stats["instructions"] += len(instructions)
+        prompt = self.build_pack_prompt(instructions)
+        try:
+            # 输出长度上限按条数放大
+            response = self.llm_client.generate(
+                prompt, max_tokens=self.max_tokens_for(prompt, len(instructions)), **self.request_kwargs
+            )
+        except ResponseTruncated as e:
+            # 加大预算后仍被截断，不解析不完整的输出，改为逐条单独生成
+            print(f"打包生成实例的输出被截断: {e}，改为逐条生成")
+            with self._stats_lock:
+                self.pack_stats["retried"] += len(instructions)
+            return [self._safe_generate(instruction) for instruction in instructions]
+        except Exception as e:
+            print(f"打包生成实例失败: {e}")
+            metrics.inc("instances_generated_total", len(instructions), result="failed")
+            return [None] * len(instructions)
+        parsed, as_json = parse_packed_instances(response, len(instructions))
+        
+        results = []
+        for idx, instruction in enumerate(instructions):
+            if idx not in parsed:
+                self.parse_stats.record(False)
+                with self._stats_lock:
+                    self.pack_stats["retried"] += 1
+                results.append(self._safe_generate(instruction))
+                continue
+            self.parse_stats.record(True, as_json)
+            metrics.inc("instances_generated_total", result="ok")
+            input_text, output_text = parsed[idx]
+            results.append({
+                "instruction": instruction,
+                "input": input_text if input_text else "无",
+                "output": output_text
+            })
+        return results
+    
+    def iter_generate(self, instructions: List[str], max_workers: int = None) -> Iterator[Tuple[int, Optional[Dict[str, str]]]]:
+        """并发为多条指令生成输入-输出对，按完成顺序逐条返回
+        
+        配置instances_per_prompt大于1时，每个请求打包多条指令（见generate_pack）。
+        
+        Args:
+            instructions: 指令列表
+            max_workers: 最大并发请求数，默认使用配置中的max_concurrency
+            
+        Yields:
+            (指令下标, 实例) 元组，生成失败时实例为None
+        """
+        max_workers = max_workers or self.config.max_concurrency
+        pack_size = max(1, self.config.instances_per_prompt)
+        packs = [list(range(start, min(start + pack_size, len(instructions))))
+                 for start in range(0, len(instructions), pack_size)]
+        if max_workers <= 1:
+            for pack in packs:
+                yield from zip(pack, self.generate_pack([instructions[idx] for idx in pack]))
+            return
+        
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {
+                executor.submit(self.generate_pack, [instructions[idx] for idx in pack]): pack
+                for pack in packs
+            }
+            for future in as_completed(futures):
+                yield from zip(futures[future], future.result())
+        finally:
+            # 调用方提前退出时取消尚未开始的请求
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    def generate_batch(self, instructions: List[str], max_workers: int = None) -> List[Optional[Dict[str, str]]]:
+        """并发为多条指令生成输入-输出对，结果顺序与输入指令一致
+        
+        Args:
+            instructions: 指令列表
+            max_workers: 最大并发请求数，默认使用配置中的max_concurrency
+            
+        Returns:
+            与指令一一对应的实例列表，生成失败的位置为None
+        """
+        results = [None] * len(instructions)
+        for idx, instance in self.iter_generate(instructions, max_workers):
+            results[idx] = instance
+        return results
+    
+    def _safe_generate(self, instruction: str) -> Optional[Dict[str, str]]:
+        """生成实例，API调用最终失败时返回None而不是中断整批任务"""
+        result = "failed"
+        try:
+            instance = self.generate(instruction)
+        except StreamAborted:
+            # 被过滤规则提前中止且没有可用的部分实例，已计入llm_stream_aborts_total
+            instance, result = None, "aborted"
+        except Exception as e:
+            print(f"生成实例失败: {e}")
+            instance = None
+        metrics.inc("instances_generated_total", result="ok" if instance is not None else result)
+        return instance
+    
+    def _generate_streaming(self, instruction: str, prompt: str) -> Optional[Dict[str, str]]:
+        """流式生成实例，边生成边解析并用过滤器检查部分输出
+
+        只依赖指令的规则在发出请求前检查，命中时不发请求，抛出StreamAborted；生成中途被规则断定拒绝时关闭连接，
+        返回由已生成部分构成的实例，它同样会被完整过滤拒绝，调用方照常过滤即可。部分输出无法解析时抛出StreamAborted。
+        """
+        rejected = self.stream_filter.check_partial(instruction, "", "")
+        if rejected is not None:
+            metrics.inc("llm_stream_aborts_total", reason=rejected)
+            raise StreamAborted(rejected, "")
+
+        def stream_check(text: str) -> Optional[str]:
+            parsed = parse_partial_instance(text)
+            if parsed is None:
+                return None
+            return self.stream_filter.check_partial(instruction, *parsed)
+
+        try:
+            response = self.llm_client.generate(
+                prompt, stream_check=stream_check, max_tokens=self.max_tokens_for(prompt), **self.request_kwargs
+            )
+        except StreamAborted as e:
+            parsed = parse_partial_instance(e.text)
+            if parsed is None:
+                raise
+            input_text, output_text = parsed
+            return {"instruction": instruction, "input": input_text or "无", "output": output_text}
+        try:
+            return self._parse_instance(instruction, response)
+        except Exception as e:
+            print(f"解析实例失败: {e}")
+            return None
+    
     def _parse_instance(self, instruction: str, response: str) -> Dict[str, str]:
-        """解析LLM响应，提取输入和输出"""
-        input_text = ""
-        output_text = ""
-        
-        # 解析输入和输出
-        if "输入：" in response and "输出：" in response:
-            parts = response.split("输出：")
-            output_text = parts[1].strip()
-            input_text = parts[0].replace("输入：", "").strip()
-        else:
-            # 尝试其他可能的格式
-            if "Input:" in response and "Output:" in response:
-                parts = response.split("Output:")
-                output_text = parts[1].strip()
-                input_text = parts[0].replace("Input:", "").strip()
+        """解析LLM响应，提取输入和输出（JSON对象，或“输入：/输出：”“Input:/Output:”标记，冒号可为全角或半角）"""
+        parsed = parse_instance_response(response)
+        self.parse_stats.record(parsed is not None, parsed is not None and parsed[2])
         
         # 验证解析结果
-        if not output_text:
+        if parsed is None:
             raise ValueError("无法解析输出")
+        input_text, output_text, _ = parsed
         
         return {
             "instruction": instruction,
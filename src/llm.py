@@ -1,11 +1,109 @@
+import asyncio
+import threading
 import time
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple, TYPE_CHECKING
 
-import openai
-from openai import OpenAI
+from .balancer import Endpoint, get_load_balancer
+from .cache import get_response_cache, make_cache_key
+from .metrics import metrics
+from .ratelimit import (
+    estimate_tokens, is_retryable_error, is_rate_limit_error, get_retry_after, get_status_code, backoff_delay
+)
+from .tokens import PromptBudget
 
-class LLMClient:
-    """LLM客户端，负责与语言模型API交互"""
+if TYPE_CHECKING:
+    from openai import OpenAI, AsyncOpenAI
+
+# 流式生成时每累计这么多新字符调用一次stream_check
+STREAM_CHECK_CHARS = 16
+
+# 同一端点的LLMClient共享一个OpenAI客户端（及其HTTP连接池）
+_shared_clients: Dict[Tuple[str, str, Optional[float]], "OpenAI"] = {}
+_shared_clients_lock = threading.Lock()
+
+
+def get_shared_client(api_key: str, base_url: str, timeout: Optional[float] = None) -> "OpenAI":
+    """获取指定端点共享的OpenAI客户端
+
+    Args:
+        api_key: API密钥
+        base_url: API地址
+        timeout: 单次请求超时时间（秒），None时使用SDK默认值
+
+    Returns:
+        同一进程内复用的OpenAI客户端
+    """
+    key = (api_key, base_url, timeout)
+    with _shared_clients_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            from openai import OpenAI
+            # 重试由LLMClient统一调度，关闭SDK内置重试
+            client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=timeout)
+            _shared_clients[key] = client
+        return client
+
+
+class StreamAborted(Exception):
+    """流式生成被stream_check提前中止
+
+    Attributes:
+        reason: stream_check返回的中止原因（如过滤规则名称）
+        text: 中止前已生成的文本
+    """
+
+    def __init__(self, reason: str, text: str):
+        super().__init__(f"流式生成已中止: {reason}")
+        self.reason = reason
+        self.text = text
+
+
+class ResponseTruncated(Exception):
+    """输出因达到max_tokens被截断（finish_reason为length），且已无法用更大的max_tokens重新生成
+
+    Attributes:
+        text: 最后一次被截断的输出
+        max_tokens: 最后一次请求的max_tokens
+    """
+
+    def __init__(self, text: str, max_tokens: int):
+        super().__init__(f"输出在max_tokens={max_tokens}处被截断")
+        self.text = text
+        self.max_tokens = max_tokens
+
+
+class TokenUsage:
+    """累计API返回的token用量，可在多个线程中更新"""
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, usage) -> None:
+        """记录一次响应的usage（服务端未返回时只计请求数）"""
+        with self._lock:
+            self.requests += 1
+            if usage is not None:
+                self.prompt_tokens += usage.prompt_tokens or 0
+                self.completion_tokens += usage.completion_tokens or 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+        }
+
+
+class _BaseLLMClient:
+    """同步与异步客户端共用的配置、参数合并和重试调度"""
 
     def __init__(self, config):
         self.config = config
@@ -14,60 +112,427 @@ class LLMClient:
         self.model = config.model
         self.temperature = config.temperature
         self.max_tokens = config.max_tokens
-        self.retry_count = config.retry_count
+        # 每次请求的最大尝试次数（含第一次），至少为1
+        self.retry_count = max(1, config.retry_count)
         self.retry_delay = config.retry_delay
+        self.retry_max_delay = config.retry_max_delay
+        self.request_timeout = config.request_timeout
+        # 输出被截断时用更大的max_tokens重新生成的次数
+        self.length_retries = config.length_retries
+        self.budget = PromptBudget(config)
+
+        # 请求在配置的端点之间负载均衡，每个端点有各自共享的限速器
+        self.balancer = get_load_balancer(config)
+        self.rate_limiter = self.balancer.endpoints[0].rate_limiter
+        # 可选的持久化响应缓存，未启用时为None
+        self.cache = get_response_cache(config)
+        # 本客户端实际发出的请求的token用量（缓存命中不计）
+        self.usage = TokenUsage()
+
+    def _build_params(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """合并默认配置与调用参数"""
+        params = {
+            "model": kwargs.get("model", self.model),
+            "temperature": kwargs.get("temperature", self.temperature),
+            "max_tokens": kwargs.get("max_tokens", self.max_tokens),
+        }
+        # 结构化输出（如{"type": "json_object"}），只在指定时发送
+        if kwargs.get("response_format"):
+            params["response_format"] = kwargs["response_format"]
+        return params
+
+    def _endpoint_params(self, endpoint: Endpoint, params: Dict[str, Any], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """发往指定端点的参数：调用时未指定模型则使用该端点配置的模型名"""
+        if "model" in kwargs or endpoint.model == params["model"]:
+            return params
+        return dict(params, model=endpoint.model)
+
+    def _cache_lookup(self, prompt: str, params: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+        """查询响应缓存
+
+        Returns:
+            (缓存键, 缓存的响应) 元组，未启用缓存时两者均为None
+        """
+        if self.cache is None:
+            return None, None
+        key = make_cache_key(self.base_url, params, prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            metrics.inc("llm_cache_hits_total")
+        return key, cached
+
+    def _estimate_cost(self, prompt: str, params: Dict[str, Any]) -> int:
+        """估算一次请求消耗的token数，用于tokens/min限速"""
+        return estimate_tokens(prompt) + params["max_tokens"]
+
+    def _on_success(self, endpoint: Endpoint, latency: float) -> None:
+        """记录一次成功请求：负载均衡、限速和延迟指标"""
+        self.balancer.release(endpoint, latency=latency)
+        endpoint.rate_limiter.on_success()
+        metrics.inc("llm_requests_total", endpoint=endpoint.base_url, result="ok")
+        metrics.observe("llm_request_seconds", latency, endpoint=endpoint.base_url)
+
+    def _on_error(self, endpoint: Endpoint, error: Exception) -> None:
+        """记录一次失败请求，错误按HTTP状态码或异常类型分类"""
+        self.balancer.release(endpoint, error=error)
+        error_type = get_status_code(error) or type(error).__name__
+        metrics.inc("llm_requests_total", endpoint=endpoint.base_url, result="error")
+        metrics.inc("llm_errors_total", endpoint=endpoint.base_url, error=error_type)
+
+    def _on_abort(self, endpoint: Endpoint, latency: float, aborted: StreamAborted) -> None:
+        """记录一次被提前中止的流式请求：端点本身正常，不计入错误和延迟直方图"""
+        self.balancer.release(endpoint, latency=latency)
+        endpoint.rate_limiter.on_success()
+        self.usage.record(None)
+        metrics.inc("llm_requests_total", endpoint=endpoint.base_url, result="aborted")
+        metrics.inc("llm_stream_aborts_total", reason=aborted.reason)
+        # 服务端在连接断开前已生成的token（估算）
+        metrics.inc("llm_aborted_completion_tokens_total", estimate_tokens(aborted.text), endpoint=endpoint.base_url)
+
+    def _grow_params(self, prompt: str, params: Dict[str, Any], text: str, retry: int) -> Dict[str, Any]:
+        """输出被截断后重新请求的参数：max_tokens加倍（受max_tokens_limit和上下文长度限制）
+
+        Raises:
+            ResponseTruncated: 重试次数用完或max_tokens已无法增大
+        """
+        grown = self.budget.grow_max_tokens(prompt, params["max_tokens"]) if retry < self.length_retries else None
+        if grown is None:
+            metrics.inc("llm_truncated_total", result="failed")
+            raise ResponseTruncated(text, params["max_tokens"])
+        metrics.inc("llm_truncated_total", result="retried")
+        return dict(params, max_tokens=grown)
+
+    def _record_usage(self, endpoint: Endpoint, usage) -> None:
+        """累计响应中的token用量"""
+        self.usage.record(usage)
+        if usage is not None:
+            metrics.inc("llm_prompt_tokens_total", usage.prompt_tokens or 0, endpoint=endpoint.base_url)
+            metrics.inc("llm_completion_tokens_total", usage.completion_tokens or 0, endpoint=endpoint.base_url)
+
+    def _next_retry_delay(self, error: Exception, attempt: int, endpoint: Endpoint) -> Optional[float]:
+        """根据错误类型决定是否重试
 
-        # 初始化API客户端
-        self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        Args:
+            error: 本次调用抛出的异常
+            attempt: 已尝试次数（从0开始）
+            endpoint: 本次调用所用的端点
+
+        Returns:
+            下次重试前的等待秒数，不应重试时返回None
+        """
+        if attempt >= self.retry_count - 1 or not is_retryable_error(error):
+            return None
+        metrics.inc("llm_retries_total")
+
+        retry_after = get_retry_after(error)
+        if is_rate_limit_error(error):
+            endpoint.rate_limiter.on_rate_limited(retry_after)
+        if self.balancer.has_alternative(endpoint):
+            # 还有其他可用端点时立即切换重试
+            return 0.0
+        if retry_after is not None:
+            return min(retry_after, self.retry_max_delay)
+        return backoff_delay(attempt, self.retry_delay, self.retry_max_delay)
+
+
+class LLMClient(_BaseLLMClient):
+    """LLM客户端，负责与语言模型API交互"""
 
-    def generate(self, prompt: str, **kwargs) -> str:
+    @property
+    def client(self) -> "OpenAI":
+        """第一个端点共享的OpenAI客户端（首次使用时才导入openai并创建，同一端点复用连接池）"""
+        return get_shared_client(self.api_key, self.base_url, self.request_timeout)
+
+    def _get_client(self, endpoint: Endpoint) -> "OpenAI":
+        return get_shared_client(endpoint.api_key, endpoint.base_url, self.request_timeout)
+
+    def generate(self, prompt: str, stream_check=None, **kwargs) -> str:
         """生成文本
-        
+
+        输出因达到max_tokens被截断时，按length_retries用加倍的max_tokens重新生成，
+        仍被截断则抛出ResponseTruncated，截断的输出不会返回或缓存。
+
         Args:
             prompt: 提示词
+            stream_check: 可选的回调，指定时以流式方式请求，每收到一段新文本就以目前的全部文本调用它，
+                返回非空的中止原因时立即关闭连接并抛出StreamAborted（不重试、不缓存）
             **kwargs: 其他参数，会覆盖默认配置
-            
+
         Returns:
             生成的文本
         """
-        params = {
-            "model": kwargs.get("model", self.model),
-            "temperature": kwargs.get("temperature", self.temperature),
-            "max_tokens": kwargs.get("max_tokens", self.max_tokens),
-        }
+        params = self._build_params(kwargs)
+        cache_key, cached = self._cache_lookup(prompt, params)
+        if cached is not None:
+            return cached
+
+        retry = 0
+        while True:
+            result, finish_reason = self._request(prompt, params, kwargs, stream_check)
+            if finish_reason != "length":
+                break
+            params = self._grow_params(prompt, params, result, retry)
+            retry += 1
+        if cache_key is not None:
+            self.cache.put(cache_key, result)
+        return result
 
-        # 重试机制
+    def _request(self, prompt: str, params: Dict[str, Any], kwargs: Dict[str, Any],
+                 stream_check) -> Tuple[str, Optional[str]]:
+        """发出一次请求，按错误类型重试，返回(文本, finish_reason)"""
+        cost = self._estimate_cost(prompt, params)
+
+        # 重试机制：可重试错误按指数退避（或Retry-After）等待，致命错误直接抛出
+        # 失败后优先换到其他端点重试
+        failed = None
         for attempt in range(self.retry_count):
+            endpoint = self.balancer.acquire(exclude=failed)
+            endpoint.rate_limiter.acquire(cost)
+            start = time.monotonic()
             try:
-                return self._call_api(prompt, params)
-            except Exception as e:
-                if attempt < self.retry_count - 1:
-                    print(f"API调用失败: {e}，{self.retry_delay}秒后重试...")
-                    time.sleep(self.retry_delay)
+                endpoint_params = self._endpoint_params(endpoint, params, kwargs)
+                if stream_check is None:
+                    result = self._call_api(endpoint, prompt, endpoint_params)
                 else:
+                    result = self._stream_api(endpoint, prompt, endpoint_params, stream_check)
+            except StreamAborted as e:
+                self._on_abort(endpoint, time.monotonic() - start, e)
+                raise
+            except Exception as e:
+                self._on_error(endpoint, e)
+                delay = self._next_retry_delay(e, attempt, endpoint)
+                if delay is None:
+                    raise e
+                failed = endpoint
+                print(f"API调用失败: {e}，{delay:.1f}秒后重试...")
+                time.sleep(delay)
+            else:
+                self._on_success(endpoint, time.monotonic() - start)
+                return result
+
+    def _call_api(self, endpoint: Endpoint, prompt: str, params: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+        """调用OpenAI API，返回(文本, finish_reason)"""
+        response = self._get_client(endpoint).chat.completions.create(
+            model=params["model"],
+            messages=[{"role": "user", "content": prompt}],
+            temperature=params["temperature"],
+            max_tokens=params["max_tokens"],
+            **({"response_format": params["response_format"]} if "response_format" in params else {})
+        )
+        self._record_usage(endpoint, response.usage)
+        choice = response.choices[0]
+        return (choice.message.content or "").strip(), choice.finish_reason
+
+    def _stream_api(self, endpoint: Endpoint, prompt: str, params: Dict[str, Any],
+                    stream_check) -> Tuple[str, Optional[str]]:
+        """以流式方式调用OpenAI API，stream_check判定中止时关闭连接，服务端随之停止生成
+
+        Returns:
+            (文本, finish_reason)
+        """
+        start = time.monotonic()
+        stream = self._get_client(endpoint).chat.completions.create(
+            model=params["model"],
+            messages=[{"role": "user", "content": prompt}],
+            temperature=params["temperature"],
+            max_tokens=params["max_tokens"],
+            stream=True,
+            stream_options={"include_usage": True},
+            **({"response_format": params["response_format"]} if "response_format" in params else {})
+        )
+        parts = []
+        length = checked = 0
+        usage = finish_reason = None
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if not parts:
+                    metrics.observe("llm_first_token_seconds", time.monotonic() - start, endpoint=endpoint.base_url)
+                parts.append(chunk.choices[0].delta.content)
+                length += len(parts[-1])
+                if length - checked >= STREAM_CHECK_CHARS:
+                    checked = length
+                    text = "".join(parts)
+                    reason = stream_check(text)
+                    if reason:
+                        raise StreamAborted(reason, text.strip())
+        finally:
+            stream.close()
+        self._record_usage(endpoint, usage)
+        return "".join(parts).strip(), finish_reason
+
+    def batch_generate(self, prompts: List[str], **kwargs) -> List[Optional[str]]:
+        """批量生成文本，内部通过AsyncLLMClient并发请求
+
+        单个提示词重试后仍失败（包括输出被截断）时不抛出异常，只打印错误并在对应位置返回None，
+        其余提示词的结果照常返回。需要对失败做处理的调用方应检查返回值中的None，
+        需要异常时逐条调用generate。
+
+        Args:
+            prompts: 提示词列表
+            **kwargs: 其他参数，同AsyncLLMClient.abatch_generate
+
+        Returns:
+            与提示词一一对应的生成文本列表，失败的位置为None
+        """
+        async def _run():
+            async with AsyncLLMClient(self.config) as client:
+                return await client.abatch_generate(prompts, **kwargs)
+
+        return asyncio.run(_run())
+
+
+class AsyncLLMClient(_BaseLLMClient):
+    """异步LLM客户端，基于AsyncOpenAI在同一个连接池上并发请求"""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.max_concurrency = config.max_concurrency
+
+        # AsyncOpenAI的连接池绑定事件循环，因此在首次使用时按当前循环为每个端点创建
+        self._clients: Dict[str, "AsyncOpenAI"] = {}
+        self._loop = None
+
+    def _get_client(self, endpoint: Endpoint) -> "AsyncOpenAI":
+        """当前事件循环下该端点共享的AsyncOpenAI客户端"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._clients = {}
+            self._loop = loop
+        client = self._clients.get(endpoint.base_url)
+        if client is None:
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(api_key=endpoint.api_key, base_url=endpoint.base_url, max_retries=0)
+            self._clients[endpoint.base_url] = client
+        return client
+
+    @property
+    def client(self) -> "AsyncOpenAI":
+        """当前事件循环下第一个端点的AsyncOpenAI客户端"""
+        return self._get_client(self.balancer.endpoints[0])
+
+    async def aclose(self) -> None:
+        """关闭底层HTTP连接池"""
+        for client in self._clients.values():
+            await client.close()
+        self._clients = {}
+        self._loop = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def agenerate(self, prompt: str, timeout: float = None, **kwargs) -> str:
+        """异步生成文本，输出被截断时的处理同LLMClient.generate
+
+        Args:
+            prompt: 提示词
+            timeout: 单次请求超时时间（秒），默认使用配置中的request_timeout
+            **kwargs: 其他参数，会覆盖默认配置
+
+        Returns:
+            生成的文本
+        """
+        params = self._build_params(kwargs)
+        cache_key, cached = self._cache_lookup(prompt, params)
+        if cached is not None:
+            return cached
+        timeout = timeout or self.request_timeout
+
+        retry = 0
+        while True:
+            result, finish_reason = await self._arequest(prompt, params, kwargs, timeout)
+            if finish_reason != "length":
+                break
+            params = self._grow_params(prompt, params, result, retry)
+            retry += 1
+        if cache_key is not None:
+            self.cache.put(cache_key, result)
+        return result
+
+    async def _arequest(self, prompt: str, params: Dict[str, Any], kwargs: Dict[str, Any],
+                        timeout: float) -> Tuple[str, Optional[str]]:
+        """异步发出一次请求，按错误类型重试，返回(文本, finish_reason)"""
+        cost = self._estimate_cost(prompt, params)
+
+        # 重试机制，取消信号直接向上传递
+        failed = None
+        for attempt in range(self.retry_count):
+            endpoint = self.balancer.acquire(exclude=failed)
+            start = time.monotonic()
+            try:
+                await endpoint.rate_limiter.aacquire(cost)
+                start = time.monotonic()
+                result = await asyncio.wait_for(
+                    self._acall_api(endpoint, prompt, self._endpoint_params(endpoint, params, kwargs)), timeout
+                )
+            except asyncio.CancelledError:
+                self.balancer.abandon(endpoint)
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = TimeoutError(f"请求超过{timeout}秒未返回")
+                self._on_error(endpoint, e)
+                delay = self._next_retry_delay(e, attempt, endpoint)
+                if delay is None:
                     raise e
+                failed = endpoint
+                print(f"API调用失败: {e}，{delay:.1f}秒后重试...")
+                await asyncio.sleep(delay)
+            else:
+                self._on_success(endpoint, time.monotonic() - start)
+                return result
 
-    def _call_api(self, prompt: str, params: Dict[str, Any]) -> str:
-        """调用OpenAI API"""
-        response = self.client.chat.completions.create(
+    async def _acall_api(self, endpoint: Endpoint, prompt: str, params: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+        """异步调用OpenAI API，返回(文本, finish_reason)"""
+        response = await self._get_client(endpoint).chat.completions.create(
             model=params["model"],
             messages=[{"role": "user", "content": prompt}],
             temperature=params["temperature"],
-            max_tokens=params["max_tokens"]
+            max_tokens=params["max_tokens"],
+            **({"response_format": params["response_format"]} if "response_format" in params else {})
         )
-        return response.choices[0].message.content.strip()
+        self._record_usage(endpoint, response.usage)
+        choice = response.choices[0]
+        return (choice.message.content or "").strip(), choice.finish_reason
+
+    async def abatch_generate(self, prompts: List[str], max_concurrency: int = None,
+                              timeout: float = None, **kwargs) -> List[Optional[str]]:
+        """并发批量生成文本
 
-    def batch_generate(self, prompts: list, **kwargs) -> list:
-        """批量生成文本
-        
         Args:
             prompts: 提示词列表
-            **kwargs: 其他参数
-            
+            max_concurrency: 最大并发请求数，默认使用配置中的max_concurrency
+            timeout: 单次请求超时时间（秒）
+            **kwargs: 其他参数，会覆盖默认配置
+
         Returns:
-            生成的文本列表
+            与提示词一一对应的生成文本列表，失败的位置为None
         """
-        results = []
-        for prompt in prompts:
-            results.append(self.generate(prompt, **kwargs))
-        return results
\ No newline at end of file
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+
+        async def _run(prompt: str) -> Optional[str]:
+            async with semaphore:
+                try:
+                    return await self.agenerate(prompt, timeout=timeout, **kwargs)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"批量生成中的请求失败: {e}")
+                    return None
+
+        tasks = [asyncio.ensure_future(_run(prompt)) for prompt in prompts]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # 外部取消时同时取消尚未完成的请求
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
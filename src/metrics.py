@@ -0,0 +1,190 @@
+import math
+import threading
+from typing import Dict, Any, List, Tuple
+
+# Prometheus指标名前缀
+METRIC_PREFIX = "self_instruct_"
+# 延迟直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> _LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: _LabelKey, extra: Dict[str, str] = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ""
+    body = ",".join(
+        f'{k}="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for k, v in items
+    )
+    return "{" + body + "}"
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """最近秩法分位数，sorted_values须已排序"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class _Histogram:
+    """累计桶计数（用于Prometheus）加上当前统计窗口内的原始样本（用于分位数）"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.window: List[float] = []
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.window.append(value)
+
+    def summary(self, values: List[float]) -> Dict[str, float]:
+        values = sorted(values)
+        return {
+            "count": len(values),
+            "mean": sum(values) / len(values) if values else 0.0,
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": values[-1] if values else 0.0,
+        }
+
+
+class MetricsRegistry:
+    """进程内的计数器和直方图
+
+    计数器和直方图按名称和标签区分，可在多个线程中更新。snapshot返回自上次取窗口以来的
+    增量（用于每轮迭代的指标文件），to_prometheus输出累计值（用于Prometheus抓取）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[_LabelKey, float]] = {}
+        self._window_base: Dict[str, Dict[_LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[_LabelKey, _Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """计数器加value"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels) -> None:
+        """向直方图记录一个观测值"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def snapshot(self, reset_window: bool = True) -> Dict[str, Any]:
+        """返回自上次取窗口以来的计数器增量和直方图分位数
+
+        Args:
+            reset_window: 是否开始新的统计窗口
+
+        Returns:
+            {"counters": {名称: {标签: 增量}}, "histograms": {名称: {标签: 分位数统计}}}，
+            标签格式为"k=v,k2=v2"，无标签时为空字符串
+        """
+        with self._lock:
+            counters = {}
+            for name, series in self._counters.items():
+                base = self._window_base.get(name, {})
+                values = {
+                    ",".join(f"{k}={v}" for k, v in key): value - base.get(key, 0)
+                    for key, value in series.items()
+                }
+                counters[name] = {label: value for label, value in values.items() if value}
+            histograms = {}
+            for name, series in self._histograms.items():
+                histograms[name] = {
+                    ",".join(f"{k}={v}" for k, v in key): histogram.summary(histogram.window)
+                    for key, histogram in series.items() if histogram.window
+                }
+            if reset_window:
+                self._window_base = {name: dict(series) for name, series in self._counters.items()}
+                for series in self._histograms.values():
+                    for histogram in series.values():
+                        histogram.window = []
+        return {"counters": counters, "histograms": histograms}
+
+    def to_prometheus(self) -> str:
+        """Prometheus文本格式的累计指标"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                metric = METRIC_PREFIX + name
+                lines.append(f"# TYPE {metric} counter")
+                for key, value in series.items():
+                    lines.append(f"{metric}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                metric = METRIC_PREFIX + name
+                lines.append(f"# TYPE {metric} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{_format_labels(key, {'le': str(bound)})} {cumulative}")
+                    lines.append(f"{metric}_bucket{_format_labels(key, {'le': '+Inf'})} {histogram.count}")
+                    lines.append(f"{metric}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{metric}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+# 进程内共享的指标注册表
+metrics = MetricsRegistry()
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0", registry: MetricsRegistry = None):
+    """在后台线程中启动Prometheus文本格式的/metrics接口
+
+    Args:
+        port: 监听端口
+        host: 监听地址
+        registry: 指标注册表，默认为进程内共享的metrics
+
+    Returns:
+        HTTP服务对象，可调用shutdown停止
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    registry = registry or metrics
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            payload = registry.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,211 @@
+import json
+import re
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+from .metrics import metrics
+
+# 列表项前缀：- * • 以及 1. 1) (1) 1、 1． 等编号（全角、半角标点均可）；
+# 冒号编号（1: ）要求后跟空白且其后不是数字，以免把“10:30”“3: 2”之类的正文当作编号
+_LIST_PREFIX_RE = re.compile(r"^(?:[-*•·]\s*|[(（]?\d{1,3}\s*(?:[.)）、．]\s*|[:：]\s+(?![\s\d])))")
+# 行首的输入/输出标记，允许Markdown加粗和标题符号，冒号可为全角或半角
+_INPUT_MARKER_RE = re.compile(r"^[#>*\s]*(?:输入|input)\s*\**\s*[:：]\s*\**", re.IGNORECASE | re.MULTILINE)
+_OUTPUT_MARKER_RE = re.compile(r"^[#>*\s]*(?:输出|output)\s*\**\s*[:：]\s*\**", re.IGNORECASE | re.MULTILINE)
+# 不在行首的输出标记（模型把输入和输出写在同一行时）
+_INLINE_OUTPUT_MARKER_RE = re.compile(r"(?:输出|output)\s*[:：]", re.IGNORECASE)
+# 多条实例打包回复中的分节标题：单独一行的 [1]、【1】、### 1、1. 等
+_SECTION_HEADER_RE = re.compile(r"^[#\s]*[\[【(（]?(\d{1,3})[\]】)）]?\s*[.、:：]?\s*$", re.MULTILINE)
+_CODE_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+
+# JSON模式下请求的response_format
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+
+def _load_json(text: str) -> Any:
+    """解析可能带有代码块围栏的JSON，不是JSON时返回None"""
+    text = _CODE_FENCE_RE.sub("", text.strip())
+    if not text or text[0] not in "[{":
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def strip_list_prefix(line: str) -> str:
+    """去掉行首的列表符号或编号"""
+    match = _LIST_PREFIX_RE.match(line)
+    return line[match.end():].strip() if match else line
+
+
+def parse_instruction_list(response: str, min_length: int = 6) -> Tuple[List[str], bool]:
+    """解析指令列表
+
+    先按JSON解析（字符串数组，或包含instructions数组的对象），否则按行解析并去掉编号。
+
+    Args:
+        response: LLM响应
+        min_length: 指令最小长度，更短的行被丢弃
+
+    Returns:
+        (指令列表, 是否按JSON解析) 元组
+    """
+    data = _load_json(response)
+    if isinstance(data, dict):
+        data = data.get("instructions")
+    if isinstance(data, list):
+        items = [strip_list_prefix(str(item).strip()) for item in data if isinstance(item, (str, int, float))]
+        return [item for item in items if len(item) >= min_length], True
+
+    items, numbered = [], False
+    for line in response.splitlines():
+        line = line.strip()
+        match = _LIST_PREFIX_RE.match(line)
+        if match:
+            line = line[match.end():].strip()
+            numbered = True
+        if len(line) >= min_length:
+            items.append((line, match is None and line.endswith((":", "："))))
+    # 有编号的列表中，未编号且以冒号结尾的行是列表前的标题（如“生成的指令列表：”）
+    return [line for line, is_header in items if not (numbered and is_header)], False
+
+
+def parse_instance_response(response: str) -> Optional[Tuple[str, str, bool]]:
+    """解析输入-输出对
+
+    先按JSON解析（包含input和output字段的对象），否则定位第一个输出标记：标记之前为输入
+    （去掉输入标记），之后的全部内容为输出，输出中再次出现的标记原样保留。
+
+    Returns:
+        (输入, 输出, 是否按JSON解析) 元组，无法解析出输出时返回None
+    """
+    data = _load_json(response)
+    if isinstance(data, dict):
+        output = data.get("output")
+        if isinstance(output, str) and output.strip():
+            input_text = data.get("input")
+            return (input_text.strip() if isinstance(input_text, str) else ""), output.strip(), True
+
+    match = _OUTPUT_MARKER_RE.search(response) or _INLINE_OUTPUT_MARKER_RE.search(response)
+    if match is None:
+        return None
+    output = response[match.end():].strip()
+    if not output:
+        return None
+    head = response[:match.start()]
+    input_match = _INPUT_MARKER_RE.search(head)
+    input_text = head[input_match.end():] if input_match else ""
+    return input_text.strip(), output, False
+
+
+def _partial_json_string(text: str, key: str) -> Optional[str]:
+    """从可能不完整的JSON文本中取出某个字符串字段已生成的部分"""
+    match = re.search(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)' % key, text)
+    if match is None:
+        return None
+    # 末尾未写完的转义（如\u4e，单独的反斜杠不会被匹配）去掉后再解码
+    value = re.sub(r"\\u[0-9a-fA-F]{0,3}$", "", match.group(1))
+    try:
+        return json.loads(f'"{value}"')
+    except ValueError:
+        return value
+
+
+def parse_partial_instance(response: str) -> Optional[Tuple[str, str]]:
+    """解析流式生成中尚未完成的输入-输出对，格式同parse_instance_response
+
+    Returns:
+        (输入, 已生成的部分输出) 元组，输出尚未开始时返回None
+    """
+    stripped = _CODE_FENCE_RE.sub("", response.lstrip())
+    if stripped.startswith("{"):
+        output = _partial_json_string(stripped, "output")
+        if output is None:
+            return None
+        return (_partial_json_string(stripped, "input") or "").strip(), output.strip()
+
+    match = _OUTPUT_MARKER_RE.search(response) or _INLINE_OUTPUT_MARKER_RE.search(response)
+    if match is None:
+        return None
+    head = response[:match.start()]
+    input_match = _INPUT_MARKER_RE.search(head)
+    input_text = head[input_match.end():] if input_match else ""
+    return input_text.strip(), response[match.end():].strip()
+
+
+def parse_packed_instances(response: str, count: int) -> Tuple[Dict[int, Tuple[str, str]], bool]:
+    """解析一次请求中打包的多条输入-输出对
+
+    先按JSON解析（results数组，每项含id、input、output；没有id时按位置对应），
+    否则按单独成行的编号标题分节，每节按parse_instance_response解析。
+
+    Args:
+        response: LLM响应
+        count: 打包的指令数
+
+    Returns:
+        ({指令在包内的下标(从0开始): (输入, 输出)}, 是否按JSON解析) 元组，解析失败的条目不出现
+    """
+    results = {}
+    data = _load_json(response)
+    if isinstance(data, dict):
+        data = data.get("results", next((v for v in data.values() if isinstance(v, list)), None))
+    if isinstance(data, list):
+        for position, item in enumerate(data):
+            if not isinstance(item, dict):
+                continue
+            try:
+                idx = int(item["id"]) - 1 if "id" in item else position
+            except (TypeError, ValueError):
+                idx = position
+            output = item.get("output")
+            if 0 <= idx < count and idx not in results and isinstance(output, str) and output.strip():
+                input_text = item.get("input")
+                results[idx] = ((input_text.strip() if isinstance(input_text, str) else ""), output.strip())
+        return results, True
+
+    headers = list(_SECTION_HEADER_RE.finditer(response))
+    for i, header in enumerate(headers):
+        idx = int(header.group(1)) - 1
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(response)
+        parsed = parse_instance_response(response[header.end():end])
+        if 0 <= idx < count and idx not in results and parsed is not None:
+            results[idx] = parsed[:2]
+    return results, False
+
+
+class ParseStats:
+    """解析统计，可在多个线程中更新
+
+    Args:
+        kind: 响应类型（instruction/instance），作为parse_responses_total指标的标签
+    """
+
+    def __init__(self, kind: str = "response"):
+        self.kind = kind
+        self.responses = 0
+        self.failures = 0
+        self.json = 0
+        self._lock = threading.Lock()
+
+    def record(self, success: bool, as_json: bool = False) -> None:
+        with self._lock:
+            self.responses += 1
+            if not success:
+                self.failures += 1
+            elif as_json:
+                self.json += 1
+        metrics.inc("parse_responses_total", kind=self.kind,
+                    result="failed" if not success else "json" if as_json else "text")
+
+    @property
+    def failure_rate(self) -> float:
+        return self.failures / self.responses if self.responses else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "responses": self.responses,
+            "failures": self.failures,
+            "json": self.json,
+            "failure_rate": self.failure_rate,
+        }
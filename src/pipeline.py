@@ -0,0 +1,173 @@
+import math
+import queue
+import threading
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
+
+from .metrics import metrics
+
+# 队列结束标记
+_DONE = object()
+
+
+class IterationPipeline:
+    """单轮迭代的流水线引擎
+
+    各阶段由有界队列连接，下游处理不过来时上游在put处阻塞（背压）：
+    指令生成(多线程) → 去重(单线程) → 实例生成(多线程) → 过滤(单线程) → 调用方(写入数据池)。
+    第一批指令解析出来后实例生成即开始，与后续的指令生成请求重叠进行。
+    """
+
+    def __init__(self, config, instruction_generator, instance_generator, data_filter):
+        self.config = config
+        self.instruction_generator = instruction_generator
+        self.instance_generator = instance_generator
+        self.data_filter = data_filter
+        self.instruction_workers = max(1, config.pipeline_instruction_workers)
+        self.instance_workers = max(1, config.pipeline_instance_workers or config.max_concurrency)
+        self.queue_size = max(1, config.pipeline_queue_size)
+        self.stats = {}
+
+    def run(self, pool: List[Dict[str, Any]], target: int,
+            on_instruction: Callable[[int, str], None] = None) -> Iterator[Tuple[int, str, Optional[Dict[str, str]]]]:
+        """运行一轮流水线
+
+        Args:
+            pool: 当前数据池（本轮运行期间不应修改）
+            target: 本轮要生成的去重后指令数
+            on_instruction: 指令通过去重时的回调，参数为(指令序号, 指令)，在去重线程中调用
+
+        Yields:
+            (指令序号, 指令, 有效实例) 元组，按完成顺序返回，实例生成失败或被过滤时为None
+        """
+        per_request = max(1, self.config.instructions_per_prompt)
+        budget = self.config.max_instruction_requests or math.ceil(target / per_request) * 4
+
+        instruction_queue = queue.Queue(self.queue_size)
+        instance_queue = queue.Queue(self.queue_size)
+        filter_queue = queue.Queue(self.queue_size)
+        output_queue = queue.Queue(self.queue_size)
+
+        lock = threading.Lock()
+        stop = threading.Event()
+        errors = []
+        stats = {"instruction_requests": 0, "instruction_failures": 0, "candidates": 0,
+                 "accepted_instructions": 0, "valid_instances": 0}
+        self.stats = stats
+        dedup_index = self.instruction_generator.dedup_index
+        dedup_index.sync(pool)
+
+        def guarded(func):
+            def wrapper(*args):
+                try:
+                    func(*args)
+                except Exception as e:
+                    errors.append(e)
+                    stop.set()
+                    # 出错时确保下游能收到结束标记
+                    output_queue.put(_DONE)
+            return wrapper
+
+        def put_unless_stopped(q, item):
+            # 去重线程达到目标后不再读取指令队列，此时放弃放入，避免生产线程阻塞在已满的队列上
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce_instructions():
+            while not stop.is_set():
+                with lock:
+                    if stats["instruction_requests"] >= budget:
+                        return
+                    stats["instruction_requests"] += 1
+                try:
+                    candidates = self.instruction_generator.generate_candidates(pool, per_request)
+                except Exception as e:
+                    if stop.is_set():
+                        return
+                    print(f"指令生成请求失败: {e}")
+                    with lock:
+                        stats["instruction_failures"] += 1
+                    continue
+                for candidate in candidates:
+                    if not put_unless_stopped(instruction_queue, candidate):
+                        return
+
+        def deduplicate():
+            accepted = 0
+            while True:
+                candidate = instruction_queue.get()
+                if candidate is _DONE:
+                    break
+                stats["candidates"] += 1
+                if not dedup_index.add_if_new(candidate):
+                    continue
+                if on_instruction is not None:
+                    on_instruction(accepted, candidate)
+                instance_queue.put((accepted, candidate))
+                accepted += 1
+                metrics.inc("instructions_accepted_total")
+                if accepted >= target:
+                    # 已达目标，通知指令生成线程停止发新请求，并立即结束实例生成阶段，
+                    # 不等待仍在进行中的指令请求，它们的结果被丢弃
+                    stop.set()
+                    break
+            stats["accepted_instructions"] = accepted
+            for _ in range(self.instance_workers):
+                instance_queue.put(_DONE)
+
+        def generate_instances():
+            while True:
+                item = instance_queue.get()
+                if item is _DONE:
+                    filter_queue.put(_DONE)
+                    return
+                index, instruction = item
+                filter_queue.put((index, instruction, self.instance_generator._safe_generate(instruction)))
+
+        def filter_instances():
+            finished = 0
+            while finished < self.instance_workers:
+                item = filter_queue.get()
+                if item is _DONE:
+                    finished += 1
+                    continue
+                index, instruction, instance = item
+                if instance is not None and not self.data_filter.is_valid(instance):
+                    instance = None
+                if instance is not None:
+                    stats["valid_instances"] += 1
+                output_queue.put((index, instruction, instance))
+            output_queue.put(_DONE)
+
+        producers = [threading.Thread(target=guarded(produce_instructions), daemon=True)
+                     for _ in range(self.instruction_workers)]
+        threads = producers + [threading.Thread(target=guarded(deduplicate), daemon=True)]
+        threads += [threading.Thread(target=guarded(generate_instances), daemon=True)
+                    for _ in range(self.instance_workers)]
+        threads.append(threading.Thread(target=guarded(filter_instances), daemon=True))
+
+        def close_instruction_queue():
+            # 请求预算用完而未达目标时，由此通知去重线程结束
+            for producer in producers:
+                producer.join()
+            put_unless_stopped(instruction_queue, _DONE)
+
+        threads.append(threading.Thread(target=close_instruction_queue, daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = output_queue.get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            stop.set()
+
+        if errors:
+            raise errors[0]
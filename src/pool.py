@@ -0,0 +1,201 @@
+import json
+import os
+import random
+from array import array
+from collections.abc import Sequence
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+
+from .storage import iter_jsonl
+
+# 数据池的固定列，其余字段按记录稀疏保存
+POOL_FIELDS = ("instruction", "input", "output")
+
+
+class StringColumn:
+    """紧凑的字符串列：所有值的UTF-8编码连续存放在一个bytearray中，另用int64数组记录偏移
+
+    每个值只占编码后的字节数加8字节偏移，没有每个str对象约50字节的头部开销；
+    按下标读取时才解码，为O(1)。
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("q", [0])
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def append(self, value: str) -> None:
+        self.data += value.encode("utf-8")
+        self.offsets.append(len(self.data))
+
+    def __getitem__(self, index: int) -> str:
+        return self.data[self.offsets[index]:self.offsets[index + 1]].decode("utf-8")
+
+    def nbytes(self) -> int:
+        return len(self.data) + self.offsets.itemsize * len(self.offsets)
+
+
+class DataPool(Sequence):
+    """列式存储的数据池，只追加不删除
+
+    instruction、input、output三列各存为一个StringColumn，其他字段（如种子数据中的附加字段）
+    按记录下标稀疏保存。实现了Sequence接口，len、下标访问（返回新建的字典）、迭代和
+    random.sample均可直接使用，已有接受list-of-dict的代码无需修改；只需要某一列时
+    用field/iter_field读取，不必构造字典。
+
+    可附加一个去重索引（InstructionIndex或EmbeddingIndex），每次追加后自动同步。
+    """
+
+    def __init__(self, records: Iterable[Dict[str, Any]] = None, index=None):
+        """
+        Args:
+            records: 初始记录
+            index: 可选的去重索引，需提供sync(pool)方法
+        """
+        self._columns = {name: StringColumn() for name in POOL_FIELDS}
+        self._extra: Dict[int, Dict[str, Any]] = {}
+        self.index = None
+        if records is not None:
+            self.extend(records)
+        if index is not None:
+            self.attach_index(index)
+
+    @classmethod
+    def from_jsonl(cls, file_path: str, end_offset: int = None, index=None) -> "DataPool":
+        """从JSONL文件流式加载数据池，不在内存中保留整个记录列表
+
+        Args:
+            file_path: JSONL文件路径
+            end_offset: 结束字节偏移（不含），None表示读到文件末尾
+            index: 可选的去重索引
+        """
+        return cls(iter_jsonl(file_path, end_offset=end_offset), index=index)
+
+    def attach_index(self, index) -> None:
+        """附加去重索引并同步已有数据"""
+        self.index = index
+        index.sync(self)
+
+    def __len__(self) -> int:
+        return len(self._columns["instruction"])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("数据池下标越界")
+        record = {name: column[index] for name, column in self._columns.items()}
+        extra = self._extra.get(index)
+        if extra:
+            record.update(extra)
+        return record
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def field(self, index: int, name: str) -> str:
+        """读取单条记录的某个字段，不构造整条记录"""
+        if name in self._columns:
+            return self._columns[name][index]
+        return self._extra.get(index, {}).get(name, "")
+
+    def iter_field(self, name: str, start: int = 0, stop: int = None) -> Iterator[str]:
+        """按顺序读取[start, stop)范围内记录的某个字段"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for i in range(start, stop):
+            yield self.field(i, name)
+
+    def append(self, record: Dict[str, Any]) -> None:
+        self._append(record)
+        if self.index is not None:
+            self.index.sync(self)
+
+    def extend(self, records: Iterable[Dict[str, Any]]) -> None:
+        for record in records:
+            self._append(record)
+        if self.index is not None:
+            self.index.sync(self)
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        position = len(self)
+        for name, column in self._columns.items():
+            column.append(str(record.get(name, "")))
+        extra = {key: value for key, value in record.items() if key not in self._columns}
+        if extra:
+            self._extra[position] = extra
+
+    def sample(self, k: int, rng: random.Random = None) -> List[Dict[str, Any]]:
+        """无放回随机抽取k条记录，耗时只与k有关"""
+        rng = rng or random
+        return [self[i] for i in rng.sample(range(len(self)), min(k, len(self)))]
+
+    def nbytes(self) -> int:
+        """列存储占用的字节数（不含稀疏的附加字段）"""
+        return sum(column.nbytes() for column in self._columns.values())
+
+    def to_jsonl(self, file_path: str, start: int = 0) -> int:
+        """把[start, 末尾)的记录流式写入JSONL文件
+
+        Returns:
+            写入的记录数
+        """
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        count = 0
+        with open(file_path, "w", encoding="utf-8") as f:
+            for i in range(start, len(self)):
+                f.write(json.dumps(self[i], ensure_ascii=False) + "\n")
+                count += 1
+        return count
+
+    def to_arrow(self):
+        """转换为pyarrow.Table，三列直接引用列存储的缓冲区（零拷贝）
+
+        返回的表与数据池共享内存，表存活期间向数据池追加数据会抛出BufferError（缓冲区已被导出，
+        不能扩容），应先释放表。附加字段不包含在内。
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("导出Arrow/Parquet需要安装pyarrow: pip install pyarrow")
+
+        arrays = [
+            pa.LargeStringArray.from_buffers(
+                len(column), pa.py_buffer(column.offsets), pa.py_buffer(column.data)
+            )
+            for column in self._columns.values()
+        ]
+        return pa.Table.from_arrays(arrays, names=list(self._columns))
+
+    def to_parquet(self, file_path: str) -> int:
+        """导出为Parquet文件（需要pyarrow）
+
+        Returns:
+            写入的记录数
+        """
+        table = self.to_arrow()
+        import pyarrow.parquet as pq
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        pq.write_table(table, file_path)
+        return len(self)
+
+
+def iter_field(pool, name: str, start: int = 0) -> Iterator[str]:
+    """读取数据池中从start开始各记录的某个字段，DataPool按列读取，list-of-dict逐条取值"""
+    if isinstance(pool, DataPool):
+        return pool.iter_field(name, start)
+    return (pool[i][name] for i in range(start, len(pool)))
+
+
+def get_field(pool, index: int, name: str) -> str:
+    """读取数据池中某条记录的某个字段，DataPool不构造整条记录"""
+    if isinstance(pool, DataPool):
+        return pool.field(index, name)
+    return pool[index][name]
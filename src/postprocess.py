@@ -0,0 +1,332 @@
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+
+from .config import Config
+from .dedup import normalize_text
+from .filter import DataFilter
+from .utils import iter_json, save_json_stream
+
+# 每个分片的目标输入字节数，决定默认分片数（第二遍去重时每个分片的哈希集合需放入内存）
+SHARD_TARGET_BYTES = 256 << 20
+# 语义去重每批编码的记录数
+EMBED_BATCH_SIZE = 1024
+
+# 进程池中每个worker进程的过滤器，由_init_worker创建
+_worker_filter: Optional[DataFilter] = None
+
+
+def _init_worker(config) -> None:
+    global _worker_filter
+    _worker_filter = DataFilter(config)
+
+
+def iter_input_chunks(paths: List[str], chunk_size: int) -> Iterator[List[Any]]:
+    """按块读取输入文件
+
+    JSONL文件只按行切分，原始行交给worker解析；JSON数组文件由iter_json在本进程流式解析。
+
+    Yields:
+        每块最多chunk_size条，元素为JSONL原始行（bytes）或已解析的记录
+    """
+    chunk = []
+    for path in paths:
+        if path.endswith(".jsonl"):
+            with open(path, "rb") as f:
+                for line in f:
+                    if line.strip():
+                        chunk.append(line)
+                        if len(chunk) >= chunk_size:
+                            yield chunk
+                            chunk = []
+        else:
+            for record in iter_json(path):
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+def dedup_hash(text: str) -> int:
+    """规范化文本的64位哈希，用于分片和精确去重"""
+    return int.from_bytes(hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _filter_chunk(start_seq: int, items: List[Any], num_shards: int, key: str) -> Tuple[List[bytes], Counter, int]:
+    """第一遍（worker进程）：解析、过滤，按去重键哈希把保留的记录分到各分片
+
+    每行格式为“序号\\t哈希\\tJSON”，JSONL输入直接沿用原始行，不重新序列化。
+
+    Returns:
+        (各分片的待写入数据, 各规则拒绝数, 格式错误的记录数)
+    """
+    shards = [[] for _ in range(num_shards)]
+    rejections = Counter()
+    malformed = 0
+    for offset, item in enumerate(items):
+        try:
+            if isinstance(item, bytes):
+                text = item.decode("utf-8").strip()
+                record = json.loads(text)
+            else:
+                record = item
+                text = json.dumps(record, ensure_ascii=False)
+            rule = _worker_filter.check_fields(
+                record["instruction"], record.get("input", ""), record["output"]
+            )
+        except (ValueError, KeyError, TypeError, AttributeError):
+            malformed += 1
+            continue
+        if rule is not None:
+            rejections[rule] += 1
+            continue
+        digest = dedup_hash(str(record.get(key, "")))
+        shards[digest % num_shards].append(f"{start_seq + offset}\t{digest}\t{text}\n")
+    return ["".join(lines).encode("utf-8") for lines in shards], rejections, malformed
+
+
+def _dedup_shard(in_path: str, out_path: str) -> Tuple[int, int]:
+    """第二遍（worker进程）：分片内按哈希精确去重，保留序号最小的一条
+
+    分片文件按序号递增写入，因此保留的是第一次出现的记录，输出仍按序号有序。
+
+    Returns:
+        (保留数, 丢弃数)
+    """
+    seen = set()
+    kept = dropped = 0
+    with open(in_path, "rb") as src, open(out_path, "wb") as dst:
+        for line in src:
+            seq, digest, text = line.split(b"\t", 2)
+            if digest in seen:
+                dropped += 1
+                continue
+            seen.add(digest)
+            dst.write(seq + b"\t" + text)
+            kept += 1
+    os.remove(in_path)
+    return kept, dropped
+
+
+def _copy_shard(in_path: str, out_path: str) -> Tuple[int, int]:
+    """不去重时只去掉哈希列"""
+    kept = 0
+    with open(in_path, "rb") as src, open(out_path, "wb") as dst:
+        for line in src:
+            seq, _, text = line.split(b"\t", 2)
+            dst.write(seq + b"\t" + text)
+            kept += 1
+    os.remove(in_path)
+    return kept, 0
+
+
+def _ordered_map(executor, fn, arg_iter: Iterable[tuple], max_in_flight: int) -> Iterator[Any]:
+    """按提交顺序返回结果，同时最多max_in_flight个任务在途，限制读入内存的数据量"""
+    pending = deque()
+    for args in arg_iter:
+        if executor is None:
+            yield fn(*args)
+            continue
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def merge_shards(paths: List[str]) -> Iterator[bytes]:
+    """按序号归并各分片的去重结果，恢复输入顺序，返回每条记录的JSON文本"""
+    def lines(path):
+        with open(path, "rb") as f:
+            for line in f:
+                seq, text = line.split(b"\t", 1)
+                yield int(seq), text
+
+    for _, text in heapq.merge(*(lines(path) for path in paths)):
+        yield text
+
+
+def semantic_filter(texts: Iterator[bytes], threshold: float, config, work_dir: str,
+                    stats: Dict[str, Any], key: str = "instruction") -> Iterator[bytes]:
+    """按批在CPU上编码并做语义去重，与之前保留的记录及同批记录相似的丢弃
+
+    向量存放在工作目录的内存映射文件中，主进程内存只包含一批记录。配置了embedding_server时由嵌入服务编码。
+    """
+    from .embedding import EmbeddingIndex
+
+    index = EmbeddingIndex(config.embedding_model, path=os.path.join(work_dir, "embeddings.f32"), device="cpu",
+                           batch_size=EMBED_BATCH_SIZE // 4, server_url=config.embedding_server or None)
+    batch = []
+
+    def flush():
+        start = time.perf_counter()
+        embeddings = index.encode([str(json.loads(text).get(key, "")) for text in batch])
+        keep = index.filter_embeddings(embeddings, threshold)
+        index.add_embeddings(embeddings[keep])
+        stats["semantic_dropped"] += len(batch) - int(keep.sum())
+        stats["semantic_seconds"] += time.perf_counter() - start
+        return [text for text, k in zip(batch, keep) if k]
+
+    for text in texts:
+        batch.append(text)
+        if len(batch) >= EMBED_BATCH_SIZE:
+            yield from flush()
+            batch = []
+    if batch:
+        yield from flush()
+
+
+def run_postprocess(paths: List[str], output_path: str, config, workers: int = 0, chunk_size: int = 5000,
+                    num_shards: int = 0, dedup: bool = True, semantic_threshold: float = 0,
+                    key: str = "instruction", work_dir: str = None) -> Dict[str, Any]:
+    """对已生成的数据集做过滤、去重和可选的语义去重，流式处理，内存占用有上限
+
+    1. 分块读取输入，在进程池中用DataFilter过滤，保留的记录按去重键的哈希写入磁盘上的分片
+    2. 各分片在进程池中分别精确去重（规范化文本相同视为重复）
+    3. 按原始顺序归并各分片；指定semantic_threshold时再按批编码做语义去重
+    4. 写出结果，.jsonl为JSONL，其他扩展名为JSON数组
+
+    Args:
+        paths: 输入文件（JSON数组或JSONL）
+        output_path: 输出文件
+        config: 配置，过滤规则和嵌入模型取自其中
+        workers: 进程数，0表示使用全部CPU核，1表示在本进程中处理
+        chunk_size: 每个过滤任务的记录数
+        num_shards: 去重分片数，0表示按输入大小自动选择
+        dedup: 是否做精确去重
+        semantic_threshold: 语义去重阈值，0表示不做
+        key: 去重字段
+        work_dir: 存放分片的临时目录，默认在输出文件所在目录下创建
+
+    Returns:
+        各阶段的统计
+    """
+    workers = workers or os.cpu_count() or 1
+    input_bytes = sum(os.path.getsize(path) for path in paths)
+    num_shards = num_shards or max(workers * 4, -(-input_bytes // SHARD_TARGET_BYTES))
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+    if work_dir:
+        os.makedirs(work_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="postprocess_", dir=work_dir or output_dir)
+    stats = {"input": 0, "malformed": 0, "rejections": Counter(), "filtered": 0, "dedup_dropped": 0,
+             "semantic_dropped": 0, "semantic_seconds": 0.0, "output": 0}
+
+    try:
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(config,))
+        else:
+            _init_worker(config)
+        try:
+            # 第一遍：过滤并按哈希分片
+            start = time.perf_counter()
+            shard_paths = [os.path.join(work_dir, f"shard_{i:04d}.tsv") for i in range(num_shards)]
+            shard_files = [open(path, "wb") for path in shard_paths]
+            try:
+                numbered = _numbered(iter_input_chunks(paths, chunk_size), stats)
+                chunks = ((seq, chunk, num_shards, key) for seq, chunk in numbered)
+                for blobs, rejections, malformed in _ordered_map(executor, _filter_chunk, chunks, workers * 2):
+                    stats["malformed"] += malformed
+                    stats["rejections"].update(rejections)
+                    for f, blob in zip(shard_files, blobs):
+                        f.write(blob)
+            finally:
+                for f in shard_files:
+                    f.close()
+            stats["filter_seconds"] = time.perf_counter() - start
+            stats["filtered"] = stats["input"] - stats["malformed"] - sum(stats["rejections"].values())
+
+            # 第二遍：各分片分别去重
+            start = time.perf_counter()
+            deduped_paths = [path[:-4] + ".dedup.tsv" for path in shard_paths]
+            for kept, dropped in _ordered_map(
+                executor, _dedup_shard if dedup else _copy_shard, zip(shard_paths, deduped_paths), workers * 2
+            ):
+                stats["dedup_dropped"] += dropped
+            stats["dedup_seconds"] = time.perf_counter() - start
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        # 归并、语义去重并写出
+        start = time.perf_counter()
+        texts = merge_shards(deduped_paths)
+        if semantic_threshold > 0:
+            texts = semantic_filter(texts, semantic_threshold, config, work_dir, stats, key)
+        if output_path.endswith(".jsonl"):
+            tmp_path = f"{output_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                for text in texts:
+                    f.write(text)
+                    stats["output"] += 1
+            os.replace(tmp_path, output_path)
+        else:
+            stats["output"] = save_json_stream((json.loads(text) for text in texts), os.path.abspath(output_path))
+        stats["write_seconds"] = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    stats["rejections"] = dict(stats["rejections"])
+    stats["num_shards"] = num_shards
+    stats["workers"] = workers
+    return stats
+
+
+def _numbered(chunks: Iterator[List[Any]], stats: Dict[str, Any]) -> Iterator[Tuple[int, List[Any]]]:
+    """为每块附上其第一条记录的全局序号，并累计输入记录数"""
+    for chunk in chunks:
+        yield stats["input"], chunk
+        stats["input"] += len(chunk)
+
+
+def peak_rss_mb() -> float:
+    """本进程与已结束子进程中最大的峰值常驻内存（MB）"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(prog='main.py postprocess', description='对已生成的大数据集做多进程过滤和去重')
+    parser.add_argument('inputs', nargs='+', help='输入文件（JSON数组或JSONL）')
+    parser.add_argument('--output', type=str, required=True, help='输出文件，.jsonl为JSONL，否则为JSON数组')
+    parser.add_argument('--config', type=str, default='config/default.json', help='配置文件路径（过滤规则和嵌入模型）')
+    parser.add_argument('--workers', type=int, default=0, help='进程数，0表示使用全部CPU核')
+    parser.add_argument('--chunk_size', type=int, default=5000, help='每个过滤任务的记录数')
+    parser.add_argument('--num_shards', type=int, default=0, help='去重分片数，0表示按输入大小自动选择')
+    parser.add_argument('--no_dedup', action='store_true', help='不做精确去重')
+    parser.add_argument('--semantic_threshold', type=float, default=0, help='语义去重阈值，0表示不做')
+    parser.add_argument('--key', type=str, default='instruction', help='去重依据的字段')
+    parser.add_argument('--work_dir', type=str, default=None, help='临时分片目录，默认在输出文件所在目录')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    stats = run_postprocess(
+        args.inputs, args.output, Config(args.config), workers=args.workers, chunk_size=args.chunk_size,
+        num_shards=args.num_shards, dedup=not args.no_dedup, semantic_threshold=args.semantic_threshold,
+        key=args.key, work_dir=args.work_dir
+    )
+    elapsed = time.perf_counter() - start
+    print(f"输入 {stats['input']} 条（格式错误 {stats['malformed']} 条），"
+          f"过滤后 {stats['filtered']} 条，精确去重丢弃 {stats['dedup_dropped']} 条，"
+          f"语义去重丢弃 {stats['semantic_dropped']} 条，输出 {stats['output']} 条")
+    print(f"过滤规则拒绝: {stats['rejections']}")
+    print(f"耗时 {elapsed:.1f} 秒（过滤 {stats['filter_seconds']:.1f}，去重 {stats['dedup_seconds']:.1f}，"
+          f"归并写出 {stats['write_seconds']:.1f}，其中语义去重 {stats['semantic_seconds']:.1f}），{stats['input'] / max(elapsed, 1e-9):.0f} 条/秒，"
+          f"{stats['workers']} 个进程，{stats['num_shards']} 个分片，峰值内存 {peak_rss_mb():.0f} MB")
+    print(f"结果已保存至: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import asyncio
+import random
+import sys
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+# 自适应限速参数：收到429时按比例降速，成功后逐步恢复
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN = 2.0
+MIN_REQUESTS_PER_MINUTE = 1.0
+
+# 同一端点和模型的所有生成器共享一个限速器
+_limiters: Dict[Tuple[str, str], "RateLimiter"] = {}
+_limiters_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数：中日韩字符按1个token计，其余按4个字符1个token计"""
+    cjk = sum(1 for ch in text if '⺀' <= ch <= '鿿' or '가' <= ch <= '힯')
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+class _Bucket:
+    """令牌桶，允许透支，透支部分通过等待偿还"""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = 0.0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(per_minute)
+
+    @property
+    def capacity(self) -> float:
+        # 最多积攒10秒的配额，避免空闲后瞬间涌出整分钟的请求
+        return max(1.0, self.per_minute / 6)
+
+    def set_rate(self, per_minute: float) -> None:
+        self._refill(time.monotonic())
+        was_unlimited = self.per_minute <= 0
+        self.per_minute = per_minute
+        if per_minute <= 0:
+            self.tokens = 0.0
+        elif was_unlimited:
+            # 从不限速切换为限速时以满桶开始
+            self.tokens = self.capacity
+        else:
+            self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self, now: float) -> None:
+        if self.per_minute > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """预留amount个令牌，返回需要等待的秒数"""
+        if self.per_minute <= 0:
+            return 0.0
+        self._refill(now)
+        self.tokens -= amount
+        return max(0.0, -self.tokens * 60 / self.per_minute)
+
+
+class RateLimiter:
+    """按每分钟请求数和每分钟token数限速，并根据观察到的429自适应调整速率"""
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        """
+        Args:
+            requests_per_minute: 每分钟请求数上限，0表示不限制（收到429后自动学习）
+            tokens_per_minute: 每分钟token数上限，0表示不限制
+        """
+        self.max_requests_per_minute = requests_per_minute
+        self.max_tokens_per_minute = tokens_per_minute
+        self._requests = _Bucket(requests_per_minute)
+        self._tokens = _Bucket(tokens_per_minute)
+        self._recent = deque()
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "wait_seconds": 0.0}
+
+    @property
+    def requests_per_minute(self) -> float:
+        """当前生效的每分钟请求数，0表示不限制"""
+        return self._requests.per_minute
+
+    @property
+    def tokens_per_minute(self) -> float:
+        """当前生效的每分钟token数，0表示不限制"""
+        return self._tokens.per_minute
+
+    def reserve(self, tokens: int = 0) -> float:
+        """预留一次请求的配额
+
+        Args:
+            tokens: 本次请求预计消耗的token数
+
+        Returns:
+            发出请求前需要等待的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._recent.append(now)
+            while self._recent and self._recent[0] < now - 60:
+                self._recent.popleft()
+
+            wait = max(
+                self._blocked_until - now,
+                self._requests.reserve(1, now),
+                self._tokens.reserve(tokens, now),
+            )
+            wait = max(0.0, wait)
+            self.stats["requests"] += 1
+            self.stats["wait_seconds"] += wait
+            return wait
+
+    def acquire(self, tokens: int = 0) -> None:
+        """阻塞直到配额可用"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 0) -> None:
+        """异步等待直到配额可用"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self) -> None:
+        """请求成功后加性恢复速率，直到回到配置的上限"""
+        with self._lock:
+            rpm = self._requests.per_minute
+            if rpm <= 0:
+                return
+            if self.max_requests_per_minute <= 0 or rpm < self.max_requests_per_minute:
+                new_rpm = rpm + 1
+                if self.max_requests_per_minute > 0:
+                    new_rpm = min(new_rpm, self.max_requests_per_minute)
+                self._requests.set_rate(new_rpm)
+            tpm = self._tokens.per_minute
+            if 0 < tpm < self.max_tokens_per_minute:
+                self._tokens.set_rate(min(self.max_tokens_per_minute, tpm * (1 + 1 / rpm)))
+
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """收到429后暂停所有调用方并按比例降速
+
+        Args:
+            retry_after: 服务端通过Retry-After给出的等待秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.stats["rate_limited"] += 1
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+
+            # 并发请求往往同时收到429，冷却期内只降速一次
+            if now - self._last_decrease < DECREASE_COOLDOWN:
+                return
+            self._last_decrease = now
+
+            # 未配置上限时，以最近一分钟观察到的请求速率为起点
+            rpm = self._requests.per_minute or self._observed_requests_per_minute(now)
+            self._requests.set_rate(max(MIN_REQUESTS_PER_MINUTE, rpm * DECREASE_FACTOR))
+            if self._tokens.per_minute > 0:
+                self._tokens.set_rate(self._tokens.per_minute * DECREASE_FACTOR)
+
+    def _observed_requests_per_minute(self, now: float) -> float:
+        """最近一分钟内实际发出请求的速率"""
+        if not self._recent:
+            return MIN_REQUESTS_PER_MINUTE
+        window = max(1.0, now - self._recent[0])
+        return max(MIN_REQUESTS_PER_MINUTE, len(self._recent) * 60 / window)
+
+
+def get_rate_limiter(config, base_url: str = None, model: str = None,
+                     requests_per_minute: float = None, tokens_per_minute: float = None) -> RateLimiter:
+    """获取端点共享的限速器，未指定的参数取配置中的值"""
+    key = (base_url or config.base_url, model or config.model)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(
+                config.requests_per_minute if requests_per_minute is None else requests_per_minute,
+                config.tokens_per_minute if tokens_per_minute is None else tokens_per_minute
+            )
+            _limiters[key] = limiter
+        return limiter
+
+
+def _loaded_openai():
+    """已导入的openai模块，尚未导入时返回None
+
+    openai导入较慢（约0.7秒），只在创建客户端时才导入；此前出现的异常不可能来自openai，
+    判断错误类型时无需为此导入。
+    """
+    return sys.modules.get("openai")
+
+
+def get_status_code(error: Exception) -> Optional[int]:
+    """API返回错误状态码时的HTTP状态码，其他错误返回None"""
+    openai = _loaded_openai()
+    if openai is not None and isinstance(error, openai.APIStatusError):
+        return error.status_code
+    return None
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """判断错误是否值得重试：超时、连接错误、429和5xx可以重试，其余（鉴权、参数错误等）直接失败"""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return True
+    openai = _loaded_openai()
+    if openai is not None and isinstance(error, openai.APIConnectionError):
+        return True
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code in (408, 409, 429) or status_code >= 500
+    return False
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """判断错误是否为429限流"""
+    return get_status_code(error) == 429
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """从错误响应的Retry-After/retry-after-ms头中解析等待秒数"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """带完全抖动的指数退避：在[0, min(max_delay, base_delay * 2^attempt)]内随机取值"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
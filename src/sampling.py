@@ -0,0 +1,182 @@
+import random
+import threading
+from typing import List, Dict, Any
+
+# 数据池增长到上次完整拟合时的该倍数后，用全部向量重新拟合聚类中心
+REFIT_GROWTH = 2.0
+# 完整拟合时的Lloyd迭代次数
+REFIT_ITERATIONS = 2
+# 每次矩阵乘法处理的向量行数
+ASSIGN_CHUNK_ROWS = 65536
+
+
+class UniformSeedSampler:
+    """从整个数据池中均匀随机抽取种子示例"""
+
+    def sync(self, pool: List[Dict[str, Any]]) -> None:
+        pass
+
+    def sample(self, pool: List[Dict[str, Any]], k: int) -> List[int]:
+        """无放回抽取k个下标"""
+        return random.sample(range(len(pool)), min(k, len(pool)))
+
+
+class DiversitySeedSampler:
+    """基于数据池嵌入聚类的种子采样器，优先从样本较少的簇中抽取示例
+
+    数据池的指令向量缓存在EmbeddingIndex中，每次只编码新增部分。数据池达到num_clusters条后
+    用最远点法选出初始聚类中心，之后新条目分配到最近的中心并按在线k-means更新该中心；
+    数据池每增长REFIT_GROWTH倍，用全部向量做几轮Lloyd迭代重新拟合，均摊到每条的开销为O(k·dim)。
+
+    抽样时先等概率选出k个不同的簇，再从每个簇中各取一条（簇不够时从其余条目中补足），
+    使提示词中的示例覆盖数据池中较少出现的任务类型，而不是总集中在占多数的几类上。
+    """
+
+    def __init__(self, index, num_clusters: int = 32):
+        """
+        Args:
+            index: 缓存数据池向量的EmbeddingIndex
+            num_clusters: 簇数
+        """
+        self.num_clusters = num_clusters
+        self._reset(index)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config) -> "DiversitySeedSampler":
+        """根据配置创建采样器，seed_embedding为"model"时使用嵌入模型，否则使用字符n-gram哈希向量"""
+        from .embedding import EmbeddingIndex, HashingEmbeddingModel
+
+        if config.seed_embedding == "model":
+            index = EmbeddingIndex(
+                config.embedding_model, device=config.embedding_device, server_url=config.embedding_server or None
+            )
+        else:
+            index = EmbeddingIndex("hashing", model=HashingEmbeddingModel())
+        return cls(index, num_clusters=config.seed_clusters)
+
+    @property
+    def cluster_sizes(self) -> List[int]:
+        """各簇的条目数"""
+        return [len(members) for members in self._members]
+
+    def sync(self, pool: List[Dict[str, Any]]) -> None:
+        """编码数据池新增的条目并更新聚类（数据池只追加不删除）"""
+        with self._lock:
+            self._sync(pool)
+
+    def sample(self, pool: List[Dict[str, Any]], k: int) -> List[int]:
+        """无放回抽取k个下标，尽量来自不同的簇"""
+        with self._lock:
+            self._sync(pool)
+            k = min(k, len(pool))
+            if self._centroids is None:
+                return random.sample(range(len(pool)), k)
+
+            # 先等概率选出不同的簇，再在簇内均匀抽取：每条的概率与所在簇的大小成反比
+            clusters = [c for c, members in enumerate(self._members) if members]
+            chosen = [random.choice(self._members[c]) for c in random.sample(clusters, min(k, len(clusters)))]
+            if len(chosen) < k:
+                taken = set(chosen)
+                rest = [i for i in random.sample(range(len(pool)), min(len(pool), 2 * k + len(chosen)))
+                        if i not in taken]
+                chosen.extend(rest[:k - len(chosen)])
+            return chosen
+
+    def _reset(self, index) -> None:
+        """清空聚类状态并改用新的向量索引，不替换锁，调用方需持有锁（构造时除外）"""
+        self.index = index
+        self._centroids = None
+        self._counts = None
+        self._members: List[List[int]] = []
+        self._assigned = 0
+        self._fitted_size = 0
+
+    def _sync(self, pool: List[Dict[str, Any]]) -> None:
+        if len(pool) < self._assigned:
+            # 传入的不是同一个数据池，从头重建
+            from .embedding import EmbeddingIndex
+            index = EmbeddingIndex(self.index.model_name, device=self.index.device,
+                                   server_url=self.index.server_url, model=self.index.model)
+            self._reset(index)
+        self.index.sync(pool)
+        total = len(self.index)
+        if total == self._assigned or total < self.num_clusters:
+            return
+        if self._centroids is None or total >= self._fitted_size * REFIT_GROWTH:
+            self._fit(total)
+        else:
+            self._assign_online(self._assigned, total)
+
+    def _fit(self, total: int) -> None:
+        """用全部向量拟合聚类中心并重新分配所有条目"""
+        import numpy as np
+
+        embeddings = self.index.embeddings[:total]
+        if self._centroids is None:
+            self._centroids = self._farthest_points(embeddings)
+        for _ in range(REFIT_ITERATIONS):
+            labels = self._nearest(embeddings)
+            sums = np.zeros_like(self._centroids)
+            np.add.at(sums, labels, embeddings)
+            counts = np.bincount(labels, minlength=self.num_clusters)
+            # 空簇保留原中心
+            nonempty = counts > 0
+            sums[nonempty] /= counts[nonempty, None]
+            sums[~nonempty] = self._centroids[~nonempty]
+            self._centroids = _unit_rows(sums)
+        labels = self._nearest(embeddings)
+        self._counts = np.bincount(labels, minlength=self.num_clusters).astype(np.float64)
+        self._members = [[] for _ in range(self.num_clusters)]
+        for i, label in enumerate(labels.tolist()):
+            self._members[label].append(i)
+        self._assigned = total
+        self._fitted_size = total
+
+    def _assign_online(self, start: int, stop: int) -> None:
+        """将新条目分配到最近的中心，并把中心向其移动1/n（在线k-means）"""
+        embeddings = self.index.embeddings[start:stop]
+        for offset, (vector, label) in enumerate(zip(embeddings, self._nearest(embeddings).tolist())):
+            self._counts[label] += 1
+            centroid = self._centroids[label] + (vector - self._centroids[label]) / self._counts[label]
+            self._centroids[label] = centroid / max(float((centroid ** 2).sum()) ** 0.5, 1e-12)
+            self._members[label].append(start + offset)
+        self._assigned = stop
+
+    def _farthest_points(self, embeddings):
+        """最远点法选取初始中心：从随机一点开始，每次取与已选中心最大相似度最小的点"""
+        import numpy as np
+
+        chosen = [random.randrange(len(embeddings))]
+        closest = embeddings @ embeddings[chosen[0]]
+        for _ in range(self.num_clusters - 1):
+            chosen.append(int(np.argmin(closest)))
+            np.maximum(closest, embeddings @ embeddings[chosen[-1]], out=closest)
+        return np.array(embeddings[chosen], dtype=np.float32)
+
+    def _nearest(self, embeddings):
+        """每个向量最近（内积最大）的中心"""
+        import numpy as np
+
+        labels = np.empty(len(embeddings), dtype=np.int64)
+        for start in range(0, len(embeddings), ASSIGN_CHUNK_ROWS):
+            chunk = embeddings[start:start + ASSIGN_CHUNK_ROWS]
+            labels[start:start + len(chunk)] = (chunk @ self._centroids.T).argmax(axis=1)
+        return labels
+
+
+def _unit_rows(matrix):
+    import numpy as np
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def create_seed_sampler(config):
+    """根据配置的seed_sampler创建种子采样器"""
+    if config.seed_sampler == "diversity":
+        return DiversitySeedSampler.from_config(config)
+    if config.seed_sampler != "uniform":
+        raise ValueError(f"不支持的种子采样方式: {config.seed_sampler}")
+    return UniformSeedSampler()
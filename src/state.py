@@ -0,0 +1,144 @@
+import os
+import random
+import threading
+from typing import List, Dict, Any, Optional
+
+from .storage import JsonlSink, iter_jsonl
+
+
+def get_rng_state() -> List[Any]:
+    """以可JSON序列化的形式获取random模块的状态"""
+    version, internal, gauss_next = random.getstate()
+    return [version, list(internal), gauss_next]
+
+
+def set_rng_state(state: List[Any]) -> None:
+    """恢复get_rng_state保存的random模块状态"""
+    version, internal, gauss_next = state
+    random.setstate((version, tuple(internal), gauss_next))
+
+
+class RunState:
+    """从运行日志回放得到的断点状态"""
+
+    def __init__(self):
+        self.config_hash = None
+        self.finished = False
+        # 最近一次提交（完整结束）的迭代序号，-1表示只写入了种子数据
+        self.committed_iteration = None
+        self.committed_offset = 0
+        self.committed_total = 0
+        self.rng_state = None
+        # 已生成指令但尚未完成的迭代
+        self.pending_iteration = None
+        self.pending_instructions: List[str] = []
+        self.completed_instances: Dict[int, Optional[Dict[str, str]]] = {}
+
+    @property
+    def next_iteration(self) -> int:
+        """恢复后应开始的迭代序号"""
+        return self.committed_iteration + 1
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        """回放一条日志事件"""
+        event_type = event["type"]
+        if event_type == "start":
+            self.config_hash = event["config_hash"]
+        elif event_type == "instructions":
+            self.pending_iteration = event["iteration"]
+            self.pending_instructions = event["instructions"]
+            self.completed_instances = {}
+            self.rng_state = event["rng_state"]
+        elif event_type == "instruction":
+            # 流水线模式下指令逐条通过去重后记录
+            if event["iteration"] != self.pending_iteration:
+                self.pending_iteration = event["iteration"]
+                self.pending_instructions = []
+                self.completed_instances = {}
+            self.pending_instructions.append(event["instruction"])
+        elif event_type == "instance":
+            if event["iteration"] == self.pending_iteration:
+                self.completed_instances[event["index"]] = event["instance"]
+        elif event_type == "commit":
+            self.committed_iteration = event["iteration"]
+            self.committed_offset = event["offset"]
+            self.committed_total = event["total"]
+            self.rng_state = event["rng_state"]
+            self.pending_iteration = None
+            self.pending_instructions = []
+            self.completed_instances = {}
+        elif event_type == "finish":
+            self.finished = True
+
+
+class RunJournal:
+    """只追加的运行日志，记录迭代进度以便崩溃后从断点恢复
+
+    日志为JSONL，事件依次为：start（配置哈希）、instructions（本轮生成的待处理指令和随机数状态；
+    流水线模式下为逐条的instruction事件）、instance（每条指令完成后的有效实例或null）、
+    commit（本轮数据已写入数据池的字节偏移）、finish。各方法可在多个线程中调用。
+    """
+
+    def __init__(self, file_path: str, truncate: bool = False):
+        """
+        Args:
+            file_path: 日志文件路径
+            truncate: 是否清空已有日志（开始新的运行）
+        """
+        self.file_path = file_path
+        self._sink = JsonlSink(file_path, truncate=truncate)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load(file_path: str) -> Optional[RunState]:
+        """回放日志，返回断点状态；日志不存在或没有任何提交时返回None"""
+        if not os.path.exists(file_path):
+            return None
+        state = RunState()
+        for event in iter_jsonl(file_path):
+            state.apply(event)
+        if state.committed_iteration is None:
+            return None
+        return state
+
+    def _write(self, event: Dict[str, Any], sync: bool = False) -> None:
+        with self._lock:
+            self._sink.write([event])
+            if sync:
+                self._sink.sync()
+
+    def start(self, config_hash: str) -> None:
+        self._write({"type": "start", "config_hash": config_hash}, sync=True)
+
+    def record_instructions(self, iteration: int, instructions: List[str]) -> None:
+        """记录本轮生成的指令（此后这些指令的生成费用不会再重复支付）"""
+        self._write({
+            "type": "instructions",
+            "iteration": iteration,
+            "instructions": instructions,
+            "rng_state": get_rng_state(),
+        }, sync=True)
+
+    def record_instruction(self, iteration: int, index: int, instruction: str) -> None:
+        """逐条记录通过去重的指令（流水线模式）"""
+        self._write({"type": "instruction", "iteration": iteration, "index": index, "instruction": instruction})
+
+    def record_instance(self, iteration: int, index: int, instance: Optional[Dict[str, str]]) -> None:
+        """记录一条指令的处理结果，instance为None表示生成失败或被过滤"""
+        self._write({"type": "instance", "iteration": iteration, "index": index, "instance": instance})
+
+    def commit(self, iteration: int, offset: int, total: int) -> None:
+        """记录一轮迭代已完整写入数据池"""
+        self._write({
+            "type": "commit",
+            "iteration": iteration,
+            "offset": offset,
+            "total": total,
+            "rng_state": get_rng_state(),
+        }, sync=True)
+
+    def finish(self) -> None:
+        self._write({"type": "finish"}, sync=True)
+
+    def close(self) -> None:
+        self._sink.close()
@@ -0,0 +1,192 @@
+import json
+import os
+from typing import List, Dict, Any, Iterator
+
+
+def atomic_write_json(data: Any, file_path: str) -> None:
+    """原子写入JSON文件：先写临时文件再替换，崩溃时不会留下半个文件"""
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def iter_jsonl(file_path: str, start_offset: int = 0, end_offset: int = None) -> Iterator[Dict[str, Any]]:
+    """逐行读取JSONL文件
+
+    Args:
+        file_path: JSONL文件路径
+        start_offset: 起始字节偏移
+        end_offset: 结束字节偏移（不含），None表示读到文件末尾
+
+    Yields:
+        每行解析出的记录，末尾不完整的行会被忽略
+    """
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, 'rb') as f:
+        f.seek(start_offset)
+        position = start_offset
+        for line in f:
+            position += len(line)
+            if end_offset is not None and position > end_offset:
+                break
+            if not line.endswith(b"\n"):
+                # 写入中途崩溃留下的半行
+                break
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class JsonlSink:
+    """只追加的JSONL写入器
+
+    每次write把所有记录编码后一次性写入并刷新，文件中只会出现完整的行；
+    打开时会截掉上次崩溃遗留的不完整尾行。
+    """
+
+    def __init__(self, file_path: str, truncate: bool = False):
+        """
+        Args:
+            file_path: JSONL文件路径
+            truncate: 是否清空已有内容
+        """
+        self.file_path = file_path
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if truncate or not os.path.exists(file_path):
+            open(file_path, 'wb').close()
+        self._repair()
+        self._file = open(file_path, 'ab')
+        self.count = 0
+
+    def _repair(self) -> None:
+        """截断文件末尾不完整的行"""
+        with open(self.file_path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            # 从末尾向前找到最后一个换行符
+            position = size
+            while position > 0:
+                step = min(65536, position)
+                f.seek(position - step)
+                chunk = f.read(step)
+                newline = chunk.rfind(b"\n")
+                if newline >= 0:
+                    last_complete = position - step + newline + 1
+                    break
+                position -= step
+            else:
+                last_complete = 0
+            if last_complete < size:
+                f.truncate(last_complete)
+
+    @property
+    def offset(self) -> int:
+        """当前文件末尾的字节偏移"""
+        return self._file.tell()
+
+    def write(self, records: List[Dict[str, Any]]) -> int:
+        """追加记录
+
+        Args:
+            records: 要追加的记录
+
+        Returns:
+            写入的记录数
+        """
+        if not records:
+            return 0
+        payload = b"".join(
+            (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8') for record in records
+        )
+        self._file.write(payload)
+        self._file.flush()
+        self.count += len(records)
+        return len(records)
+
+    def sync(self) -> None:
+        """将已写入的数据落盘"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def truncate(self, offset: int) -> None:
+        """回滚到指定字节偏移（用于丢弃未提交的记录）"""
+        self._file.flush()
+        self._file.truncate(offset)
+        self._file.seek(offset)
+
+    def write_manifest(self, manifest_path: str, start_offset: int, count: int, **extra) -> Dict[str, Any]:
+        """落盘并写入本批记录的清单
+
+        Args:
+            manifest_path: 清单文件路径
+            start_offset: 本批记录的起始字节偏移
+            count: 本批记录数
+            **extra: 额外写入清单的字段（如迭代序号、累计条数）
+
+        Returns:
+            清单内容
+        """
+        self.sync()
+        manifest = {
+            "file": os.path.basename(self.file_path),
+            "start_offset": start_offset,
+            "end_offset": self.offset,
+            "count": count,
+        }
+        manifest.update(extra)
+        atomic_write_json(manifest, manifest_path)
+        return manifest
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class OrderedWriter:
+    """按序号顺序写入乱序完成的结果：只有连续前缀全部完成后才追加到JsonlSink"""
+
+    def __init__(self, sink: JsonlSink):
+        self.sink = sink
+        self.next_index = 0
+        self._pending: Dict[int, Any] = {}
+
+    def put(self, index: int, record: Dict[str, Any] = None) -> int:
+        """提交序号为index的结果，record为None表示该序号没有有效记录
+
+        Returns:
+            本次写入的记录数
+        """
+        self._pending[index] = record
+        ready = []
+        while self.next_index in self._pending:
+            record = self._pending.pop(self.next_index)
+            if record is not None:
+                ready.append(record)
+            self.next_index += 1
+        return self.sink.write(ready)
+
+
+def iter_manifest_records(manifest_path: str) -> Iterator[Dict[str, Any]]:
+    """读取清单所描述的那一批记录"""
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    data_path = os.path.join(os.path.dirname(manifest_path), manifest["file"])
+    yield from iter_jsonl(data_path, manifest["start_offset"], manifest["end_offset"])
@@ -0,0 +1,140 @@
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from .metrics import metrics
+from .ratelimit import estimate_tokens
+
+# 估算提示词token数时为聊天消息格式预留的token
+MESSAGE_OVERHEAD_TOKENS = 8
+# 提示词token数直方图的桶上界
+TOKEN_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _load_encoding(tokenizer: str, model: str):
+    """加载tiktoken编码，未安装tiktoken或编码不可用时返回None"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        if tokenizer != "auto":
+            return tiktoken.get_encoding(tokenizer)
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            # 非OpenAI模型没有对应的编码，用cl100k_base近似
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"加载tiktoken编码失败: {e}，改用估算的token数")
+        return None
+
+
+def get_token_counter(tokenizer: str = "auto", model: str = "") -> Callable[[str], int]:
+    """获取本地计算token数的函数
+
+    Args:
+        tokenizer: "auto"按模型选择tiktoken编码（未安装tiktoken时估算），"estimate"只估算，
+            其他值视为tiktoken编码名称（如"cl100k_base"）
+        model: 模型名称
+
+    Returns:
+        输入文本、返回token数的函数，同一进程内按(tokenizer, model)复用
+    """
+    if tokenizer == "estimate":
+        return estimate_tokens
+    key = (tokenizer, model)
+    with _encodings_lock:
+        if key not in _encodings:
+            _encodings[key] = _load_encoding(tokenizer, model)
+        encoding = _encodings[key]
+    if encoding is None:
+        return estimate_tokens
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+class PromptBudget:
+    """按模型上下文长度分配提示词和输出的token预算
+
+    提示词token数与max_tokens之和不超过context_window（为0时不限制）。种子示例放不下时从末尾开始去掉，
+    max_tokens放不下时按剩余空间缩小。tiktoken在第一次计数时才导入。
+    """
+
+    def __init__(self, config):
+        self.context_window = config.context_window
+        self.max_tokens_limit = config.max_tokens_limit
+        self.tokenizer = config.tokenizer
+        self.model = config.model
+        self._count = None
+
+    def count(self, text: str) -> int:
+        """文本的token数"""
+        if self._count is None:
+            self._count = get_token_counter(self.tokenizer, self.model)
+        return self._count(text)
+
+    def prompt_tokens(self, prompt: str) -> int:
+        """提示词作为一条用户消息的token数"""
+        return self.count(prompt) + MESSAGE_OVERHEAD_TOKENS
+
+    def fit_examples(self, render: Callable[[List[str]], str], examples: List[str],
+                     max_tokens: int, kind: str) -> Tuple[str, int]:
+        """在上下文预算内放入尽量多的示例
+
+        Args:
+            render: 由示例列表构建提示词的函数
+            examples: 按优先级排列的示例
+            max_tokens: 为输出预留的token数
+            kind: 请求类型，用于指标标签
+
+        Returns:
+            (提示词, 输出的max_tokens)
+        """
+        prompt = render(examples)
+        if not self.context_window:
+            return prompt, max_tokens
+        budget = self.context_window - max_tokens
+        used = self.prompt_tokens(prompt)
+        if used > budget and examples:
+            # 各示例的token数近似可加，按示例逐个扣减，只重新计数一次
+            sizes = [self.count(example) + 2 for example in examples]
+            kept = len(examples)
+            # 至少保留一个示例，仍放不下时缩小max_tokens
+            while kept > 1 and used > budget:
+                kept -= 1
+                used -= sizes[kept]
+            metrics.inc("prompt_examples_trimmed_total", len(examples) - kept, kind=kind)
+            prompt = render(examples[:kept])
+            used = self.prompt_tokens(prompt)
+        metrics.observe("prompt_tokens", used, buckets=TOKEN_BUCKETS, kind=kind)
+        return prompt, self._fit_output(used, max_tokens, kind)
+
+    def max_tokens_for(self, prompt: str, max_tokens: int, kind: str) -> int:
+        """提示词不可裁剪时，返回上下文中放得下的max_tokens"""
+        if not self.context_window:
+            return max_tokens
+        used = self.prompt_tokens(prompt)
+        metrics.observe("prompt_tokens", used, buckets=TOKEN_BUCKETS, kind=kind)
+        return self._fit_output(used, max_tokens, kind)
+
+    def grow_max_tokens(self, prompt: str, max_tokens: int) -> Optional[int]:
+        """输出因长度被截断后重新请求时的max_tokens：加倍，但不超过max_tokens_limit和剩余上下文
+
+        Returns:
+            新的max_tokens，已无法增大时返回None
+        """
+        limit = self.max_tokens_limit or max_tokens * 2
+        if self.context_window:
+            limit = min(limit, self.context_window - self.prompt_tokens(prompt))
+        grown = min(max_tokens * 2, limit)
+        return grown if grown > max_tokens else None
+
+    def _fit_output(self, used: int, max_tokens: int, kind: str) -> int:
+        available = self.context_window - used
+        if available >= max_tokens:
+            return max_tokens
+        metrics.inc("prompt_output_budget_reduced_total", kind=kind)
+        # 至少保留一点输出空间，提示词本身超长时由服务端报错
+        return max(available, 16)
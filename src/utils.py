@@ -1,7 +1,14 @@
 import json
 import logging
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator
+
+from .metrics import metrics
+from .pool import iter_field
+from .storage import iter_jsonl
+
+# 流式读取JSON数组时每次读取的字符数
+READ_CHUNK_SIZE = 1 << 20
 
 def setup_logger():
     """设置日志"""
@@ -30,6 +37,74 @@ def load_json(file_path: str) -> List[Dict[str, Any]]:
     with open(file_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+def iter_json(file_path: str) -> Iterator[Dict[str, Any]]:
+    """流式读取JSON数组或JSONL文件，逐条返回记录而不一次性加载整个文件
+    
+    Args:
+        file_path: JSON（顶层为数组）或JSONL文件路径
+        
+    Yields:
+        数据记录
+    """
+    if not os.path.exists(file_path):
+        return
+    if file_path.endswith('.jsonl'):
+        yield from iter_jsonl(file_path)
+        return
+    
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = f.read(READ_CHUNK_SIZE).lstrip()
+        if not buffer:
+            return
+        if not buffer.startswith('['):
+            raise ValueError(f"{file_path} 的顶层不是JSON数组")
+        buffer = buffer[1:]
+        eof = False
+        while True:
+            buffer = buffer.lstrip()
+            if buffer.startswith(','):
+                buffer = buffer[1:].lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                if not buffer:
+                    raise json.JSONDecodeError("需要更多数据", buffer, 0)
+                record, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                buffer += chunk
+                continue
+            yield record
+            buffer = buffer[end:]
+
+def save_json_stream(records: Iterable[Dict[str, Any]], file_path: str) -> int:
+    """流式保存JSON数组文件，格式与save_json一致
+    
+    Args:
+        records: 记录迭代器
+        file_path: 保存路径
+        
+    Returns:
+        写入的记录数
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    
+    count = 0
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write("[")
+        for record in records:
+            f.write(",\n  " if count else "\n  ")
+            f.write(json.dumps(record, ensure_ascii=False, indent=2).replace("\n", "\n  "))
+            count += 1
+        f.write("\n]" if count else "]")
+    os.replace(tmp_path, file_path)
+    return count
+
 def save_json(data: List[Dict[str, Any]], file_path: str) -> None:
     """保存JSON文件
     
@@ -43,77 +118,73 @@ def save_json(data: List[Dict[str, Any]], file_path: str) -> None:
     with open(file_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
-def deduplicate_instructions(new_instructions: List[str], existing_instructions: List[str]) -> List[str]:
+def deduplicate_instructions(new_instructions: List[str], existing_instructions: List[str], index=None) -> List[str]:
     """指令去重
     
     Args:
         new_instructions: 新生成的指令列表
         existing_instructions: 已有的指令列表
+        index: 可选的InstructionIndex，传入时忽略existing_instructions，
+            直接使用索引判断重复（保留的指令会加入索引）
         
     Returns:
         去重后的新指令列表
     """
-    # 简单的文本匹配去重
+    if index is not None:
+        return index.filter(new_instructions)
+    
+    # 简单的文本匹配去重（哈希集合，O(1)查询）
     unique_instructions = []
-    existing_lower = [inst.lower() for inst in existing_instructions]
+    existing_lower = {inst.lower() for inst in existing_instructions}
     
     for inst in new_instructions:
         if inst.lower() not in existing_lower:
             unique_instructions.append(inst)
-            existing_lower.append(inst.lower())
+            existing_lower.add(inst.lower())
     
     return unique_instructions
 
-def semantic_deduplicate(new_data: List[Dict[str, Any]], pool: List[Dict[str, Any]], threshold: float = 0.8):
+def semantic_deduplicate(new_data: List[Dict[str, Any]], pool: List[Dict[str, Any]], threshold: float = 0.8, index=None,
+                         add: bool = None):
     """语义去重
     
     Args:
         new_data: 新数据
         pool: 已有数据池
         threshold: 相似度阈值
+        index: 可选的EmbeddingIndex。跨迭代传入同一个索引时只编码数据池新增的部分，
+            保留的数据会加入索引，调用方应将返回结果全部加入数据池
+        add: 是否将保留的数据加入index，None表示传入index时加入。返回结果不会全部进入
+            数据池时（如指令还要经过实例生成和过滤）应传False，索引在下次sync时补齐
         
     Returns:
-        去重后的新数据
+        去重后的新数据（同时去除批次内彼此相似的数据）
     """
     try:
-        from sentence_transformers import SentenceTransformer
-        import numpy as np
-        
-        # 加载模型
-        model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-        
-        # 提取指令
-        pool_instructions = [d["instruction"] for d in pool]
-        new_instructions = [d["instruction"] for d in new_data]
-        
-        # 计算嵌入
-        pool_embeddings = model.encode(pool_instructions)
-        new_embeddings = model.encode(new_instructions)
+        from .embedding import EmbeddingIndex
         
-        # 计算相似度并过滤
-        unique_data = []
-        for i, new_item in enumerate(new_data):
-            # 计算与池中所有指令的相似度
-            similarities = np.dot(new_embeddings[i], pool_embeddings.T) / \
-                          (np.linalg.norm(new_embeddings[i]) * np.linalg.norm(pool_embeddings, axis=1))
-            
-            # 如果最大相似度低于阈值，则认为是唯一的
-            if np.max(similarities) < threshold:
-                unique_data.append(new_item)
+        persistent = index is not None
+        if index is None:
+            index = EmbeddingIndex()
         
-        return unique_data
+        # 只编码尚未索引的池数据，再批量计算相似度
+        index.sync(pool)
+        unique_data = index.deduplicate(new_data, threshold, add=persistent if add is None else add)
     except ImportError:
         print("警告: sentence-transformers未安装，使用简单文本匹配去重")
-        return deduplicate_instructions_dict(new_data, pool)
+        unique_data = deduplicate_instructions_dict(new_data, pool)
+    metrics.inc("dedup_checked_total", len(new_data), stage="semantic")
+    metrics.inc("dedup_dropped_total", len(new_data) - len(unique_data), stage="semantic")
+    return unique_data
 
 def deduplicate_instructions_dict(new_data: List[Dict[str, Any]], pool: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """基于字典的指令去重"""
     unique_data = []
-    pool_instructions = [d["instruction"].lower() for d in pool]
+    pool_instructions = {text.lower() for text in iter_field(pool, "instruction")}
     
     for item in new_data:
         if item["instruction"].lower() not in pool_instructions:
             unique_data.append(item)
-            pool_instructions.append(item["instruction"].lower())
+            pool_instructions.add(item["instruction"].lower())
     
     return unique_data
\ No newline at end of file
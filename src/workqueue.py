@@ -0,0 +1,258 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Dict, Any, Optional, Tuple
+
+from .config import Config
+from .filter import DataFilter
+from .generator import InstanceGenerator
+
+# 任务状态
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+
+
+class WorkQueue:
+    """基于SQLite的实例生成任务队列，供协调进程和多个worker进程共享
+
+    协调进程按迭代写入指令，worker成批领取任务并获得有期限的租约，完成后写回结果。
+    租约过期的任务（worker崩溃或失联）会被其他worker重新领取；worker每写回一条结果
+    都会顺带续期自己手上其余任务的租约。同一任务领取超过max_attempts次后记为失败。
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 120, max_attempts: int = 3):
+        """
+        Args:
+            path: SQLite文件路径（多台机器共享时需放在支持文件锁的共享存储上）
+            lease_seconds: 租约有效期（秒）
+            max_attempts: 每个任务最多被领取的次数
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "iteration INTEGER NOT NULL, idx INTEGER NOT NULL, instruction TEXT NOT NULL, "
+            "status TEXT NOT NULL, worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "result TEXT, rejected TEXT, PRIMARY KEY (iteration, idx))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, lease_until)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    @classmethod
+    def from_config(cls, path: str, config) -> "WorkQueue":
+        """根据配置创建队列"""
+        return cls(path, lease_seconds=config.queue_lease_seconds, max_attempts=config.queue_max_attempts)
+
+    def _transaction(self, func):
+        """在写事务中执行func(conn)，BEGIN IMMEDIATE保证多进程领取任务互斥"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def reset(self) -> None:
+        """清空所有任务（开始新的运行）"""
+        def _reset(conn):
+            conn.execute("DELETE FROM tasks")
+            conn.execute("DELETE FROM meta")
+        self._transaction(_reset)
+
+    def enqueue(self, iteration: int, instructions: List[str]) -> None:
+        """写入一轮的指令，已存在的任务（断点恢复时）保持不变"""
+        self._transaction(lambda conn: conn.executemany(
+            "INSERT OR IGNORE INTO tasks (iteration, idx, instruction, status) VALUES (?, ?, ?, ?)",
+            [(iteration, idx, instruction, PENDING) for idx, instruction in enumerate(instructions)]
+        ))
+
+    def claim(self, worker: str, limit: int) -> List[Tuple[int, int, str]]:
+        """领取最多limit个待处理或租约已过期的任务
+
+        Returns:
+            (迭代序号, 指令下标, 指令) 列表
+        """
+        def _claim(conn):
+            now = time.time()
+            # 反复过期的任务不再分配
+            conn.execute(
+                "UPDATE tasks SET status = ?, worker = NULL, result = NULL "
+                "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (DONE, LEASED, now, self.max_attempts)
+            )
+            rows = conn.execute(
+                "SELECT iteration, idx, instruction FROM tasks "
+                "WHERE status = ? OR (status = ? AND lease_until < ?) "
+                "ORDER BY iteration, idx LIMIT ?",
+                (PENDING, LEASED, now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE iteration = ? AND idx = ?",
+                [(LEASED, worker, now + self.lease_seconds, iteration, idx) for iteration, idx, _ in rows]
+            )
+            return rows
+        return self._transaction(_claim)
+
+    def complete(self, worker: str, iteration: int, idx: int, instance: Optional[Dict[str, str]],
+                 rejected: str = None) -> bool:
+        """写回一个任务的结果，并续期该worker其余任务的租约
+
+        Args:
+            worker: worker标识
+            iteration: 迭代序号
+            idx: 指令下标
+            instance: 有效实例，生成失败或被过滤时为None
+            rejected: 被过滤时未通过的规则名称
+
+        Returns:
+            结果是否被采用（任务已被其他worker完成时为False）
+        """
+        def _complete(conn):
+            cursor = conn.execute(
+                "UPDATE tasks SET status = ?, result = ?, rejected = ?, worker = ? "
+                "WHERE iteration = ? AND idx = ? AND status != ?",
+                (DONE, json.dumps(instance, ensure_ascii=False) if instance is not None else None,
+                 rejected, worker, iteration, idx, DONE)
+            )
+            conn.execute(
+                "UPDATE tasks SET lease_until = ? WHERE worker = ? AND status = ?",
+                (time.time() + self.lease_seconds, worker, LEASED)
+            )
+            return cursor.rowcount > 0
+        return self._transaction(_complete)
+
+    def fetch_done(self, iteration: int, exclude: set = ()) -> List[Tuple[int, Optional[Dict[str, str]], Optional[str]]]:
+        """读取一轮中已完成的任务
+
+        Args:
+            iteration: 迭代序号
+            exclude: 调用方已读取过的指令下标
+
+        Returns:
+            (指令下标, 实例或None, 未通过的规则名称) 列表
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, result, rejected FROM tasks WHERE iteration = ? AND status = ?",
+                (iteration, DONE)
+            ).fetchall()
+        return [
+            (idx, json.loads(result) if result is not None else None, rejected)
+            for idx, result, rejected in rows if idx not in exclude
+        ]
+
+    def progress(self, iteration: int) -> Dict[str, int]:
+        """一轮任务各状态的数量"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM tasks WHERE iteration = ? GROUP BY status", (iteration,)
+            ).fetchall()
+        counts = {PENDING: 0, LEASED: 0, DONE: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def open_run(self) -> None:
+        """标记运行进行中（清除上次的结束标记）"""
+        self._transaction(lambda conn: conn.execute("DELETE FROM meta WHERE key = 'closed'"))
+
+    def close_run(self) -> None:
+        """标记运行结束，空闲的worker随后退出"""
+        self._transaction(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('closed', '1')"
+        ))
+
+    def is_closed(self) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'closed'").fetchone()
+        return row is not None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def run_worker(config, queue_path: str, worker_id: str = None, batch_size: int = None,
+               idle_timeout: float = 0) -> int:
+    """worker主循环：领取任务、生成实例、过滤并写回结果
+
+    Args:
+        config: 配置对象
+        queue_path: 任务队列文件路径
+        worker_id: worker标识，默认使用主机名和进程号
+        batch_size: 每次领取的任务数，默认使用配置中的queue_batch_size
+        idle_timeout: 连续空闲多少秒后退出，0表示一直等到协调进程标记运行结束
+
+    Returns:
+        本worker完成的任务数
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    batch_size = batch_size or config.queue_batch_size
+    queue = WorkQueue.from_config(queue_path, config)
+    data_filter = DataFilter(config)
+    instance_generator = InstanceGenerator(config, data_filter)
+
+    completed = 0
+    idle_since = time.monotonic()
+    try:
+        while True:
+            tasks = queue.claim(worker_id, batch_size)
+            if not tasks:
+                if queue.is_closed():
+                    break
+                if idle_timeout and time.monotonic() - idle_since > idle_timeout:
+                    break
+                time.sleep(config.queue_poll_interval)
+                continue
+
+            for pos, instance in instance_generator.iter_generate([instruction for _, _, instruction in tasks]):
+                iteration, idx, _ = tasks[pos]
+                rejected = None
+                if instance is not None:
+                    rejected = data_filter.check(instance)
+                    if rejected is not None:
+                        instance = None
+                queue.complete(worker_id, iteration, idx, instance, rejected)
+                completed += 1
+            idle_since = time.monotonic()
+    finally:
+        queue.close()
+    print(f"worker {worker_id} 完成 {completed} 个任务")
+    return completed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分布式实例生成worker')
+    parser.add_argument('queue', type=str, help='任务队列SQLite文件（与协调进程的--work_queue相同）')
+    parser.add_argument('--config', type=str, default='config/default.json', help='配置文件路径')
+    parser.add_argument('--max_concurrency', type=int, default=None, help='本worker的最大并发请求数（覆盖配置文件）')
+    parser.add_argument('--batch_size', type=int, default=None, help='每次领取的任务数')
+    parser.add_argument('--idle_timeout', type=float, default=0, help='空闲多少秒后退出，0表示等到运行结束')
+    args = parser.parse_args()
+
+    config = Config(args.config)
+    if args.max_concurrency is not None:
+        config.max_concurrency = args.max_concurrency
+    run_worker(config, args.queue, batch_size=args.batch_size, idle_timeout=args.idle_timeout)
+
+
+if __name__ == "__main__":
+    main()